@@ -0,0 +1,142 @@
+import asyncio
+import json
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from django_rq.queues import get_connection
+
+from rqworkers.progress import OPTIMIZATION_CHANNEL_PATTERNS, OPTIMIZATION_PROGRESS_KEY, OPTIMIZATION_SCENE_CHANNEL, \
+    get_optimization_progress
+
+logger = logging.getLogger(__name__)
+
+EVENT_STREAM_PATH = re.compile(
+    r'^/api/(?P<resource>transport_networks|scenes)/(?P<public_id>[0-9a-fA-F-]{36})/events/?$')
+
+
+class OptimizationEventBroker:
+    """
+    One redis subscription per process shared by every open stream. A thread reads pub/sub messages published by
+    optimization jobs and hands them to the asyncio queue of each listener of the channel.
+    """
+
+    def __init__(self, connection_factory=get_connection):
+        self.connection_factory = connection_factory
+        # channel -> set of (event loop, queue)
+        self.listeners = dict()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def subscribe(self, channel, loop):
+        queue = asyncio.Queue(maxsize=settings.OPTIMIZATION_EVENT_QUEUE_SIZE)
+        with self.lock:
+            self.listeners.setdefault(channel, set()).add((loop, queue))
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._listen, name='optimization-event-broker', daemon=True)
+                self.thread.start()
+
+        return queue
+
+    def unsubscribe(self, channel, loop, queue):
+        with self.lock:
+            channel_listeners = self.listeners.get(channel, set())
+            channel_listeners.discard((loop, queue))
+            if not channel_listeners:
+                self.listeners.pop(channel, None)
+
+    def dispatch(self, channel, data):
+        with self.lock:
+            channel_listeners = list(self.listeners.get(channel, []))
+        for loop, queue in channel_listeners:
+            loop.call_soon_threadsafe(self._put, queue, data)
+
+    @staticmethod
+    def _put(queue, data):
+        # slow clients lose their oldest events instead of growing memory
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(data)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.connection_factory().pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(*OPTIMIZATION_CHANNEL_PATTERNS)
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    channel = message['channel']
+                    data = message['data']
+                    self.dispatch(channel.decode() if isinstance(channel, bytes) else channel,
+                                  data.decode() if isinstance(data, bytes) else data)
+            except Exception:
+                logger.exception('optimization event subscription failed, retrying')
+                time.sleep(1)
+
+
+broker = OptimizationEventBroker()
+
+
+def format_event(data):
+    return 'data: {0}\n\n'.format(data).encode('utf-8')
+
+
+async def optimization_event_stream(scope, receive, send):
+    """
+    ASGI application that streams optimization events of a transport network or every transport network of a scene
+    with server-sent events. Events come from redis pub/sub, so open streams do not query the database.
+    """
+    match = EVENT_STREAM_PATH.match(scope['path'])
+    public_id = match.group('public_id')
+    if match.group('resource') == 'transport_networks':
+        channel = OPTIMIZATION_PROGRESS_KEY.format(public_id)
+    else:
+        channel = OPTIMIZATION_SCENE_CHANNEL.format(public_id)
+
+    loop = asyncio.get_running_loop()
+    queue = broker.subscribe(channel, loop)
+    disconnect_task = None
+    event_task = None
+    try:
+        await send(dict(type='http.response.start', status=200, headers=[
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # nginx must not buffer the stream
+            (b'x-accel-buffering', b'no'),
+        ]))
+
+        if match.group('resource') == 'transport_networks':
+            # last known state, so clients do not wait for the next event
+            events = await loop.run_in_executor(None, get_optimization_progress, public_id,
+                                                broker.connection_factory())
+            if events:
+                await send(dict(type='http.response.body', body=format_event(json.dumps(events[-1])),
+                                more_body=True))
+
+        async def wait_for_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        disconnect_task = asyncio.ensure_future(wait_for_disconnect())
+        event_task = asyncio.ensure_future(queue.get())
+        while True:
+            done, _ = await asyncio.wait({disconnect_task, event_task}, return_when=asyncio.FIRST_COMPLETED,
+                                         timeout=settings.OPTIMIZATION_EVENT_KEEPALIVE)
+            if disconnect_task in done:
+                break
+            if event_task in done:
+                body = format_event(event_task.result())
+                event_task = asyncio.ensure_future(queue.get())
+            else:
+                # comments keep proxies from closing idle connections
+                body = b': keepalive\n\n'
+            await send(dict(type='http.response.body', body=body, more_body=True))
+    finally:
+        broker.unsubscribe(channel, loop, queue)
+        for task in [disconnect_task, event_task]:
+            if task is not None and not task.done():
+                task.cancel()
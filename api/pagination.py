@@ -0,0 +1,10 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CitySummaryPagination(CursorPagination):
+    """ cursor pagination keeps cost constant on deep pages, unlike offset pagination """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    # id breaks ties between cities created at the same time, otherwise they can be skipped or repeated
+    ordering = ('-created_at', '-id')
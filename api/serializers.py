@@ -1,18 +1,33 @@
 import logging
+import numbers
 
+import numpy as np
+from django.conf import settings
 from django.db import transaction, IntegrityError
 from rest_framework import serializers
-from sidermit.city import Graph, GraphContentFormat, Demand
+from sidermit.city import Graph, Demand
 from sidermit.exceptions import SIDERMITException
 from sidermit.publictransportsystem import TransportMode as SIDERMITTransportMode, Passenger as SIDERMITPassenger
 
-from api.utils import get_network_descriptor
+from storage.cache import sidermit_cache
 from storage.models import City, Scene, Passenger, TransportMode, OptimizationResultPerMode, OptimizationResult, \
-    TransportNetwork, Route, OptimizationResultPerRoute, OptimizationResultPerRouteDetail
+    TransportNetwork, Route, OptimizationResultPerRoute, OptimizationResultPerRouteDetail, ParameterSweep
+from storage.results import unpack_arc_loads
+from storage.sweeps import SWEEP_PASSENGER_FIELDS, SWEEP_TRANSPORT_MODE_FIELDS, get_sweep_points
 
 logger = logging.getLogger(__name__)
 
 
+class DemandMatrixField(serializers.ListField):
+    """ demand matrix is stored as numpy array but it is exposed as list of list """
+    child = serializers.ListField(child=serializers.FloatField())
+
+    def to_representation(self, data):
+        if isinstance(data, np.ndarray):
+            return data.tolist()
+        return super().to_representation(data)
+
+
 class PassengerSerializer(serializers.ModelSerializer):
 
     def validate(self, attrs):
@@ -192,50 +207,40 @@ class TransportNetworkSerializer(serializers.ModelSerializer):
         model = TransportNetwork
         fields = (
             'name', 'created_at', 'route_set', 'scene_public_id', 'public_id', 'optimization_status',
-            'optimization_ran_at', 'optimization_error_message')
-        read_only_fields = ['created_at', 'optimization_status', 'optimization_ran_at', 'optimization_error_message']
+            'optimization_ran_at', 'optimization_error_message', 'optimization_predicted_cost', 'optimization_queue')
+        read_only_fields = ['created_at', 'optimization_status', 'optimization_ran_at', 'optimization_error_message',
+                            'optimization_predicted_cost', 'optimization_queue']
 
 
 class BaseCitySerializer(serializers.ModelSerializer):
-    network_descriptor = serializers.SerializerMethodField()
-    demand_matrix_header = serializers.SerializerMethodField()
-
-    def get_network_descriptor(self, obj):
-        """
-        :return: list of nodes and edges based on parameters or graph variable
-        """
-        content = dict(nodes=[], edges=[])
-        try:
-            graph_obj = Graph.build_from_parameters(obj.n, obj.l, obj.g, obj.p, obj.etha, obj.etha_zone, obj.angles,
-                                                    obj.gi, obj.hi)
-        except (SIDERMITException, TypeError):
-            graph_obj = Graph.build_from_content(obj.graph, GraphContentFormat.PAJEK)
-
-        if graph_obj is not None:
-            content = get_network_descriptor(graph_obj)
+    demand_matrix = DemandMatrixField(allow_null=True, required=False)
+    # computed when city is saved
+    network_descriptor = serializers.JSONField(read_only=True)
+    demand_matrix_header = serializers.JSONField(read_only=True)
 
-        return content
 
-    def get_demand_matrix_header(self, obj):
-        content = []
-        try:
-            graph_obj = Graph.build_from_parameters(obj.n, obj.l, obj.g, obj.p, obj.etha, obj.etha_zone, obj.angles,
-                                                    obj.gi, obj.hi)
-        except (SIDERMITException, TypeError):
-            graph_obj = Graph.build_from_content(obj.graph, GraphContentFormat.PAJEK)
+class ShortCitySerializer(BaseCitySerializer):
+    class Meta:
+        model = City
+        fields = ('public_id', 'name', 'demand_matrix', 'n', 'y', 'a', 'alpha', 'beta', 'network_descriptor',
+                  'demand_matrix_header')
 
-        if graph_obj is not None:
-            for node_obj in graph_obj.get_nodes():
-                content.append(node_obj.name)
 
-        return content
+class CitySummarySerializer(serializers.ModelSerializer):
+    # annotated by CityViewSet.summary
+    scene_count = serializers.IntegerField(read_only=True)
+    transport_network_count = serializers.IntegerField(read_only=True)
+    optimization_status_count = serializers.SerializerMethodField()
+    last_optimization_ran_at = serializers.DateTimeField(read_only=True)
 
+    def get_optimization_status_count(self, obj):
+        return {status: getattr(obj, '{0}_count'.format(status)) for status, _ in TransportNetwork.status_choices}
 
-class ShortCitySerializer(BaseCitySerializer):
     class Meta:
         model = City
-        fields = ('public_id', 'name', 'demand_matrix', 'n', 'y', 'a', 'alpha', 'beta', 'network_descriptor',
-                  'demand_matrix_header')
+        fields = ('public_id', 'created_at', 'name', 'n', 'scene_count', 'transport_network_count',
+                  'optimization_status_count', 'last_optimization_ran_at')
+        read_only_fields = fields
 
 
 class SceneSerializer(serializers.ModelSerializer):
@@ -383,7 +388,7 @@ class CitySerializer(BaseCitySerializer):
                                                 validated_data.get('g'), validated_data.get('p'), etha, etha_zone,
                                                 angles, gi, hi)
 
-                Graph.build_from_content(validated_data['graph'], GraphContentFormat.PAJEK)
+                sidermit_cache.get_graph(validated_data['graph'])
             except SIDERMITException as e:
                 raise serializers.ValidationError(e)
 
@@ -395,8 +400,7 @@ class CitySerializer(BaseCitySerializer):
 
             try:
                 public_id = self.context['view'].kwargs['public_id']
-                graph_obj = Graph.build_from_content(City.objects.only('graph').get(public_id=public_id).graph,
-                                                     GraphContentFormat.PAJEK)
+                graph_obj = City.objects.only('graph').get(public_id=public_id).get_sidermit_graph()
                 if not all(key_exists):
                     # if all keys are not none, check values
                     Demand.build_from_parameters(graph_obj, validated_data.get('y'), validated_data.get('a'),
@@ -441,7 +445,8 @@ class CitySerializer(BaseCitySerializer):
 class OptimizationResultSerializer(serializers.ModelSerializer):
     class Meta:
         model = OptimizationResult
-        fields = ('vrc', 'co', 'ci', 'cu', 'tv', 'tw', 'ta', 't')
+        fields = ('vrc', 'co', 'ci', 'cu', 'tv', 'tw', 'ta', 't', 'solver_profile', 'deadline_reached',
+                  'iteration_number', 'saved_iteration_number')
 
 
 class OptimizationResultPerModeSerializer(serializers.ModelSerializer):
@@ -470,13 +475,20 @@ class OptimizationResultPerRouteDetailSerializer(serializers.ModelSerializer):
 
 class OptimizationResultPerRouteSerializer(serializers.ModelSerializer):
     route = serializers.SlugRelatedField(many=False, read_only=True, slug_field='name')
-    optimizationresultperroutedetail_set = OptimizationResultPerRouteDetailSerializer(many=True)
+    # packed arc loads are returned with the same format as rows
+    optimizationresultperroutedetail_set = serializers.SerializerMethodField()
 
     class Meta:
         model = OptimizationResultPerRoute
         fields = ('route', 'frequency', 'frequency_per_line', 'k', 'b', 'tc', 'co', 'lambda_min',
                   'optimizationresultperroutedetail_set')
 
+    def get_optimizationresultperroutedetail_set(self, obj):
+        if obj.arc_loads is not None:
+            return unpack_arc_loads(obj.arc_loads)
+        return OptimizationResultPerRouteDetailSerializer(obj.optimizationresultperroutedetail_set.all(),
+                                                          many=True).data
+
 
 class RecentOptimizationSerializer(serializers.ModelSerializer):
     network_name = serializers.CharField(read_only=True, source='name')
@@ -491,3 +503,106 @@ class RecentOptimizationSerializer(serializers.ModelSerializer):
         fields = (
             'optimization_status', 'network_name', 'scene_name', 'city_name', 'network_public_id', 'scene_public_id',
             'city_public_id')
+
+
+class ParameterSweepSerializer(serializers.ModelSerializer):
+    transport_network_public_id = serializers.UUIDField(write_only=True)
+
+    def validate_transport_network_public_id(self, value):
+        try:
+            transport_network_obj = TransportNetwork.objects.select_related('scene__passenger').prefetch_related(
+                'scene__transportmode_set').get(public_id=value)
+        except TransportNetwork.DoesNotExist:
+            raise serializers.ValidationError('Transport network does not exist')
+
+        return transport_network_obj
+
+    @staticmethod
+    def _validate_values(overrides, field_name_list, is_grid):
+        if not isinstance(overrides, dict):
+            raise serializers.ValidationError('Overrides have to be an object')
+        for field_name, value in overrides.items():
+            if field_name not in field_name_list:
+                raise serializers.ValidationError('Parameter "{0}" can not be modified'.format(field_name))
+            values = value if is_grid else [value]
+            if is_grid and (not isinstance(value, list) or len(value) == 0):
+                raise serializers.ValidationError('Parameter "{0}" needs a non empty list of values'.format(field_name))
+            if not all(isinstance(x, numbers.Number) and not isinstance(x, bool) for x in values):
+                raise serializers.ValidationError('Values of parameter "{0}" have to be numbers'.format(field_name))
+
+    def _validate_overrides(self, overrides, is_grid):
+        if not isinstance(overrides, dict) or not set(overrides.keys()).issubset({'passenger', 'transport_modes'}):
+            raise serializers.ValidationError('Overrides only accept keys "passenger" and "transport_modes"')
+        self._validate_values(overrides.get('passenger', {}), SWEEP_PASSENGER_FIELDS, is_grid)
+        transport_modes = overrides.get('transport_modes', {})
+        if not isinstance(transport_modes, dict):
+            raise serializers.ValidationError('Transport modes have to be an object')
+        for transport_mode_overrides in transport_modes.values():
+            self._validate_values(transport_mode_overrides, SWEEP_TRANSPORT_MODE_FIELDS, is_grid)
+
+    def validate_parameters(self, value):
+        if not isinstance(value, dict) or len(value) != 1 or list(value.keys())[0] not in ['grid', 'points']:
+            raise serializers.ValidationError('Parameters need key "grid" or key "points"')
+
+        if 'grid' in value:
+            self._validate_overrides(value['grid'], True)
+        else:
+            if not isinstance(value['points'], list) or len(value['points']) == 0:
+                raise serializers.ValidationError('Points have to be a non empty list')
+            for overrides in value['points']:
+                self._validate_overrides(overrides, False)
+
+        return value
+
+    def validate(self, attrs):
+        transport_network_obj = attrs['transport_network_public_id']
+        scene_obj = transport_network_obj.scene
+        try:
+            scene_obj.passenger
+        except Passenger.DoesNotExist:
+            raise serializers.ValidationError('Scene does not have passenger')
+        if not transport_network_obj.route_set.exists():
+            raise serializers.ValidationError('Transport network does not have routes')
+
+        point_list = get_sweep_points(attrs['parameters'])
+        if len(point_list) > settings.PARAMETER_SWEEP_MAX_POINTS:
+            raise serializers.ValidationError('Parameter sweep has {0} points, maximum is {1}'.format(
+                len(point_list), settings.PARAMETER_SWEEP_MAX_POINTS))
+
+        transport_mode_name_list = [transport_mode_obj.name for transport_mode_obj in
+                                    scene_obj.transportmode_set.all()]
+        for overrides in point_list:
+            for transport_mode_name in overrides.get('transport_modes', {}).keys():
+                if transport_mode_name not in transport_mode_name_list:
+                    raise serializers.ValidationError(
+                        'Transport mode "{0}" does not exist'.format(transport_mode_name))
+
+        attrs['point_number'] = len(point_list)
+
+        return attrs
+
+    def create(self, validated_data):
+        transport_network_obj = validated_data.pop('transport_network_public_id')
+
+        return ParameterSweep.objects.create(transport_network=transport_network_obj, **validated_data)
+
+    class Meta:
+        model = ParameterSweep
+        fields = ('public_id', 'created_at', 'transport_network_public_id', 'parameters', 'point_number', 'status',
+                  'ran_at', 'duration', 'error_message')
+        read_only_fields = ['public_id', 'created_at', 'point_number', 'status', 'ran_at', 'duration',
+                            'error_message']
+
+
+class SolverProfileSerializer(serializers.Serializer):
+    """ solver budget accepted by run optimization actions, given values replace values of profile """
+    solver_profile = serializers.ChoiceField(choices=list(settings.OPTIMIZER_SOLVER_PROFILES.keys()), required=False)
+    tolerance = serializers.FloatField(min_value=0, required=False)
+    max_number_of_iteration = serializers.IntegerField(min_value=1, required=False)
+    deadline = serializers.FloatField(min_value=1, required=False)
+
+    def validate_tolerance(self, value):
+        if value == 0:
+            raise serializers.ValidationError('Tolerance has to be greater than zero')
+
+        return value
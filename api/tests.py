@@ -1,19 +1,59 @@
+import asyncio
 import json
+import sys
+import threading
 import uuid
+from datetime import timedelta
 from unittest import mock
 
-from django.test import TestCase
+import numpy as np
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from django_rq.queues import get_connection
 from rest_framework import status
+from rq import Queue
+from rq.job import Job, JobStatus
+from rq.registry import FailedJobRegistry
+from rq.timeouts import JobTimeoutException
+from rq.worker import WorkerStatus
 from rest_framework.reverse import reverse
 from rest_framework.test import APIClient
 from sidermit.city import Graph, GraphContentFormat, Demand
+from sidermit.exceptions import SIDERMITException
+from sidermit.publictransportsystem import TransportMode as SidermitTransportMode
 
 from api.serializers import CitySerializer, SceneSerializer, TransportModeSerializer, \
     TransportNetworkOptimizationSerializer, TransportNetworkSerializer, RouteSerializer, \
     OptimizationResultPerRouteSerializer
+from api.events import OptimizationEventBroker
+from webapp.asgi import application
+from storage.cache import sidermit_cache, get_graph_fingerprint
+from rqworkers.jobs import optimize_transport_network, run_parameter_sweep
+from rqworkers.optimization import get_solver_parameters, get_optimizer_parameters, run_network_optimization
+from rqworkers.optimizerWorker import InProcessOptimizerWorker, preload_modules, PRELOADED_MODULES, \
+    register_job_worker, get_job_workers
+from rqworkers.heartbeat import OptimizationHeartbeat, get_heartbeats
+from rqworkers.reaper import reap_orphaned_optimizations, reap_failed_parameter_sweeps, \
+    ORPHANED_OPTIMIZATION_ERROR_MESSAGE, FAILED_SWEEP_CHUNK_ERROR_MESSAGE
+from rqworkers.pool import OptimizerWorkerPool, get_desired_worker_number
+from rqworkers.cost import estimate_optimization_cost, get_queue_lane
+from rqworkers.submission import enqueue_optimization, submit_optimization, claim_transport_network, \
+    OptimizationAlreadySubmitted
+from rqworkers.progress import ProgressReporter, PHASE_STATUS, publish_status_change
+from storage.cloning import clone_scene, clone_transport_network
+from storage.results import save_optimization_results, get_optimization_input_fingerprint, \
+    get_warm_start_frequencies, save_optimization_checkpoint, get_optimization_checkpoint, \
+    delete_optimization_checkpoints, pack_arc_loads, unpack_arc_loads
+from storage.utils import get_network_descriptor, round_demand_matrix
 from storage.models import City, Scene, Passenger, TransportMode, TransportNetwork, OptimizationResult, \
-    OptimizationResultPerMode, Route, OptimizationResultPerRoute, OptimizationResultPerRouteDetail
+    OptimizationResultPerMode, Route, OptimizationResultPerRoute, OptimizationResultPerRouteDetail, ParameterSweep, \
+    ParameterSweepResult, OptimizationCheckpoint
 
 
 class BaseTestCase(TestCase):
@@ -103,6 +143,11 @@ class BaseTestCase(TestCase):
 
         return self._make_request(client, self.GET_REQUEST, url, data, status_code, format='json')
 
+    def cities_summary(self, client, data, status_code=status.HTTP_200_OK):
+        url = reverse('cities-summary')
+
+        return self._make_request(client, self.GET_REQUEST, url, data, status_code, format='json')
+
     def cities_create(self, client, data, status_code=status.HTTP_201_CREATED):
         url = reverse('cities-list')
 
@@ -158,6 +203,11 @@ class BaseTestCase(TestCase):
 
         return self._make_request(client, self.POST_REQUEST, url, data, status_code, format='json')
 
+    def cities_build_matrix_from_uploaded_file_action(self, client, public_id, data, status_code=status.HTTP_200_OK):
+        url = reverse('cities-build-matrix-from-uploaded-file', kwargs=dict(public_id=public_id))
+
+        return self._make_request(client, self.POST_REQUEST, url, data, status_code, format='multipart')
+
     # scene helper
 
     def scenes_create(self, client, data, status_code=status.HTTP_201_CREATED):
@@ -195,6 +245,24 @@ class BaseTestCase(TestCase):
 
         return self._make_request(client, self.GET_REQUEST, url, data, status_code, format='json')
 
+    def scenes_run_optimization_action(self, client, public_id, status_code=status.HTTP_201_CREATED, **headers):
+        url = reverse('scenes-run-optimization', kwargs=dict(public_id=public_id))
+        data = dict()
+
+        return self._make_request(client, self.POST_REQUEST, url, data, status_code, format='json', **headers)
+
+    def scenes_cancel_optimization_action(self, client, public_id, status_code=status.HTTP_200_OK):
+        url = reverse('scenes-cancel-optimization', kwargs=dict(public_id=public_id))
+        data = dict()
+
+        return self._make_request(client, self.POST_REQUEST, url, data, status_code, format='json')
+
+    def scenes_optimization_group_action(self, client, public_id, group_id, status_code=status.HTTP_200_OK):
+        url = reverse('scenes-optimization-group', kwargs=dict(public_id=public_id, group_id=group_id))
+        data = dict()
+
+        return self._make_request(client, self.GET_REQUEST, url, data, status_code, format='json')
+
     # transport mode helpers
 
     def scenes_transportmode_create(self, client, scene_public_id, data, status_code=status.HTTP_201_CREATED):
@@ -272,11 +340,18 @@ class BaseTestCase(TestCase):
 
     # optimizations
 
-    def run_optimization(self, client, transport_network_public_id, status_code=status.HTTP_201_CREATED):
+    def run_optimization(self, client, transport_network_public_id, data=None, status_code=status.HTTP_201_CREATED,
+                         **headers):
         url = reverse('transport-networks-run-optimization', kwargs=dict(public_id=transport_network_public_id))
+        data = data or dict()
+
+        return self._make_request(client, self.POST_REQUEST, url, data, status_code, format='json', **headers)
+
+    def optimization_progress(self, client, transport_network_public_id, status_code=status.HTTP_200_OK):
+        url = reverse('transport-networks-progress', kwargs=dict(public_id=transport_network_public_id))
         data = dict()
 
-        return self._make_request(client, self.POST_REQUEST, url, data, status_code, format='json')
+        return self._make_request(client, self.GET_REQUEST, url, data, status_code, format='json')
 
     def cancel_optimization(self, client, transport_network_public_id, status_code=status.HTTP_200_OK):
         url = reverse('transport-networks-cancel-optimization', kwargs=dict(public_id=transport_network_public_id))
@@ -284,6 +359,19 @@ class BaseTestCase(TestCase):
 
         return self._make_request(client, self.POST_REQUEST, url, data, status_code, format='json')
 
+    # parameter sweeps
+
+    def parameter_sweeps_create(self, client, data, status_code=status.HTTP_201_CREATED):
+        url = reverse('parameter-sweeps-list')
+
+        return self._make_request(client, self.POST_REQUEST, url, data, status_code, format='json')
+
+    def parameter_sweeps_results_action(self, client, public_id, status_code=status.HTTP_200_OK):
+        url = reverse('parameter-sweeps-results', kwargs=dict(public_id=public_id))
+        data = dict()
+
+        return self._make_request(client, self.GET_REQUEST, url, data, status_code, format='json')
+
     # recent optimizations
 
     def recent_optimizations_list(self, client, status_code=status.HTTP_200_OK):
@@ -319,6 +407,58 @@ class CityAPITest(BaseTestCase):
 
         self.assertEqual(len(json_response), 1)
 
+    def test_retrieve_city_summary(self):
+        transport_network_obj = self.city_obj.scene_set.first().transportnetwork_set.first()
+        transport_network_obj.optimization_status = TransportNetwork.STATUS_FINISHED
+        transport_network_obj.optimization_ran_at = timezone.now()
+        transport_network_obj.save()
+
+        with self.assertNumQueries(1):
+            json_response = self.cities_summary(self.client, dict())
+
+        self.assertIsNone(json_response['next'])
+        self.assertEqual(len(json_response['results']), 1)
+        city_data = json_response['results'][0]
+        self.assertEqual(city_data['public_id'], str(self.city_obj.public_id))
+        self.assertEqual(city_data['scene_count'], 1)
+        self.assertEqual(city_data['transport_network_count'], 2)
+        self.assertDictEqual(city_data['optimization_status_count'],
+                             dict(queued=0, processing=0, finished=1, error=0))
+        self.assertIsNotNone(city_data['last_optimization_ran_at'])
+        self.assertNotIn('scene_set', city_data)
+        self.assertNotIn('network_descriptor', city_data)
+
+    def test_retrieve_city_summary_with_cursor(self):
+        self.create_data(city_number=2)
+
+        with self.assertNumQueries(1):
+            json_response = self.cities_summary(self.client, dict(page_size=2))
+
+        self.assertEqual(len(json_response['results']), 2)
+        self.assertIsNotNone(json_response['next'])
+        self.assertEqual(json_response['results'][0]['scene_count'], 0)
+
+        with self.assertNumQueries(1):
+            json_response = self.client.get(json_response['next']).json()
+
+        self.assertEqual(len(json_response['results']), 1)
+        self.assertIsNone(json_response['next'])
+        self.assertEqual(json_response['results'][0]['public_id'], str(self.city_obj.public_id))
+
+    def test_retrieve_city_summary_with_cursor_and_same_created_at(self):
+        self.create_data(city_number=4)
+        City.objects.update(created_at=self.city_obj.created_at)
+
+        public_id_list = []
+        json_response = self.cities_summary(self.client, dict(page_size=2))
+        public_id_list.extend(city_data['public_id'] for city_data in json_response['results'])
+        while json_response['next'] is not None:
+            json_response = self.client.get(json_response['next']).json()
+            public_id_list.extend(city_data['public_id'] for city_data in json_response['results'])
+
+        self.assertListEqual(public_id_list, [str(public_id) for public_id in
+                                              City.objects.order_by('-id').values_list('public_id', flat=True)])
+
     def test_retrieve_city_with_public_id(self):
         with self.assertNumQueries(7):
             json_response = self.cities_retrieve(self.client, self.city_obj.public_id)
@@ -385,7 +525,7 @@ class CityAPITest(BaseTestCase):
         new_city_name = 'name2'
         graph_content = Graph.build_from_parameters(4, 1, 1, 1).export_graph(GraphContentFormat.PAJEK)
         new_data = dict(name=new_city_name, graph=graph_content, n=4, p=1, l=1, g=1, step=CitySerializer.STEP_1)
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(6):
             json_response = self.cities_update(self.client, self.city_obj.public_id, new_data,
                                                status_code=status.HTTP_400_BAD_REQUEST)
 
@@ -398,7 +538,7 @@ class CityAPITest(BaseTestCase):
         new_city_name = 'name2'
         graph_content = Graph.build_from_parameters(4, 1, 1, 1).export_graph(GraphContentFormat.PAJEK)
         new_data = dict(name=new_city_name, graph=graph_content, n=1, p=1, l=1, g=1, step=CitySerializer.STEP_1)
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(5):
             json_response = self.cities_update(self.client, self.city_obj.public_id, new_data)
 
         self.city_obj.refresh_from_db()
@@ -410,7 +550,7 @@ class CityAPITest(BaseTestCase):
 
         new_data = dict(demand_matrix=self.city_obj.demand_matrix, y=1, a=1, alpha=0.1, beta=0.2,
                         step=CitySerializer.STEP_2)
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(6):
             json_response = self.cities_partial_update(self.client, self.city_obj.public_id, new_data)
 
         self.city_obj.refresh_from_db()
@@ -421,7 +561,7 @@ class CityAPITest(BaseTestCase):
 
         new_city_name = 'name2'
         new_data = dict(name=new_city_name, n=7)
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(5):
             json_response = self.cities_partial_update(self.client, self.city_obj.public_id, new_data)
 
         self.city_obj.refresh_from_db()
@@ -434,18 +574,90 @@ class CityAPITest(BaseTestCase):
         self.assertIsNone(self.city_obj.beta)
 
     def test_delete_city(self):
-        with self.assertNumQueries(19):
+        with self.assertNumQueries(18):
             self.cities_delete(self.client, self.city_obj.public_id)
 
         self.assertEqual(City.objects.count(), 0)
 
     def test_duplicate_city(self):
-        with self.assertNumQueries(22):
+        with self.assertNumQueries(19):
             json_response = self.cities_duplicate_action(self.client, self.city_obj.public_id)
 
         self.assertEqual(City.objects.count(), 2)
         self.assertDictEqual(json_response, CitySerializer(City.objects.order_by('-created_at').first()).data)
 
+    def test_duplicate_city_with_many_routes_uses_constant_number_of_queries(self):
+        city_obj = self.create_data(city_number=1, scene_number=1, passenger=True, transport_mode_number=2,
+                                    transport_network_number=50)[0]
+        transport_mode_obj_list = list(TransportMode.objects.filter(scene__city=city_obj))
+        route_obj_list = []
+        for transport_network_obj in TransportNetwork.objects.filter(scene__city=city_obj):
+            for i in range(100):
+                route_obj_list.append(Route(transport_network=transport_network_obj, name='route {0}'.format(i),
+                                            transport_mode=transport_mode_obj_list[i % 2], nodes_sequence_i='1,2',
+                                            stops_sequence_i='1,2', nodes_sequence_r='2,1', stops_sequence_r='2,1',
+                                            type=Route.CUSTOM))
+        Route.objects.bulk_create(route_obj_list)
+
+        small_city_obj = self.create_data(city_number=1, scene_number=1, passenger=True, transport_mode_number=1,
+                                          transport_network_number=1, route_number=1)[0]
+        with CaptureQueriesContext(connection) as small_city_queries:
+            self.cities_duplicate_action(self.client, small_city_obj.public_id)
+
+        with self.assertNumQueries(len(small_city_queries)):
+            json_response = self.cities_duplicate_action(self.client, city_obj.public_id)
+
+        new_city_obj = City.objects.get(public_id=json_response['public_id'])
+        self.assertEqual(TransportNetwork.objects.filter(scene__city=new_city_obj).count(), 50)
+        self.assertEqual(Route.objects.filter(transport_network__scene__city=new_city_obj).count(), 5000)
+        # routes point to transport modes of the new scene
+        self.assertFalse(Route.objects.filter(transport_network__scene__city=new_city_obj).exclude(
+            transport_mode__scene__city=new_city_obj).exists())
+        self.assertEqual(Passenger.objects.filter(scene__city=new_city_obj).count(), 1)
+
+    def test_graph_data_is_computed_on_save(self):
+        graph_obj = Graph.build_from_parameters(4, 2, 3, 4)
+        self.assertEqual(self.city_obj.graph_fingerprint, get_graph_fingerprint(self.city_obj.graph))
+        self.assertDictEqual(self.city_obj.network_descriptor, get_network_descriptor(graph_obj))
+        self.assertListEqual(self.city_obj.demand_matrix_header, [node.name for node in graph_obj.get_nodes()])
+
+        # graph is not rebuilt to serialize city
+        with mock.patch('storage.utils.build_city_graph') as mock_build_city_graph:
+            CitySerializer(City.objects.get(pk=self.city_obj.pk)).data
+            city_obj = City.objects.get(pk=self.city_obj.pk)
+            city_obj.name = 'new name'
+            city_obj.save()
+        mock_build_city_graph.assert_not_called()
+
+        city_obj.n = 2
+        city_obj.save()
+        city_obj.refresh_from_db()
+        self.assertEqual(len(city_obj.network_descriptor['nodes']), 5)
+        self.assertEqual(len(city_obj.demand_matrix_header), 5)
+
+    def test_demand_matrix_is_stored_as_numpy_array(self):
+        city_obj = City.objects.get(pk=self.city_obj.pk)
+
+        self.assertIsInstance(city_obj.demand_matrix, np.ndarray)
+        self.assertEqual(city_obj.demand_matrix.dtype, np.float64)
+        self.assertFalse(city_obj.demand_matrix.flags.writeable)
+        self.assertListEqual(city_obj.demand_matrix.tolist(), self.city_obj.demand_matrix)
+        self.assertListEqual(CitySerializer(city_obj).data['demand_matrix'], self.city_obj.demand_matrix)
+
+        city_obj.demand_matrix = np.zeros((9, 9))
+        city_obj.save()
+        city_obj.refresh_from_db()
+        self.assertTrue(np.array_equal(city_obj.demand_matrix, np.zeros((9, 9))))
+
+    def test_round_demand_matrix_like_python_round(self):
+        # halfway values in decimal, in binary and values that become halfway when they are scaled
+        value_list = [0.125, 0.375, 2.675, 1.005, 0.045, 12.5, 0.994, 0.995, 3.14159] + \
+                     [i / 1000 for i in range(10000)]
+        matrix = round_demand_matrix(np.array(value_list).reshape((-1, 1)))
+
+        self.assertListEqual(matrix.ravel().tolist(), [round(value, 2) for value in value_list])
+        self.assertListEqual(matrix[:3].ravel().tolist(), [0.12, 0.38, 2.67])
+
     def test_build_graph_file_city(self):
         data = dict(n=1, l=1.0, p=1.0, g=1.0)
         with self.assertNumQueries(0):
@@ -548,7 +760,7 @@ class CityAPITest(BaseTestCase):
 
     def test_build_matrix_data_city(self):
         data = dict(y=1, a=1.0, alpha=0.1, beta=0.8)
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(1):
             json_response = self.cities_build_matrix_data_action(self.client, self.city_obj.public_id, data)
 
         expected_demand_matrix_file = [
@@ -603,7 +815,7 @@ SC_3,0,0,0,0,0,0,0,0,0
 P_4,300,0,25,0,25,0,25,0,375
 SC_4,0,0,0,0,0,0,0,0,0'''
         data = dict(content=file_content)
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(1):
             json_response = self.cities_build_matrix_from_file_action(self.client, self.city_obj.public_id, data)
 
         expected_demand_matrix_file = [
@@ -625,13 +837,77 @@ SC_4,0,0,0,0,0,0,0,0,0'''
     def test_build_matrix_from_file_with_wrong_parameters_city(self):
         for content in ['', 'asdasdasd', 'ads,1\nads,1\nads\nads\nads\nads\nads\nads\n']:
             data = dict(content=content)
-            with self.assertNumQueries(5):
+            with self.assertNumQueries(1):
                 json_response = self.cities_build_matrix_from_file_action(self.client, self.city_obj.public_id, data,
                                                                           status_code=status.HTTP_400_BAD_REQUEST)
             self.assertIn('Matrix should have rows equal to number of nodes', json_response['detail'])
 
+    def test_build_matrix_from_file_with_wrong_cell_values_city(self):
+        header = ',CBD,P_1,SC_1,P_2,SC_2,P_3,SC_3,P_4,SC_4\n'
+        for cell_value, message in [('a', 'could not convert string to float'), ('-1', 'cell value should be >= 0')]:
+            rows = ['node,{0}'.format(','.join([cell_value] + ['0'] * 8))] * 9
+            data = dict(content=header + '\n'.join(rows))
+            json_response = self.cities_build_matrix_from_file_action(self.client, self.city_obj.public_id, data,
+                                                                      status_code=status.HTTP_400_BAD_REQUEST)
+            self.assertIn(message, json_response['detail'])
+
+    def test_build_matrix_from_uploaded_file_city(self):
+        Scene.objects.all().delete()
+        file_content = ''',CBD,P_1,SC_1,P_2,SC_2,P_3,SC_3,P_4,SC_4\r
+CBD,1,2,3,0,0,0,0,0,0\r
+P_1,300,0,375,0,25,0,25,0,25.005\r
+SC_1,0,0,0,0,0,0,0,0,0\r
+P_2,300,0,25,0,375,0,25,0,25\r
+SC_2,0,0,0,0,0,0,0,0,0\r
+P_3,300,0,25,0,25,0,375,0,25\r
+SC_3,0,0,0,0,0,0,0,0,0\r
+P_4,300,0,25,0,25,0,25,0,375\r
+SC_4,0,0,0,0,0,0,0,0,0\r
+'''
+        data = dict(file=SimpleUploadedFile('matrix.csv', file_content.encode('utf-8')))
+        with self.assertNumQueries(4):
+            json_response = self.cities_build_matrix_from_uploaded_file_action(self.client, self.city_obj.public_id,
+                                                                               data)
+
+        json_data = dict(content=file_content.replace('\r', ''))
+        expected_response = self.cities_build_matrix_from_file_action(self.client, self.city_obj.public_id, json_data)
+        self.assertDictEqual(json_response, dict(demand_matrix_header=expected_response['demand_matrix_header']))
+        self.city_obj.refresh_from_db()
+        self.assertListEqual(self.city_obj.demand_matrix.tolist(), expected_response['demand_matrix'])
+        # like python round, 25.005 is stored as 25.00499...
+        self.assertEqual(self.city_obj.demand_matrix[1][8], 25.0)
+        self.assertIsNone(self.city_obj.y)
+        self.assertEqual(self.city_obj.version, 2)
+
+    def test_build_matrix_from_uploaded_file_with_scenes_is_not_valid(self):
+        data = dict(file=SimpleUploadedFile('matrix.csv', b''))
+        json_response = self.cities_build_matrix_from_uploaded_file_action(
+            self.client, self.city_obj.public_id, data, status_code=status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(json_response[0],
+                         'City "{0}" can not be modified because has scenes.'.format(self.city_obj.name))
+
+    def test_build_matrix_from_uploaded_file_with_wrong_content_city(self):
+        Scene.objects.all().delete()
+        header = ',CBD,P_1,SC_1,P_2,SC_2,P_3,SC_3,P_4,SC_4\n'
+        row = 'node,0,0,0,0,0,0,0,0,0\n'
+        for content, message in [('', 'Matrix should have rows equal to number of nodes'),
+                                 (header + row * 8, 'Matrix should have rows equal to number of nodes'),
+                                 (header + row * 10, 'Matrix should have rows equal to number of nodes'),
+                                 (header + 'node,1\n' + row * 8, 'Matrix should have columns equal to number of nodes'),
+                                 (header + row.replace('0', 'a', 1) * 9, 'could not convert string to float'),
+                                 (header + row.replace('0', '-1', 1) * 9, 'cell value should be >= 0')]:
+            data = dict(file=SimpleUploadedFile('matrix.csv', content.encode('utf-8')))
+            json_response = self.cities_build_matrix_from_uploaded_file_action(
+                self.client, self.city_obj.public_id, data, status_code=status.HTTP_400_BAD_REQUEST)
+            self.assertIn(message, json_response['detail'])
+
+        json_response = self.cities_build_matrix_from_uploaded_file_action(
+            self.client, self.city_obj.public_id, dict(), status_code=status.HTTP_400_BAD_REQUEST)
+        self.assertIn('File can not be empty', json_response['detail'])
+
     def test_build_matrix_from_file_without_parameters_city(self):
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(1):
             json_response = self.cities_build_matrix_from_file_action(self.client, self.city_obj.public_id, dict(),
                                                                       status_code=status.HTTP_400_BAD_REQUEST)
         self.assertIn('Matrix should have rows equal to number of nodes', json_response['detail'])
@@ -646,7 +922,7 @@ class SceneAPITest(BaseTestCase):
         self.scene_obj = self.city_obj.scene_set.all()[0]
 
     def test_retrieve_scene_with_public_id(self):
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(5):
             json_response = self.scenes_retrieve(self.client, self.scene_obj.public_id)
 
         self.assertIsNotNone(json_response['passenger'])
@@ -659,7 +935,7 @@ class SceneAPITest(BaseTestCase):
                                    fini=1)
         fields = dict(name='scene name', city_public_id=self.city_obj.public_id, passenger=passenger_data,
                       transportmode_set=[transport_mode_data])
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(7):
             self.scenes_create(self.client, fields)
 
         self.assertEqual(Scene.objects.count(), 2)
@@ -685,7 +961,7 @@ class SceneAPITest(BaseTestCase):
                                    fini=1)
         new_data = dict(name=new_scene_name, city_public_id=self.city_obj.public_id, passenger=passenger_data,
                         transportmode_set=[transport_mode_data])
-        with self.assertNumQueries(11):
+        with self.assertNumQueries(12):
             json_response = self.scenes_update(self.client, self.scene_obj.public_id, new_data)
 
         self.scene_obj.refresh_from_db()
@@ -693,13 +969,13 @@ class SceneAPITest(BaseTestCase):
         self.assertEqual(self.scene_obj.name, new_scene_name)
 
     def test_delete_scene(self):
-        with self.assertNumQueries(16):
+        with self.assertNumQueries(20):
             self.scenes_delete(self.client, self.scene_obj.public_id)
 
         self.assertEqual(Scene.objects.count(), 0)
 
     def test_duplicate_scene(self):
-        with self.assertNumQueries(24):
+        with self.assertNumQueries(16):
             json_response = self.scenes_duplicate_action(self.client, self.scene_obj.public_id)
 
         self.assertEqual(Scene.objects.count(), 2)
@@ -708,7 +984,7 @@ class SceneAPITest(BaseTestCase):
     def test_duplicate_scene_without_passenger(self):
         self.scene_obj.passenger.delete()
 
-        with self.assertNumQueries(22):
+        with self.assertNumQueries(15):
             json_response = self.scenes_duplicate_action(self.client, self.scene_obj.public_id)
 
         self.assertEqual(Scene.objects.count(), 2)
@@ -720,7 +996,7 @@ class SceneAPITest(BaseTestCase):
                                    fini=1)
         scene_data = dict(passenger=passenger_data, name='new name', transportmode_set=[transport_mode_data],
                           city_public_id=self.city_obj.public_id)
-        with self.assertNumQueries(11):
+        with self.assertNumQueries(12):
             json_response = self.scenes_update(self.client, self.scene_obj.public_id, scene_data,
                                                status_code=status.HTTP_200_OK)
 
@@ -740,7 +1016,7 @@ class SceneAPITest(BaseTestCase):
                                                      transport_mode=transport_mode_obj,
                                                      b=i, k=i, l=i)
 
-        with self.assertNumQueries(7):
+        with self.assertNumQueries(8):
             json_response = self.scenes_globalresults_action(self.client, self.scene_obj.public_id)
 
         self.assertListEqual(json_response['rows'],
@@ -748,7 +1024,7 @@ class SceneAPITest(BaseTestCase):
         self.assertIn('scene', json_response.keys())
 
     def test_get_global_result_without_optimization_data(self):
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(6):
             json_response = self.scenes_globalresults_action(self.client, self.scene_obj.public_id)
 
         self.assertListEqual(json_response['rows'], [])
@@ -758,7 +1034,7 @@ class SceneAPITest(BaseTestCase):
         data = dict(name='new name', bya=1, co=2, c1=2, c2=2, v=2, t=2, fmax=2, kmax=2, theta=1, tat=2, d=2, fini=2)
 
         self.assertEqual(TransportMode.objects.count(), 2)
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(3):
             json_response = self.scenes_transportmode_create(self.client, self.scene_obj.public_id, data)
 
         self.assertEqual(TransportMode.objects.count(), 3)
@@ -779,7 +1055,7 @@ class SceneAPITest(BaseTestCase):
         data = dict(name='new name', public_id=str(public_id), bya=1, co=2, c1=2, c2=2, v=2, t=2, fmax=2, kmax=2,
                     theta=1, tat=2, d=2, fini=2)
 
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(3):
             json_response = self.scenes_transportmode_update(self.client, self.scene_obj.public_id, public_id, data)
         for key in data.keys():
             self.assertEqual(json_response[key], data[key])
@@ -789,7 +1065,7 @@ class SceneAPITest(BaseTestCase):
     def test_delete_transport_mode(self):
         public_id = self.scene_obj.transportmode_set.all()[0].public_id
 
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(5):
             self.scenes_transportmode_delete(self.client, self.scene_obj.public_id, public_id)
 
         self.assertEqual(TransportMode.objects.count(), 1)
@@ -805,7 +1081,7 @@ class TransportNetworkAPITest(BaseTestCase):
         self.transport_network_obj = TransportNetwork.objects.first()
 
     def test_retrieve_transport_network_with_public_id(self):
-        with self.assertNumQueries(3):
+        with self.assertNumQueries(4):
             json_response = self.transport_network_retrieve(self.client, self.transport_network_obj.public_id)
 
         self.assertDictEqual(json_response, TransportNetworkSerializer(self.transport_network_obj).data)
@@ -815,7 +1091,7 @@ class TransportNetworkAPITest(BaseTestCase):
                           stops_sequence_r='2,1', type=Route.CUSTOM,
                           transport_mode_public_id=TransportMode.objects.first().public_id)
         fields = dict(name='transport network name', scene_public_id=self.scene_obj.public_id, route_set=[route_data])
-        with self.assertNumQueries(9):
+        with self.assertNumQueries(10):
             self.transport_network_create(self.client, fields)
 
         self.assertEqual(TransportNetwork.objects.count(), 2)
@@ -835,7 +1111,7 @@ class TransportNetworkAPITest(BaseTestCase):
     def test_update_transport_network(self):
         new_scene_name = 'name2'
         new_data = dict(name=new_scene_name, scene_public_id=self.scene_obj.public_id, route_set=[])
-        with self.assertNumQueries(12):
+        with self.assertNumQueries(13):
             json_response = self.transport_network_update(self.client, self.transport_network_obj.public_id, new_data)
 
         self.transport_network_obj.refresh_from_db()
@@ -845,7 +1121,7 @@ class TransportNetworkAPITest(BaseTestCase):
     def test_partial_update_transport_network(self):
         new_scene_name = 'name2'
         new_data = dict(name=new_scene_name, route_set=[])
-        with self.assertNumQueries(12):
+        with self.assertNumQueries(13):
             json_response = self.transport_network_partial_update(self.client, self.transport_network_obj.public_id,
                                                                   new_data)
 
@@ -854,13 +1130,13 @@ class TransportNetworkAPITest(BaseTestCase):
         self.assertEqual(self.transport_network_obj.name, new_scene_name)
 
     def test_delete_transport_network(self):
-        with self.assertNumQueries(10):
+        with self.assertNumQueries(14):
             self.transport_network_delete(self.client, self.transport_network_obj.public_id)
 
         self.assertEqual(TransportNetwork.objects.count(), 0)
 
     def test_duplicate_transport_network(self):
-        with self.assertNumQueries(11):
+        with self.assertNumQueries(10):
             json_response = self.transport_network_duplicate_action(self.client, self.transport_network_obj.public_id)
 
         self.assertEqual(TransportNetwork.objects.count(), 2)
@@ -943,7 +1219,7 @@ class TransportNetworkAPITest(BaseTestCase):
                           stops_sequence_r='2,1', type=Route.CUSTOM,
                           transport_mode_public_id=TransportMode.objects.first().public_id)
         data = dict(name='transport network test', scene_public_id=self.scene_obj.public_id, route_set=[route_data])
-        with self.assertNumQueries(9):
+        with self.assertNumQueries(10):
             json_response = self.transport_network_create(self.client, data)
 
         self.assertEqual(Route.objects.count(), 2)
@@ -968,7 +1244,7 @@ class TransportNetworkAPITest(BaseTestCase):
                           transport_mode_public_id=str(transport_mode_obj.public_id))
         data = dict(name='new_name', scene_public_id=self.scene_obj.public_id, route_set=[route_data])
 
-        with self.assertNumQueries(13):
+        with self.assertNumQueries(14):
             json_response = self.transport_network_update(self.client, self.transport_network_obj.public_id, data,
                                                           status_code=status.HTTP_200_OK)
 
@@ -997,7 +1273,7 @@ class TransportNetworkAPITest(BaseTestCase):
         route_set.append(route_data)
         data = dict(name='new_name', scene_public_id=self.scene_obj.public_id, route_set=route_set)
 
-        with self.assertNumQueries(16):
+        with self.assertNumQueries(17):
             self.transport_network_update(self.client, self.transport_network_obj.public_id, data,
                                           status_code=status.HTTP_200_OK)
 
@@ -1005,7 +1281,7 @@ class TransportNetworkAPITest(BaseTestCase):
 
     def test_delete_route(self):
         data = dict(name='new name', scene_public_id=self.scene_obj.public_id, route_set=[])
-        with self.assertNumQueries(12):
+        with self.assertNumQueries(13):
             self.transport_network_update(self.client, self.transport_network_obj.public_id, data)
 
         self.assertEqual(Route.objects.count(), 0)
@@ -1034,7 +1310,7 @@ class TransportNetworkAPITest(BaseTestCase):
             opt_route=opt_result_per_route_obj, direction=OptimizationResultPerRouteDetail.DIRECTION_I,
             origin_node=2, destination_node=3, lambda_value=1)
 
-        with self.assertNumQueries(9):
+        with self.assertNumQueries(10):
             json_response = self.transport_network_results(self.client, transport_network_obj.public_id)
 
         self.assertDictEqual(json_response['opt_result'],
@@ -1043,7 +1319,7 @@ class TransportNetworkAPITest(BaseTestCase):
                              [OptimizationResultPerRouteSerializer(opt_result_per_route_obj).data])
 
     def test_transport_network_results_without_data(self):
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(7):
             json_response = self.transport_network_results(self.client, self.transport_network_obj.public_id)
 
         self.assertDictEqual(json_response,
@@ -1081,13 +1357,20 @@ class OptimizationActionTest(BaseTestCase):
         self.transport_network_obj = TransportNetwork.objects.first()
 
     def test_run_optimization_with_wrong_data(self):
-        with self.assertNumQueries(9):
+        with self.assertNumQueries(17):
             json_response = self.run_optimization(self.client, self.transport_network_obj.public_id)
 
         self.assertEqual(json_response['optimization_status'], TransportNetwork.STATUS_QUEUED)
         self.assertIsNone(json_response['optimization_ran_at'])
 
-    def test_run_optimization_with_correct_data(self):
+        with self.assertNumQueries(0):
+            json_response = self.optimization_progress(self.client, self.transport_network_obj.public_id)
+        self.assertListEqual([(event['phase'], event.get('optimization_status')) for event in json_response['events']],
+                             [(PHASE_STATUS, TransportNetwork.STATUS_PROCESSING), (ProgressReporter.PHASE_ERROR, None),
+                              (PHASE_STATUS, TransportNetwork.STATUS_ERROR)])
+        self.assertEqual(json_response['events'][1]['message'], 'par OD 1-0 without connection')
+
+    def create_optimizable_routes(self):
         graph = self.transport_network_obj.scene.city.get_sidermit_graph()
         network_obj = self.transport_network_obj.get_sidermit_network(graph)
         # add feeder routes
@@ -1106,33 +1389,1368 @@ class OptimizationActionTest(BaseTestCase):
                                  nodes_sequence_r=','.join([str(x) for x in route.nodes_sequence_r]),
                                  stops_sequence_r=','.join([str(x) for x in route.stops_sequence_r]))
 
-        with self.assertNumQueries(181):
+    def test_run_optimization_with_correct_data(self):
+        self.create_optimizable_routes()
+
+        with CaptureQueriesContext(connection) as queries:
             json_response = self.run_optimization(self.client, self.transport_network_obj.public_id)
 
         self.assertEqual(json_response['optimization_status'], TransportNetwork.STATUS_QUEUED)
         self.assertIsNone(json_response['optimization_ran_at'])
+        # checkpoint is created after first iteration and updated after the next ones, locking the transport network
+        iteration_number = OptimizationResult.objects.get(transport_network=self.transport_network_obj).iteration_number
+        self.assertEqual(len(queries), 29 + 4 * iteration_number)
 
         self.transport_network_obj.refresh_from_db()
         self.assertEqual(self.transport_network_obj.optimization_status, TransportNetwork.STATUS_FINISHED)
         self.assertIsNotNone(self.transport_network_obj.optimization_ran_at)
 
-    @mock.patch('api.views.send_kill_horse_command')
-    @mock.patch('api.views.cancel_job')
+        with self.assertNumQueries(0):
+            json_response = self.optimization_progress(self.client, self.transport_network_obj.public_id)
+        phases = [event['phase'] for event in json_response['events']]
+        self.assertListEqual(phases[:2], [PHASE_STATUS, ProgressReporter.PHASE_INITIALIZATION])
+        self.assertListEqual(phases[-3:], [ProgressReporter.PHASE_SAVING_RESULTS, ProgressReporter.PHASE_FINISHED,
+                                           PHASE_STATUS])
+        iteration_events = [event for event in json_response['events'] if
+                            event['phase'] == ProgressReporter.PHASE_ITERATION]
+        self.assertListEqual([event['iteration'] for event in iteration_events],
+                             list(range(1, len(iteration_events) + 1)))
+        self.assertTrue(all(event['vrc'] is not None for event in iteration_events))
+
+        # warm start from frequencies of previous results
+        first_iteration_number = OptimizationResult.objects.get(
+            transport_network=self.transport_network_obj).iteration_number
+        self.assertEqual(first_iteration_number, len(iteration_events))
+        self.run_optimization(self.client, self.transport_network_obj.public_id, data=dict(warm_start=True))
+
+        opt_result_obj = OptimizationResult.objects.get(transport_network=self.transport_network_obj)
+        self.assertEqual(opt_result_obj.warm_start_transport_network, self.transport_network_obj)
+        self.assertEqual(opt_result_obj.saved_iteration_number,
+                         first_iteration_number - opt_result_obj.iteration_number)
+        self.assertLessEqual(opt_result_obj.iteration_number, first_iteration_number)
+
+    @mock.patch('rqworkers.submission.send_kill_horse_command')
+    @mock.patch('rqworkers.submission.cancel_job')
     def test_cancel_optimization(self, mock_cancel_job, mock_send_kill_horse_command):
-        with self.assertNumQueries(3):
+        job_id = str(uuid.uuid4())
+        TransportNetwork.objects.filter(pk=self.transport_network_obj.pk).update(
+            optimization_status=TransportNetwork.STATUS_PROCESSING, job_id=job_id)
+        register_job_worker(get_connection(), mock.Mock(id=job_id, timeout=60), 'worker-1')
+
+        with self.assertNumQueries(5):
             json_response = self.cancel_optimization(self.client, self.transport_network_obj.public_id)
 
         self.assertIsNone(json_response['optimization_status'])
         self.assertIsNone(json_response['optimization_ran_at'])
 
-        mock_send_kill_horse_command.fetch.assert_not_called()
-        mock_cancel_job.assert_called_once()
+        mock_send_kill_horse_command.assert_called_once_with(mock.ANY, 'worker-1')
+        mock_cancel_job.assert_called_once_with(job_id, connection=mock.ANY)
+        self.assertListEqual(get_job_workers(get_connection(), [job_id]), [None])
 
         self.transport_network_obj.refresh_from_db()
         self.assertIsNone(self.transport_network_obj.optimization_status)
         self.assertIsNone(self.transport_network_obj.optimization_ran_at)
         self.assertIsNone(self.transport_network_obj.optimization_error_message)
 
+    def enqueue_optimization_for_worker(self):
+        job_id = uuid.uuid4()
+        TransportNetwork.objects.filter(pk=self.transport_network_obj.pk).update(
+            optimization_status=TransportNetwork.STATUS_QUEUED, job_id=job_id)
+        queue = Queue('optimizer-worker-test', connection=get_connection())
+        job = queue.enqueue(optimize_transport_network, self.transport_network_obj.public_id, None, None,
+                            job_id=str(job_id))
+
+        return queue, job
+
+    def test_cancel_optimization_running_in_process_worker(self):
+        self.create_optimizable_routes()
+        queue, job = self.enqueue_optimization_for_worker()
+        worker = InProcessOptimizerWorker([queue], connection=get_connection())
+        job_worker_list = []
+
+        def cancel_before_checkpoint(*args, **kwargs):
+            job_worker_list.extend(get_job_workers(get_connection(), [job.id]))
+            # kill horse command is sent to the worker, it does not stop a job that runs in process
+            self.cancel_optimization(self.client, self.transport_network_obj.public_id)
+            return save_optimization_checkpoint(*args, **kwargs)
+
+        with mock.patch('rqworkers.jobs.save_optimization_checkpoint',
+                        side_effect=cancel_before_checkpoint) as mock_save_optimization_checkpoint:
+            worker.work(burst=True)
+
+        # job stopped at the first checkpoint after the cancellation
+        mock_save_optimization_checkpoint.assert_called_once()
+        self.assertListEqual(job_worker_list, [dict(worker_name=worker.name)])
+        self.assertListEqual(get_job_workers(get_connection(), [job.id]), [None])
+        job.refresh()
+        self.assertEqual(job.get_status(), JobStatus.FINISHED)
+        self.transport_network_obj.refresh_from_db()
+        self.assertIsNone(self.transport_network_obj.optimization_status)
+        self.assertIsNone(self.transport_network_obj.optimization_duration)
+        self.assertFalse(OptimizationResult.objects.filter(transport_network=self.transport_network_obj).exists())
+        self.assertFalse(OptimizationCheckpoint.objects.exists())
+
+    def test_optimization_enqueued_again_after_last_iteration_does_not_write_results(self):
+        self.create_optimizable_routes()
+        queue, job = self.enqueue_optimization_for_worker()
+        new_job_id = uuid.uuid4()
+
+        def enqueue_again_after_last_iteration(*args, **kwargs):
+            result = run_network_optimization(*args, **kwargs)
+            TransportNetwork.objects.filter(pk=self.transport_network_obj.pk).update(
+                optimization_status=TransportNetwork.STATUS_QUEUED, job_id=new_job_id)
+            return result
+
+        with mock.patch('rqworkers.jobs.run_network_optimization', side_effect=enqueue_again_after_last_iteration):
+            InProcessOptimizerWorker([queue], connection=get_connection()).work(burst=True)
+
+        self.transport_network_obj.refresh_from_db()
+        self.assertEqual(self.transport_network_obj.optimization_status, TransportNetwork.STATUS_QUEUED)
+        self.assertEqual(self.transport_network_obj.job_id, new_job_id)
+        # results are rolled back and checkpoint is kept for the new job
+        self.assertTrue(OptimizationCheckpoint.objects.filter(transport_network=self.transport_network_obj).exists())
+        self.assertFalse(OptimizationResult.objects.filter(transport_network=self.transport_network_obj).exists())
+
+    @mock.patch('rqworkers.reaper.enqueue_optimization')
+    def test_stuck_optimization_in_process_worker_stops_after_reaper_retry(self, mock_enqueue_optimization):
+        self.create_optimizable_routes()
+        queue, job = self.enqueue_optimization_for_worker()
+        public_id = self.transport_network_obj.public_id
+        checkpoint_number = []
+        retried_list = []
+
+        def reap_before_second_checkpoint(*args, **kwargs):
+            checkpoint_number.append(len(checkpoint_number) + 1)
+            if len(checkpoint_number) == 2:
+                # job got stuck long enough for its heartbeat to expire
+                TransportNetwork.objects.filter(pk=self.transport_network_obj.pk).update(
+                    optimization_ran_at=timezone.now() - timedelta(hours=1))
+                get_connection().delete(OptimizationHeartbeat(public_id).key)
+                retried_list.extend(reap_orphaned_optimizations(max_retries=1)[0])
+                # retry starts running
+                OptimizationHeartbeat(public_id, retried_list[0].job_id).beat()
+            return save_optimization_checkpoint(*args, **kwargs)
+
+        with mock.patch('rqworkers.jobs.save_optimization_checkpoint', side_effect=reap_before_second_checkpoint):
+            InProcessOptimizerWorker([queue], connection=get_connection()).work(burst=True)
+
+        # stuck job stopped at the checkpoint after the retry and left status, checkpoint and heartbeat to it
+        self.assertListEqual(checkpoint_number, [1, 2])
+        self.assertListEqual(retried_list, [self.transport_network_obj])
+        self.transport_network_obj.refresh_from_db()
+        self.assertEqual(self.transport_network_obj.optimization_status, TransportNetwork.STATUS_QUEUED)
+        self.assertEqual(self.transport_network_obj.job_id, retried_list[0].job_id)
+        mock_enqueue_optimization.assert_called_once()
+        self.assertFalse(OptimizationResult.objects.filter(transport_network=self.transport_network_obj).exists())
+        self.assertEqual(OptimizationCheckpoint.objects.get(
+            transport_network=self.transport_network_obj).iteration_number, 1)
+        self.assertListEqual(get_heartbeats(get_connection(), [public_id]), [str(retried_list[0].job_id)])
+
+
+class OptimizationEventStreamTest(BaseTestCase):
+
+    def setUp(self):
+        self.create_data(city_number=1, scene_number=1, transport_network_number=2)
+        self.transport_network_obj = TransportNetwork.objects.select_related('scene').order_by('id').first()
+
+    def read_stream(self, path, publish, event_number):
+        # django cache connections are local to each thread and fake redis servers are not shared between them, so
+        # broker thread has to use connection of test thread
+        connection = get_connection()
+        with mock.patch('api.events.broker', OptimizationEventBroker(connection_factory=lambda: connection)):
+            return self._read_stream(path, publish, event_number)
+
+    @async_to_sync
+    async def _read_stream(self, path, publish, event_number):
+        communicator = ApplicationCommunicator(application, dict(type='http', method='GET', path=path, headers=[]))
+        await communicator.send_input(dict(type='http.request', body=b'', more_body=False))
+        response_start = await communicator.receive_output(timeout=5)
+
+        # wait until broker thread is subscribed before publishing
+        await asyncio.sleep(0.5)
+        await sync_to_async(publish)()
+        bodies = []
+        for _ in range(event_number):
+            bodies.append((await communicator.receive_output(timeout=5))['body'])
+        await communicator.send_input(dict(type='http.disconnect'))
+        await communicator.wait(timeout=5)
+
+        return response_start, [json.loads(body.decode()[len('data: '):]) for body in bodies]
+
+    def publish_status(self, transport_network_obj, optimization_status):
+        transport_network_obj.optimization_status = optimization_status
+        publish_status_change(transport_network_obj)
+
+    def test_transport_network_stream(self):
+        self.publish_status(self.transport_network_obj, TransportNetwork.STATUS_QUEUED)
+        path = '/api/transport_networks/{0}/events/'.format(self.transport_network_obj.public_id)
+
+        response_start, events = self.read_stream(
+            path, lambda: self.publish_status(self.transport_network_obj, TransportNetwork.STATUS_PROCESSING), 2)
+
+        self.assertEqual(response_start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), response_start['headers'])
+        # last known event is sent first
+        self.assertListEqual([event['optimization_status'] for event in events],
+                             [TransportNetwork.STATUS_QUEUED, TransportNetwork.STATUS_PROCESSING])
+
+    def test_scene_stream(self):
+        other_transport_network_obj = TransportNetwork.objects.select_related('scene').order_by('id').last()
+        path = '/api/scenes/{0}/events/'.format(self.transport_network_obj.scene.public_id)
+
+        def publish():
+            self.publish_status(self.transport_network_obj, TransportNetwork.STATUS_QUEUED)
+            self.publish_status(other_transport_network_obj, TransportNetwork.STATUS_FINISHED)
+
+        with self.assertNumQueries(0):
+            _, events = self.read_stream(path, publish, 2)
+
+        self.assertListEqual([(event['transport_network_public_id'], event['optimization_status']) for event in events],
+                             [(str(self.transport_network_obj.public_id), TransportNetwork.STATUS_QUEUED),
+                              (str(other_transport_network_obj.public_id), TransportNetwork.STATUS_FINISHED)])
+
+
+class SceneOptimizationGroupTest(BaseTestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.create_data(city_number=1, scene_number=2, passenger=True, transport_mode_number=1,
+                         transport_network_number=3, route_number=1)
+        self.scene_obj = Scene.objects.order_by('id').first()
+
+    @mock.patch('rqworkers.submission.enqueue_optimization')
+    def test_run_optimization_of_scene(self, mock_enqueue_optimization):
+        mock_enqueue_optimization.return_value.id = str(uuid.uuid4())
+        processing_transport_network_obj = TransportNetwork.objects.filter(scene=self.scene_obj).first()
+        processing_transport_network_obj.optimization_status = TransportNetwork.STATUS_PROCESSING
+        processing_transport_network_obj.save()
+        TransportNetwork.objects.create(scene=self.scene_obj, name='without routes')
+
+        json_response = self.scenes_run_optimization_action(self.client, self.scene_obj.public_id)
+
+        transport_network_obj_list = list(TransportNetwork.objects.filter(
+            scene=self.scene_obj, optimization_status=TransportNetwork.STATUS_QUEUED).order_by('created_at'))
+        self.assertEqual(len(transport_network_obj_list), 2)
+        self.assertEqual(mock_enqueue_optimization.call_count, 2)
+        self.assertListEqual([x['public_id'] for x in json_response['transport_networks']],
+                             [str(x.public_id) for x in transport_network_obj_list])
+        self.assertFalse(any(x['cache_hit'] for x in json_response['transport_networks']))
+
+        group_id = json_response['group_id']
+        json_response = self.scenes_optimization_group_action(self.client, self.scene_obj.public_id, group_id)
+        self.assertEqual(json_response['total'], 2)
+        self.assertEqual(json_response['pending'], 2)
+        self.assertEqual(json_response['status_count'][TransportNetwork.STATUS_QUEUED], 2)
+        self.assertFalse(json_response['completed'])
+
+        transport_network_obj_list[0].optimization_status = TransportNetwork.STATUS_FINISHED
+        transport_network_obj_list[0].save()
+        transport_network_obj_list[1].delete()
+        with self.assertNumQueries(2):
+            json_response = self.scenes_optimization_group_action(self.client, self.scene_obj.public_id, group_id)
+        self.assertEqual(json_response['status_count'][TransportNetwork.STATUS_FINISHED], 1)
+        self.assertEqual(json_response['missing'], 1)
+        self.assertEqual(json_response['pending'], 0)
+        self.assertTrue(json_response['completed'])
+
+    def test_run_optimization_of_scene_without_eligible_transport_networks(self):
+        TransportNetwork.objects.filter(scene=self.scene_obj).update(
+            optimization_status=TransportNetwork.STATUS_QUEUED)
+
+        json_response = self.scenes_run_optimization_action(self.client, self.scene_obj.public_id,
+                                                            status_code=status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Scene does not have transport networks', json_response[0])
+
+    @mock.patch('rqworkers.submission.send_kill_horse_command')
+    @mock.patch('rqworkers.submission.cancel_job')
+    def test_cancel_optimization_of_scene(self, mock_cancel_job, mock_send_kill_horse_command):
+        transport_network_obj_list = list(TransportNetwork.objects.filter(scene=self.scene_obj).order_by('id'))
+        job_id_list = [str(uuid.uuid4()) for _ in transport_network_obj_list]
+        for transport_network_obj, job_id, optimization_status in zip(
+                transport_network_obj_list, job_id_list, [TransportNetwork.STATUS_PROCESSING,
+                                                          TransportNetwork.STATUS_QUEUED,
+                                                          TransportNetwork.STATUS_FINISHED]):
+            transport_network_obj.optimization_status = optimization_status
+            transport_network_obj.job_id = job_id
+            transport_network_obj.save()
+        register_job_worker(get_connection(), mock.Mock(id=job_id_list[0], timeout=60), 'worker-1')
+
+        json_response = self.scenes_cancel_optimization_action(self.client, self.scene_obj.public_id)
+
+        self.assertListEqual([x['public_id'] for x in json_response['transport_networks']],
+                             [str(x.public_id) for x in transport_network_obj_list[:2]])
+        mock_send_kill_horse_command.assert_called_once_with(mock.ANY, 'worker-1')
+        self.assertListEqual([call[0][0] for call in mock_cancel_job.call_args_list], job_id_list[:2])
+        self.assertListEqual(list(TransportNetwork.objects.filter(scene=self.scene_obj).order_by('id').values_list(
+            'optimization_status', flat=True)), [None, None, TransportNetwork.STATUS_FINISHED])
+
+    @mock.patch('rqworkers.submission.enqueue_optimization')
+    def test_optimization_group_does_not_exist(self, mock_enqueue_optimization):
+        mock_enqueue_optimization.return_value.id = str(uuid.uuid4())
+        self.scenes_optimization_group_action(self.client, self.scene_obj.public_id, uuid.uuid4(),
+                                              status_code=status.HTTP_404_NOT_FOUND)
+
+        # group belongs to another scene
+        json_response = self.scenes_run_optimization_action(self.client, self.scene_obj.public_id)
+        other_scene_obj = Scene.objects.exclude(pk=self.scene_obj.pk).first()
+        self.scenes_optimization_group_action(self.client, other_scene_obj.public_id, json_response['group_id'],
+                                              status_code=status.HTTP_404_NOT_FOUND)
+
+
+class ParameterSweepTest(BaseTestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.create_data(city_number=1, scene_number=1, passenger=True, transport_mode_number=1,
+                         transport_network_number=1, route_number=1)
+        self.transport_network_obj = TransportNetwork.objects.first()
+        self.transport_mode_name = TransportMode.objects.first().name
+
+    @staticmethod
+    def get_overall_results(graph, demand, passenger, network, f=None, **kwargs):
+        if passenger.va == 6:
+            raise SIDERMITException('optimization error')
+        mode = network.get_routes()[0].mode
+        opt_obj = mock.MagicMock()
+        opt_obj.get_overall_results.return_value = dict(
+            VRC=passenger.va * 100 + mode.co, operators_cost=2, infrastructure_cost=3, users_cost=4,
+            travel_time_on_board=5, waiting_time=6, access_time=7, transfers=8)
+
+        return opt_obj
+
+    @override_settings(PARAMETER_SWEEP_CHUNK_SIZE=3)
+    @mock.patch('rqworkers.jobs.Optimizer')
+    def test_run_parameter_sweep_with_grid(self, mock_optimizer):
+        mock_optimizer.network_optimization.side_effect = self.get_overall_results
+        grid = dict(passenger=dict(va=[4, 5, 6]), transport_modes={self.transport_mode_name: dict(co=[1, 2])})
+        data = dict(transport_network_public_id=str(self.transport_network_obj.public_id), parameters=dict(grid=grid))
+
+        json_response = self.parameter_sweeps_create(self.client, data)
+
+        self.assertEqual(json_response['point_number'], 6)
+        self.assertEqual(mock_optimizer.network_optimization.call_count, 6)
+        parameter_sweep_obj = ParameterSweep.objects.get(public_id=json_response['public_id'])
+        self.assertEqual(parameter_sweep_obj.status, ParameterSweep.STATUS_FINISHED)
+        self.assertIsNotNone(parameter_sweep_obj.duration)
+        # overrides are not saved
+        self.assertEqual(Passenger.objects.first().va, 4)
+        self.assertEqual(TransportMode.objects.first().co, 8.61)
+
+        json_response = self.parameter_sweeps_results_action(self.client, parameter_sweep_obj.public_id)
+
+        co_column = 'transport_modes.{0}.co'.format(self.transport_mode_name)
+        self.assertListEqual(json_response['columns'], ['point', 'passenger.va', co_column, 'vrc', 'co', 'ci', 'cu',
+                                                        'tv', 'tw', 'ta', 't', 'error_message'])
+        self.assertListEqual([row[:4] for row in json_response['rows']],
+                             [[0, 4, 1, 401], [1, 4, 2, 402], [2, 5, 1, 501], [3, 5, 2, 502], [4, 6, 1, None],
+                              [5, 6, 2, None]])
+        self.assertListEqual([row[-1] for row in json_response['rows']],
+                             [None, None, None, None, 'optimization error', 'optimization error'])
+
+    @mock.patch('rqworkers.submission.run_parameter_sweep')
+    def test_create_parameter_sweep_with_points(self, mock_run_parameter_sweep):
+        points = [dict(passenger=dict(va=5)), dict(transport_modes={self.transport_mode_name: dict(fmax=100)})]
+        data = dict(transport_network_public_id=str(self.transport_network_obj.public_id),
+                    parameters=dict(points=points))
+
+        json_response = self.parameter_sweeps_create(self.client, data)
+
+        self.assertEqual(json_response['point_number'], 2)
+        self.assertEqual(json_response['status'], ParameterSweep.STATUS_QUEUED)
+        mock_run_parameter_sweep.delay.assert_called_once_with(uuid.UUID(json_response['public_id']),
+                                                               [(0, points[0]), (1, points[1])],
+                                                               get_solver_parameters())
+
+    @mock.patch('rqworkers.submission.run_parameter_sweep')
+    def test_create_parameter_sweep_with_solver_profile(self, mock_run_parameter_sweep):
+        data = dict(transport_network_public_id=str(self.transport_network_obj.public_id),
+                    parameters=dict(points=[dict(passenger=dict(va=5))]), solver_profile='precise', tolerance=0.1)
+
+        self.parameter_sweeps_create(self.client, data)
+
+        self.assertEqual(mock_run_parameter_sweep.delay.call_args[0][2],
+                         get_solver_parameters('precise', tolerance=0.1))
+
+    @override_settings(PARAMETER_SWEEP_CHUNK_SIZE=2)
+    @mock.patch('rqworkers.jobs.Optimizer')
+    def test_failed_chunk_moves_parameter_sweep_to_error(self, mock_optimizer):
+        def get_overall_results(graph, demand, passenger, network, f=None, **kwargs):
+            if passenger.va == 5:
+                raise JobTimeoutException('Task exceeded maximum timeout value')
+            return self.get_overall_results(graph, demand, passenger, network, f=f, **kwargs)
+        mock_optimizer.network_optimization.side_effect = get_overall_results
+        data = dict(transport_network_public_id=str(self.transport_network_obj.public_id),
+                    parameters=dict(grid=dict(passenger=dict(va=[4, 5, 4, 4]))))
+
+        json_response = self.parameter_sweeps_create(self.client, data)
+
+        # first chunk stops at the timeout, second one is optimized
+        self.assertEqual(mock_optimizer.network_optimization.call_count, 4)
+        json_response = self.parameter_sweeps_results_action(self.client, json_response['public_id'])
+        self.assertEqual(json_response['parameter_sweep']['status'], ParameterSweep.STATUS_ERROR)
+        self.assertEqual(json_response['parameter_sweep']['error_message'], 'Task exceeded maximum timeout value')
+        self.assertListEqual([row[2] for row in json_response['rows']], [None, None, 408.61, 408.61])
+        self.assertListEqual([row[-1] for row in json_response['rows']],
+                             ['Task exceeded maximum timeout value'] * 2 + [None, None])
+
+    @mock.patch('storage.models.City.get_sidermit_graph', side_effect=SIDERMITException('graph error'))
+    def test_parameter_sweep_without_graph(self, mock_get_sidermit_graph):
+        data = dict(transport_network_public_id=str(self.transport_network_obj.public_id),
+                    parameters=dict(points=[dict(passenger=dict(va=5))]))
+
+        json_response = self.parameter_sweeps_create(self.client, data)
+
+        parameter_sweep_obj = ParameterSweep.objects.get(public_id=json_response['public_id'])
+        self.assertEqual(parameter_sweep_obj.status, ParameterSweep.STATUS_ERROR)
+        self.assertEqual(parameter_sweep_obj.parametersweepresult_set.get().error_message, 'graph error')
+
+    def test_failed_parameter_sweep_job_is_reaped(self):
+        parameter_sweep_obj = ParameterSweep.objects.create(
+            transport_network=self.transport_network_obj, parameters=dict(points=[dict(), dict()]), point_number=2,
+            status=ParameterSweep.STATUS_PROCESSING, ran_at=timezone.now())
+        ParameterSweepResult.objects.create(parameter_sweep=parameter_sweep_obj, point=0, overrides=dict(), vrc=1)
+        # work horse was killed while it optimized the second chunk
+        job = Job.create(run_parameter_sweep, args=(parameter_sweep_obj.public_id, [(1, dict())]),
+                         connection=get_connection())
+        job.save()
+        FailedJobRegistry(settings.OPTIMIZER_QUEUE_NAME, connection=get_connection()).add(
+            job, exc_string='Work-horse was terminated unexpectedly')
+
+        self.assertListEqual(reap_failed_parameter_sweeps(), [parameter_sweep_obj])
+
+        parameter_sweep_obj.refresh_from_db()
+        self.assertEqual(parameter_sweep_obj.status, ParameterSweep.STATUS_ERROR)
+        self.assertEqual(parameter_sweep_obj.error_message, FAILED_SWEEP_CHUNK_ERROR_MESSAGE)
+        self.assertListEqual(list(parameter_sweep_obj.parametersweepresult_set.order_by('point').values_list(
+            'vrc', 'error_message')), [(1, None), (None, FAILED_SWEEP_CHUNK_ERROR_MESSAGE)])
+        # a sweep moved to error is reaped only once
+        self.assertListEqual(reap_failed_parameter_sweeps(), [])
+
+    def test_create_parameter_sweep_with_wrong_parameters(self):
+        cases = [
+            (dict(grid=dict(), points=[]), 'Parameters need key "grid" or key "points"'),
+            (dict(grid=dict(passenger=dict(name=[1]))), 'Parameter "name" can not be modified'),
+            (dict(grid=dict(passenger=dict(va=[]))), 'Parameter "va" needs a non empty list of values'),
+            (dict(points=[dict(passenger=dict(va='1'))]), 'Values of parameter "va" have to be numbers'),
+            (dict(points=[dict(transport_modes=dict(unknown=dict(co=1)))]), 'Transport mode "unknown" does not exist'),
+            (dict(grid=dict(passenger=dict(va=list(range(20)), pv=list(range(20))))),
+             'Parameter sweep has 400 points, maximum is 200'),
+        ]
+        for parameters, error_message in cases:
+            data = dict(transport_network_public_id=str(self.transport_network_obj.public_id), parameters=parameters)
+            json_response = self.parameter_sweeps_create(self.client, data, status_code=status.HTTP_400_BAD_REQUEST)
+            self.assertIn(error_message, str(json_response))
+        self.assertEqual(ParameterSweep.objects.count(), 0)
+
+
+class OptimizationResultWriterTest(BaseTestCase):
+
+    def setUp(self):
+        self.create_data(city_number=1, scene_number=1, passenger=True, transport_mode_number=1,
+                         transport_network_number=1, route_number=3)
+        self.transport_network_obj = TransportNetwork.objects.first()
+
+    def get_optimizer_results(self, scale=1):
+        transport_mode = SidermitTransportMode(TransportMode.objects.first().name, 1, 8.61, 0.15, 0, 20, 2.5, 150, 160,
+                                               0.7, 0, 4, 28)
+        overall_results = dict(VRC=1 * scale, operators_cost=2, infrastructure_cost=3, users_cost=4,
+                               travel_time_on_board=5, waiting_time=6, access_time=7, transfers=8,
+                               vehicles_mode={transport_mode: 9}, vehicle_capacity_mode={transport_mode: 10},
+                               lines_mode={transport_mode: 11})
+        network_results = []
+        for route_obj in Route.objects.filter(transport_network=self.transport_network_obj):
+            sub_table_i = [(i, i + 1, i * 0.5 * scale) for i in range(4)]
+            sub_table_r = [(i + 1, i, i * 0.25 * scale) for i in range(4)]
+            network_results.append((route_obj.name, 1, 2, 3, 4, 5, 6, 7, sub_table_i, sub_table_r))
+
+        return overall_results, network_results
+
+    def get_saved_route_details(self):
+        return sorted(OptimizationResultPerRouteDetail.objects.filter(
+            opt_route__transport_network=self.transport_network_obj).values_list(
+            'opt_route__route__name', 'direction', 'origin_node', 'destination_node', 'lambda_value'))
+
+    def test_save_results(self):
+        overall_results, network_results = self.get_optimizer_results()
+        with self.assertNumQueries(12):
+            save_optimization_results(self.transport_network_obj, overall_results, network_results)
+
+        bulk_create_details = self.get_saved_route_details()
+        self.assertEqual(len(bulk_create_details), 3 * 8)
+        self.assertEqual(OptimizationResult.objects.get(transport_network=self.transport_network_obj).vrc, 1)
+        self.assertEqual(OptimizationResultPerMode.objects.get(transport_network=self.transport_network_obj).l, 11)
+        self.assertEqual(OptimizationResultPerRoute.objects.filter(
+            transport_network=self.transport_network_obj).count(), 3)
+
+        # details are written with COPY, previous results are replaced
+        with self.settings(OPTIMIZATION_RESULT_COPY_THRESHOLD=0):
+            save_optimization_results(self.transport_network_obj, overall_results, network_results)
+
+        self.assertListEqual(self.get_saved_route_details(), bulk_create_details)
+        self.assertEqual(OptimizationResult.objects.filter(transport_network=self.transport_network_obj).count(), 1)
+        self.assertEqual(OptimizationResultPerMode.objects.filter(transport_network=self.transport_network_obj).count(),
+                         1)
+        self.assertEqual(OptimizationResultPerRoute.objects.filter(
+            transport_network=self.transport_network_obj).count(), 3)
+
+    def test_save_results_with_lookup_maps(self):
+        route_id_dict = dict(Route.objects.values_list('name', 'id'))
+        transport_mode_id_dict = dict(TransportMode.objects.values_list('name', 'id'))
+        overall_results, network_results = self.get_optimizer_results()
+        # queries do not depend on the number of routes
+        with self.assertNumQueries(10):
+            save_optimization_results(self.transport_network_obj, overall_results, network_results,
+                                      route_id_dict=route_id_dict, transport_mode_id_dict=transport_mode_id_dict)
+
+        self.assertEqual(OptimizationResultPerRoute.objects.filter(
+            transport_network=self.transport_network_obj).count(), 3)
+
+    def get_serialized_route_results(self):
+        return OptimizationResultPerRouteSerializer(OptimizationResultPerRoute.objects.filter(
+            transport_network=self.transport_network_obj).order_by('route__name'), many=True).data
+
+    def test_save_results_in_columnar_layout(self):
+        overall_results, network_results = self.get_optimizer_results()
+        # one query less, details are not inserted
+        with self.settings(OPTIMIZATION_RESULT_ARC_STORAGE='columnar'), self.assertNumQueries(11):
+            save_optimization_results(self.transport_network_obj, overall_results, network_results)
+
+        self.assertListEqual(self.get_saved_route_details(), [])
+        for opt_result_per_route_obj in OptimizationResultPerRoute.objects.filter(
+                transport_network=self.transport_network_obj):
+            self.assertEqual(len(opt_result_per_route_obj.arc_loads), 8 * 17)
+        columnar_results = self.get_serialized_route_results()
+
+        save_optimization_results(self.transport_network_obj, overall_results, network_results)
+        self.assertListEqual(self.get_serialized_route_results(), columnar_results)
+        self.assertListEqual(unpack_arc_loads(pack_arc_loads([])), [])
+
+    def test_previous_results_are_kept_if_saving_fails(self):
+        overall_results, network_results = self.get_optimizer_results()
+        save_optimization_results(self.transport_network_obj, overall_results, network_results)
+        saved_route_details = self.get_saved_route_details()
+
+        overall_results, network_results = self.get_optimizer_results(scale=2)
+        network_results.append(('unknown route', 1, 2, 3, 4, 5, 6, 7, [], []))
+        with self.assertRaises(KeyError):
+            save_optimization_results(self.transport_network_obj, overall_results, network_results)
+
+        self.assertListEqual(self.get_saved_route_details(), saved_route_details)
+        self.assertEqual(OptimizationResult.objects.get(transport_network=self.transport_network_obj).vrc, 1)
+
+
+class WarmStartTest(BaseTestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.create_data(city_number=1, scene_number=2, passenger=True, transport_mode_number=1,
+                         transport_network_number=2, route_number=3)
+        self.scene_obj = Scene.objects.order_by('id').first()
+        self.transport_network_obj, self.reference_transport_network_obj = TransportNetwork.objects.filter(
+            scene=self.scene_obj).order_by('id')
+
+    def test_get_warm_start_frequencies(self):
+        route_obj_list = list(self.reference_transport_network_obj.route_set.order_by('name'))
+        transport_mode_obj_list = list(self.scene_obj.transportmode_set.all())
+        self.assertIsNone(get_warm_start_frequencies(self.reference_transport_network_obj,
+                                                     self.transport_network_obj.route_set.all(),
+                                                     transport_mode_obj_list))
+
+        for frequency, route_obj in zip([12.5, 0], route_obj_list):
+            OptimizationResultPerRoute.objects.create(transport_network=self.reference_transport_network_obj,
+                                                      route=route_obj, frequency=frequency, frequency_per_line=1, k=1,
+                                                      b=1, tc=1, co=1, lambda_min=1)
+
+        frequencies = get_warm_start_frequencies(self.reference_transport_network_obj,
+                                                 self.transport_network_obj.route_set.all(), transport_mode_obj_list)
+
+        # routes are matched by name, routes without positive frequency start with fini
+        self.assertDictEqual(frequencies, {'route 0': 12.5, 'route 1': 28, 'route 2': 28})
+
+    @mock.patch('rqworkers.submission.enqueue_optimization')
+    def test_run_optimization_with_warm_start(self, mock_enqueue_optimization):
+        mock_enqueue_optimization.return_value.id = str(uuid.uuid4())
+
+        self.run_optimization(self.client, self.transport_network_obj.public_id, data=dict(warm_start=True))
+        mock_enqueue_optimization.assert_called_with(self.transport_network_obj.public_id,
+                                                     self.transport_network_obj.public_id, get_solver_parameters(),
+                                                     settings.OPTIMIZER_QUEUE_LANES[0], job_id=mock.ANY)
+
+        TransportNetwork.objects.update(optimization_status=None)
+        data = dict(warm_start_transport_network_public_id=str(self.reference_transport_network_obj.public_id))
+        self.run_optimization(self.client, self.transport_network_obj.public_id, data=data)
+        mock_enqueue_optimization.assert_called_with(self.transport_network_obj.public_id,
+                                                     self.reference_transport_network_obj.public_id,
+                                                     get_solver_parameters(), settings.OPTIMIZER_QUEUE_LANES[0],
+                                                     job_id=mock.ANY)
+
+        TransportNetwork.objects.update(optimization_status=None)
+        self.run_optimization(self.client, self.transport_network_obj.public_id)
+        mock_enqueue_optimization.assert_called_with(self.transport_network_obj.public_id, None,
+                                                     get_solver_parameters(), settings.OPTIMIZER_QUEUE_LANES[0],
+                                                     job_id=mock.ANY)
+
+    def test_run_optimization_with_wrong_warm_start_transport_network(self):
+        other_scene_transport_network_obj = TransportNetwork.objects.exclude(scene=self.scene_obj).first()
+        for public_id in [str(other_scene_transport_network_obj.public_id), 'wrong id']:
+            json_response = self.run_optimization(self.client, self.transport_network_obj.public_id,
+                                                  data=dict(warm_start_transport_network_public_id=public_id),
+                                                  status_code=status.HTTP_400_BAD_REQUEST)
+            self.assertIn('Warm start transport network does not exist in the same scene', json_response[0])
+
+
+class OptimizationCheckpointTest(BaseTestCase):
+
+    def setUp(self):
+        self.create_data(city_number=1, scene_number=1, passenger=True, transport_mode_number=1,
+                         transport_network_number=1, route_number=2)
+        self.transport_network_obj = TransportNetwork.objects.select_related('scene__city', 'scene__passenger').first()
+        self.input_fingerprint = get_optimization_input_fingerprint(
+            self.transport_network_obj, list(self.transport_network_obj.scene.transportmode_set.all()),
+            list(self.transport_network_obj.route_set.all()), get_optimizer_parameters(get_solver_parameters()))
+
+    def test_save_optimization_checkpoint(self):
+        self.assertIsNone(get_optimization_checkpoint(self.transport_network_obj, self.input_fingerprint))
+
+        for iteration_number in [1, 2]:
+            save_optimization_checkpoint(self.transport_network_obj, self.input_fingerprint, iteration_number,
+                                         {'route 0': np.float64(10.5), 'route 1': 0},
+                                         (np.array([10.5, 0]), True, 1, 'ok', 0, np.float64(100)))
+
+        checkpoint_obj = get_optimization_checkpoint(self.transport_network_obj, self.input_fingerprint)
+        self.assertEqual(checkpoint_obj.iteration_number, 2)
+        self.assertDictEqual(checkpoint_obj.frequencies, {'route 0': 10.5, 'route 1': 0})
+        self.assertListEqual(checkpoint_obj.better_result, [[10.5, 0], True, 1, 'ok', 0, 100])
+        self.assertIsNone(get_optimization_checkpoint(self.transport_network_obj, 'other inputs'))
+
+        delete_optimization_checkpoints([self.transport_network_obj.id])
+        self.assertFalse(OptimizationCheckpoint.objects.exists())
+
+    @mock.patch('rqworkers.optimization.Optimizer')
+    def test_checkpoint_is_saved_after_each_iteration(self, mock_optimizer):
+        mock_optimizer.return_value.f_opt = [28]
+        mock_optimizer.return_value.internal_optimization.return_value = mock.MagicMock(
+            x=[10], success=True, status=1, message='', constr_violation=0, fun=100)
+        mock_optimizer.return_value.external_optimization_tolerance.return_value = False
+        mock_optimizer.return_value.fopt_to_f.return_value = {'route 0': 10}
+        mock_optimizer.get_better_result.side_effect = lambda result_list: result_list[1]
+        checkpoint = mock.Mock()
+        previous_result = [[12], True, 1, '', 0, 90]
+
+        _, iteration_number, _ = run_network_optimization(
+            None, None, None, None, max_number_of_iteration=5, initial_iteration=3, previous_result=previous_result,
+            checkpoint=checkpoint)
+
+        self.assertEqual(iteration_number, 6)
+        self.assertListEqual(checkpoint.call_args_list, [mock.call(iteration, {'route 0': 10}, tuple(previous_result))
+                                                         for iteration in [4, 5, 6]])
+
+    @mock.patch('rqworkers.jobs.run_network_optimization', side_effect=SIDERMITException('stop'))
+    def test_job_resumes_from_checkpoint(self, mock_run_network_optimization):
+        TransportNetwork.objects.filter(pk=self.transport_network_obj.pk).update(
+            optimization_status=TransportNetwork.STATUS_QUEUED, job_id=uuid.uuid4())
+        previous_result = [[10.5, 0], True, 1, 'ok', 0, 100]
+        save_optimization_checkpoint(self.transport_network_obj, self.input_fingerprint, 2,
+                                     {'route 0': 10.5, 'route 1': 28}, previous_result)
+
+        optimize_transport_network(self.transport_network_obj.public_id)
+
+        kwargs = mock_run_network_optimization.call_args[1]
+        self.assertDictEqual(kwargs['f'], {'route 0': 10.5, 'route 1': 28})
+        self.assertEqual(kwargs['initial_iteration'], 2)
+        self.assertListEqual(kwargs['previous_result'], previous_result)
+        # optimization failed, so it will start over
+        self.assertFalse(OptimizationCheckpoint.objects.exists())
+
+
+class OptimizationReaperTest(BaseTestCase):
+
+    def setUp(self):
+        self.create_data(city_number=1, scene_number=1, passenger=True, transport_mode_number=1,
+                         transport_network_number=2, route_number=1)
+        self.transport_network_obj_list = list(TransportNetwork.objects.order_by('id'))
+        self.job_id_list = [uuid.uuid4() for _ in self.transport_network_obj_list]
+        self.solver_parameters = get_solver_parameters('precise')
+        for transport_network_obj, job_id in zip(self.transport_network_obj_list, self.job_id_list):
+            TransportNetwork.objects.filter(pk=transport_network_obj.pk).update(
+                optimization_status=TransportNetwork.STATUS_PROCESSING, job_id=job_id,
+                optimization_queue=settings.OPTIMIZER_FAST_QUEUE_NAME,
+                optimization_ran_at=timezone.now() - timedelta(hours=1))
+            Job.create(optimize_transport_network, args=(transport_network_obj.public_id, None,
+                                                         self.solver_parameters),
+                       id=str(job_id), connection=get_connection()).save()
+        # second network is still running
+        OptimizationHeartbeat(self.transport_network_obj_list[1].public_id, self.job_id_list[1]).beat()
+
+    def test_heartbeat(self):
+        public_id = self.transport_network_obj_list[0].public_id
+        with OptimizationHeartbeat(public_id, self.job_id_list[0]):
+            self.assertListEqual(get_heartbeats(get_connection(), [public_id]), [str(self.job_id_list[0])])
+
+        self.assertListEqual(get_heartbeats(get_connection(), [public_id]), [None])
+
+    @mock.patch('rqworkers.reaper.enqueue_optimization')
+    def test_orphaned_optimization_is_enqueued_again(self, mock_enqueue_optimization):
+        retried_list, failed_list = reap_orphaned_optimizations(max_retries=1)
+
+        self.assertListEqual(retried_list, self.transport_network_obj_list[:1])
+        self.assertListEqual(failed_list, [])
+        transport_network_obj = TransportNetwork.objects.get(pk=self.transport_network_obj_list[0].pk)
+        self.assertEqual(transport_network_obj.optimization_status, TransportNetwork.STATUS_QUEUED)
+        self.assertEqual(transport_network_obj.optimization_retry_number, 1)
+        self.assertNotEqual(transport_network_obj.job_id, self.job_id_list[0])
+        mock_enqueue_optimization.assert_called_once_with(
+            transport_network_obj.public_id, None, self.solver_parameters, settings.OPTIMIZER_QUEUE_LANES[0],
+            job_id=transport_network_obj.job_id)
+        self.assertEqual(TransportNetwork.objects.get(pk=self.transport_network_obj_list[1].pk).optimization_status,
+                         TransportNetwork.STATUS_PROCESSING)
+
+    @mock.patch('rqworkers.reaper.enqueue_optimization')
+    def test_orphaned_optimization_is_moved_to_error_after_retries(self, mock_enqueue_optimization):
+        TransportNetwork.objects.filter(pk=self.transport_network_obj_list[0].pk).update(optimization_retry_number=1)
+        save_optimization_checkpoint(self.transport_network_obj_list[0], 'fingerprint', 1, {'route 0': 10}, None)
+
+        retried_list, failed_list = reap_orphaned_optimizations(max_retries=1)
+
+        self.assertListEqual(retried_list, [])
+        self.assertListEqual(failed_list, self.transport_network_obj_list[:1])
+        transport_network_obj = TransportNetwork.objects.get(pk=self.transport_network_obj_list[0].pk)
+        self.assertEqual(transport_network_obj.optimization_status, TransportNetwork.STATUS_ERROR)
+        self.assertEqual(transport_network_obj.optimization_error_message, ORPHANED_OPTIMIZATION_ERROR_MESSAGE)
+        self.assertFalse(OptimizationCheckpoint.objects.exists())
+        mock_enqueue_optimization.assert_not_called()
+
+        # a network moved to error is reaped only once
+        self.assertListEqual(reap_orphaned_optimizations(max_retries=1)[1], [])
+
+    def test_job_without_rq_job_is_moved_to_error(self):
+        get_connection().delete(Job.key_for(str(self.job_id_list[0])))
+
+        retried_list, failed_list = reap_orphaned_optimizations(max_retries=1)
+
+        self.assertListEqual(retried_list, [])
+        self.assertListEqual(failed_list, self.transport_network_obj_list[:1])
+
+    def test_recently_started_optimization_is_not_reaped(self):
+        TransportNetwork.objects.update(optimization_ran_at=timezone.now())
+
+        self.assertTupleEqual(reap_orphaned_optimizations(max_retries=1), ([], []))
+
+
+class SolverProfileTest(BaseTestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.create_data(city_number=1, scene_number=1, passenger=True, transport_mode_number=1,
+                         transport_network_number=1, route_number=1)
+        self.transport_network_obj = TransportNetwork.objects.first()
+
+    @mock.patch('rqworkers.submission.enqueue_optimization')
+    def test_run_optimization_with_solver_profile(self, mock_enqueue_optimization):
+        mock_enqueue_optimization.return_value.id = str(uuid.uuid4())
+
+        json_response = self.run_optimization(self.client, self.transport_network_obj.public_id,
+                                              data=dict(solver_profile='preview', deadline=10))
+
+        solver_parameters = dict(profile='preview', tolerance=0.05, max_number_of_iteration=2, deadline=10)
+        self.assertDictEqual(json_response['solver_parameters'], solver_parameters)
+        mock_enqueue_optimization.assert_called_once_with(self.transport_network_obj.public_id, None,
+                                                          solver_parameters, settings.OPTIMIZER_QUEUE_LANES[0],
+                                                          job_id=mock.ANY)
+
+    def test_run_optimization_with_wrong_solver_profile(self):
+        cases = [
+            (dict(solver_profile='unknown'), 'solver_profile'),
+            (dict(tolerance=0), 'tolerance'),
+            (dict(max_number_of_iteration=0), 'max_number_of_iteration'),
+            (dict(deadline=-1), 'deadline'),
+        ]
+        for data, field_name in cases:
+            json_response = self.run_optimization(self.client, self.transport_network_obj.public_id, data=data,
+                                                  status_code=status.HTTP_400_BAD_REQUEST)
+            self.assertIn(field_name, json_response)
+        self.transport_network_obj.refresh_from_db()
+        self.assertIsNone(self.transport_network_obj.optimization_status)
+
+    @mock.patch('rqworkers.submission.get_queue')
+    def test_job_timeout_depends_on_deadline(self, mock_get_queue):
+        for deadline, job_timeout in [(None, settings.OPTIMIZER_JOB_TIMEOUT),
+                                      (60, 60 + settings.OPTIMIZER_DEADLINE_MARGIN)]:
+            solver_parameters = get_solver_parameters(deadline=deadline)
+            enqueue_optimization(self.transport_network_obj.public_id, None, solver_parameters)
+            self.assertEqual(mock_get_queue.return_value.enqueue.call_args[1]['job_timeout'], job_timeout)
+
+    @mock.patch('rqworkers.submission.get_queue')
+    def test_job_timeout_depends_on_queue_lane(self, mock_get_queue):
+        for lane in settings.OPTIMIZER_QUEUE_LANES:
+            enqueue_optimization(self.transport_network_obj.public_id, None, get_solver_parameters(), lane)
+            mock_get_queue.assert_called_with(lane['queue'])
+            self.assertEqual(mock_get_queue.return_value.enqueue.call_args[1]['job_timeout'], lane['job_timeout'])
+
+    @mock.patch('rqworkers.optimization.Optimizer')
+    def test_deadline_keeps_best_result(self, mock_optimizer):
+        mock_optimizer.return_value.f_opt = [28]
+        mock_optimizer.return_value.internal_optimization.return_value = mock.MagicMock(
+            x=[10], success=True, status=1, message='', constr_violation=0, fun=100)
+        mock_optimizer.return_value.external_optimization_tolerance.return_value = False
+        mock_optimizer.get_better_result.side_effect = lambda result_list: result_list[-1]
+
+        opt_obj, iteration_number, deadline_reached = run_network_optimization(
+            None, None, None, None, max_number_of_iteration=5, deadline=0)
+
+        self.assertTrue(deadline_reached)
+        self.assertEqual(iteration_number, 1)
+        self.assertEqual(opt_obj.better_res, ([10], True, 1, '', 0, 100))
+        mock_optimizer.status_optimization.assert_called_once()
+
+        _, iteration_number, deadline_reached = run_network_optimization(
+            None, None, None, None, max_number_of_iteration=5, deadline=None)
+
+        self.assertFalse(deadline_reached)
+        self.assertEqual(iteration_number, 6)
+
+
+class OptimizationQueueLaneTest(BaseTestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.create_data(city_number=1, scene_number=1, passenger=True, transport_mode_number=1,
+                         transport_network_number=1, route_number=2)
+        self.transport_network_obj = TransportNetwork.objects.select_related('scene__city').first()
+
+    def test_estimate_optimization_cost(self):
+        city_obj = self.transport_network_obj.scene.city
+        node_number = len(city_obj.demand_matrix_header)
+        trip_number = np.count_nonzero(city_obj.demand_matrix)
+
+        self.assertEqual(estimate_optimization_cost(city_obj, 2, 1), trip_number * 2)
+        self.assertEqual(estimate_optimization_cost(city_obj, 2, 3, max_number_of_iteration=5), trip_number * 30)
+
+        city_obj.demand_matrix = None
+        self.assertEqual(estimate_optimization_cost(city_obj, 2, 1), node_number ** 2 * 2)
+
+    def test_get_queue_lane(self):
+        fast_lane, heavy_lane = settings.OPTIMIZER_QUEUE_LANES
+        self.assertEqual(get_queue_lane(0), fast_lane)
+        self.assertEqual(get_queue_lane(fast_lane['max_cost']), fast_lane)
+        self.assertEqual(get_queue_lane(fast_lane['max_cost'] + 1), heavy_lane)
+
+    @mock.patch('rqworkers.submission.enqueue_optimization')
+    def test_run_optimization_records_predicted_cost(self, mock_enqueue_optimization):
+        mock_enqueue_optimization.return_value.id = str(uuid.uuid4())
+        city_obj = self.transport_network_obj.scene.city
+        predicted_cost = estimate_optimization_cost(city_obj, 2, 1, get_solver_parameters()['max_number_of_iteration'])
+
+        lane_list = [dict(settings.OPTIMIZER_QUEUE_LANES[0], max_cost=predicted_cost - 1),
+                     settings.OPTIMIZER_QUEUE_LANES[1]]
+        with self.settings(OPTIMIZER_QUEUE_LANES=lane_list):
+            json_response = self.run_optimization(self.client, self.transport_network_obj.public_id)
+
+        heavy_lane = settings.OPTIMIZER_QUEUE_LANES[1]
+        mock_enqueue_optimization.assert_called_once_with(self.transport_network_obj.public_id, None,
+                                                          get_solver_parameters(), heavy_lane, job_id=mock.ANY)
+        self.assertEqual(json_response['optimization_predicted_cost'], predicted_cost)
+        self.assertEqual(json_response['optimization_queue'], heavy_lane['queue'])
+        self.transport_network_obj.refresh_from_db()
+        self.assertEqual(self.transport_network_obj.optimization_predicted_cost, predicted_cost)
+        self.assertEqual(self.transport_network_obj.optimization_queue, heavy_lane['queue'])
+
+
+class OptimizerWorkerTest(BaseTestCase):
+
+    def test_preload_modules(self):
+        preload_modules()
+        for module_name in PRELOADED_MODULES:
+            self.assertIn(module_name, sys.modules)
+
+    def test_in_process_worker_reports_startup_latency(self):
+        connection = get_connection()
+        queue = Queue('optimizer-worker-test', connection=connection)
+        job = queue.enqueue(get_solver_parameters, 'preview')
+
+        worker = InProcessOptimizerWorker([queue], connection=connection)
+        with mock.patch('rqworkers.optimizerWorker.register_job_worker') as mock_register_job_worker:
+            worker.work(burst=True)
+        mock_register_job_worker.assert_called_once_with(connection, mock.ANY, worker.name)
+
+        job.refresh()
+        self.assertEqual(job.get_status(), JobStatus.FINISHED)
+        self.assertDictEqual(job.result, get_solver_parameters('preview'))
+        self.assertGreaterEqual(job.meta['startup_latency'], 0)
+
+
+class FakeWorkerProcess:
+    last_pid = 1000
+
+    def __init__(self, target, args):
+        FakeWorkerProcess.last_pid += 1
+        self.pid = FakeWorkerProcess.last_pid
+        self.alive = False
+        self.exitcode = None
+        self.terminate_calls = 0
+
+    def start(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def terminate(self):
+        self.terminate_calls += 1
+        self.alive = False
+        self.exitcode = 0
+
+    def join(self, timeout=None):
+        pass
+
+
+class OptimizerWorkerPoolTest(BaseTestCase):
+
+    def setUp(self):
+        self.pool = OptimizerWorkerPool([settings.OPTIMIZER_QUEUE_NAME], 1, 3,
+                                        'rqworkers.optimizerWorker.OptimizerWorker',
+                                        process_factory=FakeWorkerProcess)
+
+    def scale(self, queued_job_number, states=None):
+        with mock.patch.object(self.pool, 'get_queued_job_number', return_value=queued_job_number), \
+                mock.patch.object(self.pool, 'get_worker_states', return_value=states or dict()):
+            self.pool.scale()
+
+    def test_get_desired_worker_number(self):
+        self.assertEqual(get_desired_worker_number(0, 0, 1, 4), 1)
+        self.assertEqual(get_desired_worker_number(2, 1, 1, 4), 3)
+        self.assertEqual(get_desired_worker_number(10, 2, 1, 4), 4)
+
+    def test_scale_with_queue_depth(self):
+        self.scale(10)
+        self.assertEqual(len(self.pool.processes), 3)
+
+        # one worker is busy and nothing is queued, idle workers are stopped
+        busy_pid, *idle_pids = self.pool.processes.keys()
+        states = {busy_pid: WorkerStatus.BUSY}
+        states.update({pid: WorkerStatus.IDLE for pid in idle_pids})
+        self.scale(0, states)
+        self.assertEqual(self.pool.stopping_pids, set(idle_pids))
+        self.assertTrue(self.pool.processes[busy_pid].is_alive())
+
+        self.pool.reap_workers()
+        self.assertEqual(list(self.pool.processes.keys()), [busy_pid])
+        self.assertEqual(self.pool.stopping_pids, set())
+
+    def test_crashed_worker_is_replaced(self):
+        self.scale(0)
+        crashed_process = list(self.pool.processes.values())[0]
+        crashed_process.alive = False
+        crashed_process.exitcode = 1
+
+        self.pool.reap_workers()
+        self.scale(0)
+
+        self.assertEqual(len(self.pool.processes), 1)
+        self.assertNotIn(crashed_process.pid, self.pool.processes)
+
+    def test_drain(self):
+        self.scale(2)
+        process_list = list(self.pool.processes.values())
+
+        self.pool.drain(timeout=1)
+
+        self.assertEqual(self.pool.processes, dict())
+        for process in process_list:
+            self.assertEqual(process.terminate_calls, 1)
+
+
+class IdempotentSubmissionTest(BaseTestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.create_data(city_number=1, scene_number=1, passenger=True, transport_mode_number=1,
+                         transport_network_number=2, route_number=1)
+        self.scene_obj = Scene.objects.first()
+        self.transport_network_obj = TransportNetwork.objects.order_by('id').first()
+
+    @mock.patch('rqworkers.submission.enqueue_optimization')
+    def test_run_optimization_with_idempotency_key(self, mock_enqueue_optimization):
+        json_response = self.run_optimization(self.client, self.transport_network_obj.public_id,
+                                              HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertFalse(json_response['duplicate'])
+        self.transport_network_obj.refresh_from_db()
+        job_id = self.transport_network_obj.job_id
+        mock_enqueue_optimization.assert_called_once_with(self.transport_network_obj.public_id, None,
+                                                          get_solver_parameters(), settings.OPTIMIZER_QUEUE_LANES[0],
+                                                          job_id=job_id)
+
+        # retry returns the queued job
+        json_response = self.run_optimization(self.client, self.transport_network_obj.public_id,
+                                              status_code=status.HTTP_200_OK, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertTrue(json_response['duplicate'])
+        self.assertEqual(json_response['job_id'], str(job_id))
+        self.assertEqual(json_response['optimization_status'], TransportNetwork.STATUS_QUEUED)
+
+        # the same key is a duplicate after optimization finished
+        TransportNetwork.objects.filter(pk=self.transport_network_obj.pk).update(
+            optimization_status=TransportNetwork.STATUS_FINISHED)
+        json_response = self.run_optimization(self.client, self.transport_network_obj.public_id,
+                                              status_code=status.HTTP_200_OK, HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertTrue(json_response['duplicate'])
+        self.assertEqual(mock_enqueue_optimization.call_count, 1)
+
+        self.run_optimization(self.client, self.transport_network_obj.public_id, HTTP_IDEMPOTENCY_KEY='key-2')
+        self.assertEqual(mock_enqueue_optimization.call_count, 2)
+
+        json_response = self.run_optimization(self.client, self.transport_network_obj.public_id,
+                                              status_code=status.HTTP_400_BAD_REQUEST, HTTP_IDEMPOTENCY_KEY='key-3')
+        self.assertIn('queued or processing', json_response[0])
+
+    @mock.patch('rqworkers.submission.enqueue_optimization')
+    def test_run_optimization_of_scene_with_idempotency_key(self, mock_enqueue_optimization):
+        json_response = self.scenes_run_optimization_action(self.client, self.scene_obj.public_id,
+                                                            HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertFalse(json_response['duplicate'])
+        group_id = json_response['group_id']
+
+        json_response = self.scenes_run_optimization_action(self.client, self.scene_obj.public_id,
+                                                            status_code=status.HTTP_200_OK,
+                                                            HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertTrue(json_response['duplicate'])
+        self.assertEqual(json_response['group_id'], group_id)
+        self.assertEqual(json_response['total'], 2)
+        self.assertEqual(mock_enqueue_optimization.call_count, 2)
+
+    def test_submission_is_released_when_enqueue_fails(self):
+        transport_network_obj = TransportNetwork.objects.select_related('scene__city', 'scene__passenger').get(
+            pk=self.transport_network_obj.pk)
+        with mock.patch('rqworkers.submission.enqueue_optimization', side_effect=ConnectionError('redis is down')):
+            with self.assertRaises(ConnectionError):
+                submit_optimization(transport_network_obj, idempotency_key='key-1')
+
+        self.transport_network_obj.refresh_from_db()
+        self.assertIsNone(self.transport_network_obj.optimization_status)
+        self.assertIsNone(self.transport_network_obj.job_id)
+        self.assertIsNone(self.transport_network_obj.optimization_idempotency_key)
+
+
+class ConcurrentSubmissionTest(TransactionTestCase):
+    """ submissions run in threads with their own database connection, so test can not run inside a transaction """
+    create_data = BaseTestCase.create_data
+
+    def setUp(self):
+        self.create_data(city_number=1, scene_number=1, passenger=True, transport_mode_number=1,
+                         transport_network_number=1, route_number=1)
+        self.transport_network_obj = TransportNetwork.objects.first()
+
+    @mock.patch('rqworkers.submission.enqueue_optimization')
+    def test_parallel_submissions_enqueue_one_job(self, mock_enqueue_optimization):
+        thread_number = 8
+        barrier = threading.Barrier(thread_number)
+        outcomes = []
+
+        def submit():
+            try:
+                transport_network_obj = TransportNetwork.objects.select_related('scene__city', 'scene__passenger').get(
+                    pk=self.transport_network_obj.pk)
+                barrier.wait()
+                try:
+                    submit_optimization(transport_network_obj, idempotency_key='key-1')
+                    outcomes.append('submitted')
+                except OptimizationAlreadySubmitted as e:
+                    outcomes.append('duplicate' if e.duplicate else 'rejected')
+            finally:
+                connection.close()
+
+        thread_list = [threading.Thread(target=submit) for _ in range(thread_number)]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+
+        self.assertEqual(outcomes.count('submitted'), 1)
+        self.assertEqual(outcomes.count('duplicate'), thread_number - 1)
+        mock_enqueue_optimization.assert_called_once()
+        self.transport_network_obj.refresh_from_db()
+        self.assertEqual(self.transport_network_obj.optimization_status, TransportNetwork.STATUS_QUEUED)
+        self.assertEqual(mock_enqueue_optimization.call_args[1]['job_id'], self.transport_network_obj.job_id)
+
+
+class OptimizationResultReuseTest(BaseTestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.create_data(city_number=1, scene_number=1, passenger=True, transport_mode_number=1,
+                         transport_network_number=1, route_number=3)
+        self.transport_network_obj = TransportNetwork.objects.first()
+        self.set_results(self.transport_network_obj)
+
+    def set_results(self, transport_network_obj):
+        transport_mode_obj = TransportMode.objects.first()
+        transport_mode = SidermitTransportMode(transport_mode_obj.name, 1, 8.61, 0.15, 0, 20, 2.5, 150, 160, 0.7, 0,
+                                               4, 28)
+        overall_results = dict(VRC=1, operators_cost=2, infrastructure_cost=3, users_cost=4, travel_time_on_board=5,
+                               waiting_time=6, access_time=7, transfers=8, vehicles_mode={transport_mode: 9},
+                               vehicle_capacity_mode={transport_mode: 10}, lines_mode={transport_mode: 11})
+        route_obj_list = list(transport_network_obj.route_set.all())
+        network_results = [(route_obj.name, 1, 2, 3, 4, 5, 6, 7, [(0, 1, 0.5)], [(1, 0, 0.25)]) for route_obj in
+                           route_obj_list]
+        input_fingerprint = get_optimization_input_fingerprint(transport_network_obj, [transport_mode_obj],
+                                                               route_obj_list,
+                                                               get_optimizer_parameters(get_solver_parameters()))
+        save_optimization_results(transport_network_obj, overall_results, network_results,
+                                  input_fingerprint=input_fingerprint)
+        transport_network_obj.optimization_status = TransportNetwork.STATUS_FINISHED
+        transport_network_obj.save()
+
+    def get_route_results(self, transport_network_obj):
+        return sorted(OptimizationResultPerRouteDetail.objects.filter(
+            opt_route__transport_network=transport_network_obj).values_list(
+            'opt_route__route__name', 'opt_route__frequency', 'direction', 'origin_node', 'destination_node',
+            'lambda_value'))
+
+    @mock.patch('rqworkers.submission.enqueue_optimization')
+    def test_results_are_copied_when_inputs_are_equal(self, mock_enqueue_optimization):
+        new_transport_network_obj = clone_transport_network(TransportNetwork.objects.get(
+            pk=self.transport_network_obj.pk))
+
+        json_response = self.run_optimization(self.client, new_transport_network_obj.public_id)
+
+        mock_enqueue_optimization.assert_not_called()
+        self.assertTrue(json_response['cache_hit'])
+        self.assertEqual(json_response['optimization_status'], TransportNetwork.STATUS_FINISHED)
+        self.assertIsNotNone(json_response['optimization_ran_at'])
+        self.assertListEqual(self.get_route_results(new_transport_network_obj),
+                             self.get_route_results(self.transport_network_obj))
+        opt_result_obj = OptimizationResult.objects.get(transport_network=new_transport_network_obj)
+        self.assertEqual(opt_result_obj.input_fingerprint,
+                         OptimizationResult.objects.get(transport_network=self.transport_network_obj).input_fingerprint)
+        self.assertEqual(OptimizationResultPerMode.objects.get(transport_network=new_transport_network_obj).l, 11)
+        # results point to routes of the new network
+        self.assertFalse(OptimizationResultPerRoute.objects.filter(transport_network=new_transport_network_obj).exclude(
+            route__transport_network=new_transport_network_obj).exists())
+
+    def test_results_are_not_copied_when_submission_is_cancelled_after_claim(self):
+        new_transport_network_obj = clone_transport_network(TransportNetwork.objects.get(
+            pk=self.transport_network_obj.pk))
+
+        def cancel_after_claim(*args, **kwargs):
+            claim_transport_network(*args, **kwargs)
+            TransportNetwork.objects.filter(pk=new_transport_network_obj.pk).update(
+                optimization_status=None, name='new name')
+
+        with mock.patch('rqworkers.submission.claim_transport_network', side_effect=cancel_after_claim):
+            json_response = self.run_optimization(self.client, new_transport_network_obj.public_id)
+
+        self.assertFalse(json_response['cache_hit'])
+        self.assertIsNone(json_response['optimization_status'])
+        new_transport_network_obj.refresh_from_db()
+        self.assertIsNone(new_transport_network_obj.optimization_status)
+        self.assertIsNone(new_transport_network_obj.optimization_ran_at)
+        self.assertEqual(new_transport_network_obj.name, 'new name')
+        self.assertFalse(OptimizationResult.objects.filter(transport_network=new_transport_network_obj).exists())
+
+    @mock.patch('rqworkers.submission.enqueue_optimization')
+    def test_results_are_not_copied_when_inputs_are_different(self, mock_enqueue_optimization):
+        mock_enqueue_optimization.return_value.id = str(uuid.uuid4())
+        new_transport_network_obj = clone_transport_network(TransportNetwork.objects.get(
+            pk=self.transport_network_obj.pk))
+        Route.objects.filter(transport_network=new_transport_network_obj, name='route 0').update(
+            stops_sequence_i='2,1')
+
+        json_response = self.run_optimization(self.client, new_transport_network_obj.public_id)
+
+        mock_enqueue_optimization.assert_called_once_with(new_transport_network_obj.public_id, None,
+                                                          get_solver_parameters(), settings.OPTIMIZER_QUEUE_LANES[0],
+                                                          job_id=mock.ANY)
+        self.assertFalse(json_response['cache_hit'])
+        self.assertEqual(json_response['optimization_status'], TransportNetwork.STATUS_QUEUED)
+        self.assertFalse(OptimizationResult.objects.filter(transport_network=new_transport_network_obj).exists())
+
+    @mock.patch('rqworkers.submission.enqueue_optimization')
+    def test_results_are_not_copied_when_source_inputs_changed(self, mock_enqueue_optimization):
+        scene_obj = clone_scene(Scene.objects.get(pk=self.transport_network_obj.scene_id))
+        new_transport_network_obj = scene_obj.transportnetwork_set.get()
+        # source keeps the fingerprint computed with the previous name
+        TransportMode.objects.filter(scene_id=self.transport_network_obj.scene_id).update(name='new name')
+
+        json_response = self.run_optimization(self.client, new_transport_network_obj.public_id)
+
+        mock_enqueue_optimization.assert_called_once()
+        self.assertFalse(json_response['cache_hit'])
+        self.assertEqual(json_response['optimization_status'], TransportNetwork.STATUS_QUEUED)
+        self.assertIsNone(OptimizationResult.objects.get(
+            transport_network=self.transport_network_obj).input_fingerprint)
+
+    def test_fingerprint_depends_on_inputs(self):
+        def get_fingerprint():
+            transport_network_obj = TransportNetwork.objects.select_related('scene__city', 'scene__passenger').get(
+                pk=self.transport_network_obj.pk)
+            return get_optimization_input_fingerprint(
+                transport_network_obj, transport_network_obj.scene.transportmode_set.all(),
+                transport_network_obj.route_set.all(), get_optimizer_parameters(get_solver_parameters()))
+
+        fingerprint_list = [get_fingerprint()]
+        self.assertEqual(get_fingerprint(), fingerprint_list[0])
+
+        Passenger.objects.update(va=5)
+        fingerprint_list.append(get_fingerprint())
+        TransportMode.objects.update(co=1)
+        fingerprint_list.append(get_fingerprint())
+        Route.objects.filter(name='route 0').update(name='route 10')
+        fingerprint_list.append(get_fingerprint())
+        city_obj = City.objects.first()
+        city_obj.demand_matrix = np.zeros((9, 9))
+        city_obj.save()
+        fingerprint_list.append(get_fingerprint())
+
+        self.assertEqual(len(set(fingerprint_list)), len(fingerprint_list))
+
+
+class SidermitCacheTest(BaseTestCase):
+
+    def setUp(self):
+        self.city_obj = self.create_data(city_number=1)[0]
+        sidermit_cache.clear_local()
+        sidermit_cache.shared.clear()
+
+    @mock.patch('storage.cache.Graph.build_from_content', wraps=Graph.build_from_content)
+    def test_graph_is_parsed_once(self, mock_build_from_content):
+        graph_obj = self.city_obj.get_sidermit_graph()
+
+        self.assertIs(graph_obj, City.objects.get(pk=self.city_obj.pk).get_sidermit_graph())
+        mock_build_from_content.assert_called_once()
+
+    @mock.patch('storage.cache.Graph.build_from_content', wraps=Graph.build_from_content)
+    def test_graph_is_loaded_from_shared_cache(self, mock_build_from_content):
+        graph_obj = self.city_obj.get_sidermit_graph()
+        # simulate another process
+        sidermit_cache.clear_local()
+        shared_graph_obj = self.city_obj.get_sidermit_graph()
+
+        mock_build_from_content.assert_called_once()
+        self.assertIsNot(graph_obj, shared_graph_obj)
+        self.assertEqual(graph_obj.export_graph(GraphContentFormat.PAJEK),
+                         shared_graph_obj.export_graph(GraphContentFormat.PAJEK))
+
+    @mock.patch('storage.cache.Demand.build_from_content', wraps=Demand.build_from_content)
+    def test_demand_is_loaded_from_shared_cache(self, mock_build_from_content):
+        graph_obj = self.city_obj.get_sidermit_graph()
+        demand_obj = self.city_obj.get_sidermit_demand_matrix(graph_obj)
+        self.assertIs(demand_obj, self.city_obj.get_sidermit_demand_matrix(graph_obj))
+
+        sidermit_cache.clear_local()
+        shared_demand_obj = self.city_obj.get_sidermit_demand_matrix(graph_obj)
+
+        mock_build_from_content.assert_called_once()
+        self.assertEqual(demand_obj.get_total_trips(), shared_demand_obj.get_total_trips())
+        self.assertDictEqual(demand_obj.get_matrix(), shared_demand_obj.get_matrix())
+
+    def test_cache_is_invalidated_when_city_is_updated(self):
+        city_obj = City.objects.get(pk=self.city_obj.pk)
+        graph_key = sidermit_cache.get_graph_key(city_obj.graph)
+        demand_key = sidermit_cache.get_demand_key(city_obj.graph, city_obj.demand_matrix)
+        city_obj.get_sidermit_demand_matrix(city_obj.get_sidermit_graph())
+        self.assertIn(graph_key, sidermit_cache.local)
+        self.assertIn(demand_key, sidermit_cache.local)
+
+        # name does not change graph or demand
+        city_obj.name = 'new name'
+        city_obj.save()
+        self.assertIn(graph_key, sidermit_cache.local)
+        self.assertIn(demand_key, sidermit_cache.local)
+
+        city_obj.graph = Graph.build_from_parameters(2, 1, 1, 1).export_graph(GraphContentFormat.PAJEK)
+        city_obj.demand_matrix = None
+        city_obj.save()
+        self.assertNotIn(graph_key, sidermit_cache.local)
+        self.assertNotIn(demand_key, sidermit_cache.local)
+        self.assertIsNone(sidermit_cache.shared.get(graph_key))
+        self.assertIsNone(sidermit_cache.shared.get(demand_key))
+
+
+class ConditionalGetTest(BaseTestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.city_obj = self.create_data(city_number=1, scene_number=1, passenger=True, transport_mode_number=1,
+                                         transport_network_number=1, route_number=1)[0]
+        self.scene_obj = self.city_obj.scene_set.all()[0]
+        self.transport_network_obj = TransportNetwork.objects.first()
+
+    def conditional_get(self, url, etag, status_code=status.HTTP_304_NOT_MODIFIED):
+        return self._make_request(self.client, self.GET_REQUEST, url, dict(), status_code, json_process=False,
+                                  HTTP_IF_NONE_MATCH=etag)
+
+    def get_versions(self):
+        return (City.objects.get(pk=self.city_obj.pk).version, Scene.objects.get(pk=self.scene_obj.pk).version,
+                TransportNetwork.objects.get(pk=self.transport_network_obj.pk).version)
+
+    def test_not_modified_transport_network(self):
+        url = reverse('transport-networks-detail', kwargs=dict(public_id=self.transport_network_obj.public_id))
+        response = self._make_request(self.client, self.GET_REQUEST, url, dict(), status.HTTP_200_OK,
+                                      json_process=False)
+        self.assertEqual(response['ETag'], '"1"')
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(1):
+            response = self.conditional_get(url, response['ETag'])
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], '"1"')
+
+        self.transport_network_partial_update(self.client, self.transport_network_obj.public_id,
+                                              dict(name='new name', route_set=[]))
+
+        # network, its scene and its city are part of the payload of each other
+        self.assertTupleEqual(self.get_versions(), (2, 2, 2))
+        response = self.conditional_get(url, '"1"', status_code=status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], '"2"')
+        self.assertEqual(json.loads(response.content)['name'], 'new name')
+
+    @mock.patch('rqworkers.submission.cancel_job')
+    def test_optimization_status_change_bumps_versions(self, mock_cancel_job):
+        TransportNetwork.objects.filter(pk=self.transport_network_obj.pk).update(
+            optimization_status=TransportNetwork.STATUS_QUEUED, job_id=uuid.uuid4())
+        self.cancel_optimization(self.client, self.transport_network_obj.public_id)
+
+        self.assertTupleEqual(self.get_versions(), (2, 2, 2))
+        url = reverse('scenes-detail', kwargs=dict(public_id=self.scene_obj.public_id))
+        self.conditional_get(url, '"2"')
+        self.conditional_get(reverse('scenes-global-results', kwargs=dict(public_id=self.scene_obj.public_id)), '"2"')
+
+    def test_transport_mode_update_bumps_transport_networks(self):
+        transport_mode_obj = self.scene_obj.transportmode_set.all()[0]
+        data = TransportModeSerializer(transport_mode_obj).data
+        data['name'] = 'new name'
+        self.scenes_transportmode_update(self.client, self.scene_obj.public_id, transport_mode_obj.public_id, data)
+
+        self.assertTupleEqual(self.get_versions(), (2, 2, 2))
+        url = reverse('transport-networks-results', kwargs=dict(public_id=self.transport_network_obj.public_id))
+        self.conditional_get(url, '"1"', status_code=status.HTTP_200_OK)
+
+    def test_save_does_not_overwrite_version(self):
+        transport_network_obj = TransportNetwork.objects.get(pk=self.transport_network_obj.pk)
+        self.transport_network_partial_update(self.client, self.transport_network_obj.public_id,
+                                              dict(name='new name', route_set=[]))
+
+        # instance was loaded before the bump
+        transport_network_obj.optimization_error_message = 'error'
+        transport_network_obj.save()
+
+        self.assertEqual(self.get_versions()[2], 2)
+
+    def test_not_modified_city_list(self):
+        url = reverse('cities-list')
+        response = self._make_request(self.client, self.GET_REQUEST, url, dict(), status.HTTP_200_OK,
+                                      json_process=False)
+        self.conditional_get(url, response['ETag'])
+
+        # deleted cities do not bump any version, list etag changes anyway
+        self.create_data(city_number=1)[0].delete()
+        self.conditional_get(url, response['ETag'])
+        City.objects.filter(pk=self.city_obj.pk).delete()
+        self.conditional_get(url, response['ETag'], status_code=status.HTTP_200_OK)
+
+    def test_not_modified_with_unknown_object(self):
+        url = reverse('transport-networks-detail', kwargs=dict(public_id=uuid.uuid4()))
+        self.conditional_get(url, '"1"', status_code=status.HTTP_404_NOT_FOUND)
+
 
 class ValidationAPITest(BaseTestCase):
 
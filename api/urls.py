@@ -3,13 +3,14 @@ from rest_framework import routers
 from rest_framework_nested import routers as nested_routers
 
 from api.views import CityViewSet, SceneViewSet, TransportNetworkViewSet, TransportModeViewSet, \
-    validate_transport_mode, recent_optimizations
+    ParameterSweepViewSet, validate_transport_mode, recent_optimizations
 
 # Routers provide an easy way of automatically determining the URL conf.
 router = routers.DefaultRouter()
 router.register('cities', CityViewSet, basename='cities')
 router.register('scenes', SceneViewSet, basename='scenes')
 router.register('transport_networks', TransportNetworkViewSet, basename='transport-networks')
+router.register('parameter_sweeps', ParameterSweepViewSet, basename='parameter-sweeps')
 
 scene_transport_mode_router = nested_routers.NestedDefaultRouter(router, 'scenes', lookup='scene')
 scene_transport_mode_router.register('transport_modes', TransportModeViewSet, basename='transport-modes')
@@ -1,29 +1,115 @@
+import functools
+import hashlib
+import json
 import logging
-import uuid
 
-from django.utils import timezone
-from django_rq.queues import get_connection
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import OuterRef, Subquery, Count, Max, IntegerField, DateTimeField
+from django.db.models.functions import Coalesce
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from rest_framework import viewsets, status, mixins
 from rest_framework.decorators import action, api_view
-from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.exceptions import ParseError, ValidationError, NotFound
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
-from rq import cancel_job
-from rq.command import send_kill_horse_command
-from rq.worker import Worker, WorkerStatus
 from sidermit.city import Graph, GraphContentFormat, Demand
 from sidermit.exceptions import SIDERMITException
 from sidermit.publictransportsystem import TransportNetwork as SidermitTransportNetwork
 
-from api.serializers import CitySerializer, SceneSerializer, TransportModeSerializer, \
+from api.pagination import CitySummaryPagination
+from api.serializers import CitySummarySerializer, CitySerializer, SceneSerializer, TransportModeSerializer, \
     TransportNetworkSerializer, RecentOptimizationSerializer, \
-    TransportNetworkOptimizationSerializer, OptimizationResultPerRoute, OptimizationResultPerRouteSerializer
-from api.utils import get_network_descriptor
-from rqworkers.jobs import optimize_transport_network
-from storage.models import City, Scene, Passenger, TransportMode, TransportNetwork
+    TransportNetworkOptimizationSerializer, OptimizationResultPerRoute, OptimizationResultPerRouteSerializer, \
+    ParameterSweepSerializer, SolverProfileSerializer
+from rqworkers.optimization import get_solver_parameters
+from rqworkers.progress import get_optimization_progress
+from rqworkers.submission import submit_optimization, create_optimization_group, get_optimization_group, \
+    get_optimization_group_progress, submit_parameter_sweep, reserve_optimization_group, OptimizationAlreadySubmitted, \
+    cancel_optimizations
+from storage.cloning import clone_city, clone_scene, clone_transport_network
+from storage.models import City, Scene, TransportMode, TransportNetwork, ParameterSweep
+from storage.sweeps import get_sweep_points, get_sweep_result_table
+from storage.versions import bump_versions
+from storage.utils import get_network_descriptor, get_demand_matrix_header, get_demand_matrix_array, \
+    read_demand_matrix_csv, read_demand_matrix_csv_file
 
 logger = logging.getLogger(__name__)
 
 
+def get_request_solver_parameters(request):
+    """ solver budget given in request data, see SolverProfileSerializer """
+    solver_profile_serializer_obj = SolverProfileSerializer(data=request.data)
+    solver_profile_serializer_obj.is_valid(raise_exception=True)
+    data = solver_profile_serializer_obj.validated_data
+
+    return get_solver_parameters(profile=data.get('solver_profile'), tolerance=data.get('tolerance'),
+                                 max_number_of_iteration=data.get('max_number_of_iteration'),
+                                 deadline=data.get('deadline'))
+
+
+def get_request_idempotency_key(request):
+    """ value of Idempotency-Key header, retries of a request with the same key are not enqueued again """
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= 100:
+        raise ValidationError('Idempotency-Key header has to have between 1 and 100 characters')
+
+    return idempotency_key
+
+
+def get_object_version(viewset):
+    """ :return: etag and last modification of the object requested to viewset, None if it does not exist """
+    try:
+        version = viewset.queryset.model.objects.filter(
+            **{viewset.lookup_field: viewset.kwargs[viewset.lookup_field]}).values_list('version', 'updated_at').first()
+    except DjangoValidationError:
+        return None
+    if version is None:
+        return None
+
+    return quote_etag(str(version[0])), version[1]
+
+
+def get_city_list_version(viewset):
+    """ a deleted city does not change any version, so etag is a hash of listed versions and there is no date """
+    version_list = list(viewset.get_queryset().prefetch_related(None).values_list('public_id', 'version'))
+    digest = hashlib.sha1(json.dumps(version_list, default=str).encode('utf-8')).hexdigest()
+
+    return quote_etag(digest), None
+
+
+def conditional_get(get_version):
+    """
+    Decorator of viewset actions, they answer 304 Not Modified without serializing anything when If-None-Match or
+    If-Modified-Since headers match the current version of the data. Responses have ETag and Last-Modified headers.
+
+    :param get_version: function with viewset as argument that returns etag and last modification or None
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            version = get_version(self)
+            if version is None:
+                # action answers not found
+                return method(self, request, *args, **kwargs)
+
+            etag, last_modified = version
+            last_modified = None if last_modified is None else int(last_modified.timestamp())
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = method(self, request, *args, **kwargs)
+            if response.status_code in [status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED]:
+                response['ETag'] = etag
+                if last_modified is not None:
+                    response['Last-Modified'] = http_date(last_modified)
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
 class CityViewSet(viewsets.ModelViewSet):
     """
     API endpoint to work with cities
@@ -32,9 +118,17 @@ class CityViewSet(viewsets.ModelViewSet):
     lookup_field = 'public_id'
     queryset = City.objects.prefetch_related('scene_set__transportmode_set',
                                              'scene_set__passenger',
-                                             'scene_set__transportnetwork_set').order_by('-created_at')
+                                             'scene_set__transportnetwork_set__route_set__transport_mode').order_by(
+        '-created_at')
 
     def get_queryset(self):
+        if self.action in ['build_matrix_data', 'build_matrix_from_file', 'build_matrix_from_uploaded_file']:
+            # matrix actions only need city graph
+            return City.objects.only('public_id', 'name', 'graph')
+        if self.action in ['duplicate', 'destroy']:
+            # related objects are not serialized
+            return City.objects.all()
+
         queryset = super().get_queryset()
         limit = self.request.query_params.get('limit')
         if limit is not None:
@@ -45,66 +139,52 @@ class CityViewSet(viewsets.ModelViewSet):
 
         return queryset
 
-    @action(detail=True, methods=['POST'])
-    def duplicate(self, request, public_id=None):
-        new_city_obj = self.get_object()
-        new_city_obj.id = None
-        new_city_obj.created_at = timezone.now()
-        new_city_obj.public_id = uuid.uuid4()
-        new_city_obj.name = '{0} copy'.format(new_city_obj.name)
-        new_city_obj.save()
-
-        for scene_obj in new_city_obj.scene_set.all():
-            transportmode_obj_list = scene_obj.transportmode_set.all()
-            transportnetwork_obj_list = scene_obj.transportnetwork_set.all()
-
-            scene_obj.id = None
-            scene_obj.created_at = timezone.now()
-            scene_obj.public_id = uuid.uuid4()
-            scene_obj.city = new_city_obj
-            scene_obj.save()
+    @conditional_get(get_city_list_version)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
-            try:
-                passenger_obj = scene_obj.passenger
-                passenger_obj.pk = None
-                passenger_obj.created_at = timezone.now()
-                passenger_obj.scene = scene_obj
-                passenger_obj.save()
-
-                scene_obj.passenger = passenger_obj
-                scene_obj.save()
-            except Passenger.DoesNotExist:
-                pass
+    @conditional_get(get_object_version)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
-            transport_mode_obj_dict = dict()
-            for transport_mode_obj in transportmode_obj_list:
-                previous_pk = transport_mode_obj.pk
-                transport_mode_obj.pk = None
-                transport_mode_obj.created_at = timezone.now()
-                transport_mode_obj.public_id = uuid.uuid4()
-                transport_mode_obj.scene = scene_obj
-                transport_mode_obj.save()
-                transport_mode_obj_dict[previous_pk] = transport_mode_obj
-
-            for transport_network_obj in transportnetwork_obj_list:
-                route_obj_list = transport_network_obj.route_set.all()
-
-                transport_network_obj.pk = None
-                transport_network_obj.scene = scene_obj
-                transport_network_obj.optimization_status = None
-                transport_network_obj.optimization_ran_at = None
-                transport_network_obj.created_at = timezone.now()
-                transport_network_obj.public_id = uuid.uuid4()
-                transport_network_obj.save()
-
-                for route_obj in route_obj_list:
-                    route_obj.pk = None
-                    route_obj.transport_network = transport_network_obj
-                    route_obj.created_at = timezone.now()
-                    route_obj.transport_mode = transport_mode_obj_dict[route_obj.transport_mode.pk]
-                    route_obj.save()
-
-        new_city_obj.refresh_from_db()
+    def perform_update(self, serializer):
+        city_obj = serializer.save()
+        # cities with scenes can not be modified, so no scene payload changes
+        bump_versions(city_id_list=[city_obj.pk])
+
+    @action(detail=False, methods=['GET'], pagination_class=CitySummaryPagination)
+    def summary(self, request):
+        """
+        lightweight city list with scene and transport network counts. Counts are correlated subqueries, so they are
+        only evaluated for cities in the requested page
+        """
+
+        def aggregate_by_city(queryset, city_lookup, aggregate, output_field):
+            queryset = queryset.filter(**{city_lookup: OuterRef('pk')}).order_by().values(city_lookup)
+            return Subquery(queryset.annotate(value=aggregate).values('value'), output_field=output_field)
+
+        def count_by_city(queryset, city_lookup):
+            return Coalesce(aggregate_by_city(queryset, city_lookup, Count('pk'), IntegerField()), 0)
+
+        annotations = dict(
+            scene_count=count_by_city(Scene.objects.all(), 'city'),
+            transport_network_count=count_by_city(TransportNetwork.objects.all(), 'scene__city'),
+            last_optimization_ran_at=aggregate_by_city(TransportNetwork.objects.all(), 'scene__city',
+                                                       Max('optimization_ran_at'), DateTimeField()))
+        for status_value, _ in TransportNetwork.status_choices:
+            annotations['{0}_count'.format(status_value)] = count_by_city(
+                TransportNetwork.objects.filter(optimization_status=status_value), 'scene__city')
+
+        queryset = City.objects.only('public_id', 'created_at', 'name', 'n').annotate(**annotations)
+
+        page = self.paginate_queryset(queryset)
+        serializer = CitySummarySerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['POST'])
+    def duplicate(self, request, public_id=None):
+        new_city_obj = clone_city(self.get_object())
+        new_city_obj = self.queryset.get(pk=new_city_obj.pk)
 
         return Response(CitySerializer(new_city_obj).data, status=status.HTTP_201_CREATED)
 
@@ -169,20 +249,11 @@ class CityViewSet(viewsets.ModelViewSet):
             beta = float(request.query_params.get('beta'))
 
             city_obj = self.get_object()
-            graph_obj = Graph.build_from_content(city_obj.graph, GraphContentFormat.PAJEK)
+            graph_obj = city_obj.get_sidermit_graph()
 
             demand_obj = Demand.build_from_parameters(graph_obj, y, a, alpha, beta)
-            demand_matrix = demand_obj.get_matrix()
-            # pass matrix dict to list of list
-            demand_matrix_data = []
-            size = len(demand_matrix.keys())
-            for i in range(size):
-                row = []
-                for j in range(size):
-                    row.append(round(demand_matrix[i][j], 2))
-                demand_matrix_data.append(row)
-
-            demand_matrix_header = [node_obj.name for node_obj in graph_obj.get_nodes()]
+            demand_matrix_data = get_demand_matrix_array(demand_obj, graph_obj).tolist()
+            demand_matrix_header = get_demand_matrix_header(graph_obj)
         except (ValueError, SIDERMITException) as e:
             raise ParseError(e)
         except TypeError:
@@ -195,34 +266,49 @@ class CityViewSet(viewsets.ModelViewSet):
     def build_matrix_from_file(self, request, public_id=None):
         try:
             content = request.data.get('content', '')
-            matrix = []
-            rows = content.split('\n')[1:]
-            for row in rows:
-                matrix.append([float(value) for value in row.split(',')[1:]])
 
             city_obj = self.get_object()
-            graph_obj = Graph.build_from_content(city_obj.graph, GraphContentFormat.PAJEK)
-
-            demand_obj = Demand.build_from_content(graph_obj, matrix)
-            demand_matrix = demand_obj.get_matrix()
-            # pass matrix dict to list of list
-            demand_matrix_data = []
-            size = len(demand_matrix.keys())
-            for i in range(size):
-                row = []
-                for j in range(size):
-                    row.append(round(demand_matrix[i][j], 2))
-                demand_matrix_data.append(row)
-
-            demand_matrix_header = [node_obj.name for node_obj in graph_obj.get_nodes()]
-        except SIDERMITException as e:
+            graph_obj = city_obj.get_sidermit_graph()
+
+            demand_matrix_data = read_demand_matrix_csv(content, graph_obj).tolist()
+            demand_matrix_header = get_demand_matrix_header(graph_obj)
+        except (ValueError, SIDERMITException) as e:
             raise ParseError(e)
-        except TypeError:
+        except (TypeError, AttributeError):
             raise ParseError('file format wrong')
 
         return Response({'demand_matrix': demand_matrix_data, 'demand_matrix_header': demand_matrix_header},
                         status.HTTP_200_OK)
 
+    @action(detail=True, methods=['POST'], parser_classes=[MultiPartParser])
+    def build_matrix_from_uploaded_file(self, request, public_id=None):
+        """
+        csv is uploaded as multipart file and saved as demand matrix of the city, so it is not limited by json size.
+        Matrix is not sent back, it is read with city data.
+        """
+        file_obj = request.FILES.get('file')
+        if file_obj is None:
+            raise ParseError('File can not be empty')
+
+        try:
+            city_obj = self.get_object()
+            if city_obj.scene_set.exists():
+                raise ValidationError('City "{0}" can not be modified because has scenes.'.format(city_obj.name))
+            graph_obj = city_obj.get_sidermit_graph()
+
+            city_obj.demand_matrix = read_demand_matrix_csv_file(file_obj, graph_obj)
+        except (ValueError, SIDERMITException) as e:
+            raise ParseError(e)
+        finally:
+            file_obj.close()
+
+        # matrix is not built from parameters anymore
+        city_obj.y = city_obj.a = city_obj.alpha = city_obj.beta = None
+        city_obj.save(update_fields=['demand_matrix', 'y', 'a', 'alpha', 'beta'])
+        bump_versions(city_id_list=[city_obj.pk])
+
+        return Response({'demand_matrix_header': get_demand_matrix_header(graph_obj)}, status.HTTP_200_OK)
+
 
 class SceneViewSet(mixins.RetrieveModelMixin, mixins.DestroyModelMixin, mixins.UpdateModelMixin,
                    mixins.CreateModelMixin, viewsets.GenericViewSet):
@@ -231,66 +317,44 @@ class SceneViewSet(mixins.RetrieveModelMixin, mixins.DestroyModelMixin, mixins.U
     """
     serializer_class = SceneSerializer
     lookup_field = 'public_id'
-    queryset = Scene.objects.select_related('passenger', 'city').prefetch_related('transportmode_set',
-                                                                                  'transportnetwork_set__route_set')
+    queryset = Scene.objects.select_related('passenger', 'city').prefetch_related(
+        'transportmode_set', 'transportnetwork_set__route_set__transport_mode')
 
-    @action(detail=True, methods=['POST'])
-    def duplicate(self, request, public_id=None):
-        now = timezone.now()
-        new_scene_obj = self.get_object()
+    def get_queryset(self):
+        if self.action == 'duplicate':
+            # related objects are copied by clone_scene
+            return Scene.objects.all()
+        elif self.action in ['run_optimization', 'optimization_group']:
+            return Scene.objects.select_related('city', 'passenger')
 
-        new_scene_obj.pk = None
-        new_scene_obj.created_at = now
-        new_scene_obj.public_id = uuid.uuid4()
-        new_scene_obj.name = '{0} copy'.format(new_scene_obj.name)
-        new_scene_obj.save()
+        return super().get_queryset()
 
-        try:
-            passenger_obj = new_scene_obj.passenger
-            passenger_obj.pk = None
-            passenger_obj.created_at = now
-            passenger_obj.scene = new_scene_obj
-            passenger_obj.save()
-
-            new_scene_obj.passenger = passenger_obj
-            new_scene_obj.save()
-        except Passenger.DoesNotExist:
-            pass
-
-        transport_mode_obj_dict = dict()
-        for transport_mode_obj in self.get_object().transportmode_set.all():
-            previous_pk = transport_mode_obj.pk
-            transport_mode_obj.pk = None
-            transport_mode_obj.created_at = now
-            transport_mode_obj.public_id = uuid.uuid4()
-            transport_mode_obj.scene = new_scene_obj
-            transport_mode_obj.save()
-            transport_mode_obj_dict[previous_pk] = transport_mode_obj
-
-        for transport_network_obj in self.get_object().transportnetwork_set.all():
-            route_obj_list = transport_network_obj.route_set.all()
-
-            transport_network_obj.pk = None
-            transport_network_obj.scene = new_scene_obj
-            transport_network_obj.optimization_status = None
-            transport_network_obj.optimization_ran_at = None
-            transport_network_obj.created_at = timezone.now()
-            transport_network_obj.public_id = uuid.uuid4()
-            transport_network_obj.save()
-
-            for route_obj in route_obj_list:
-                route_obj.pk = None
-                route_obj.transport_network = transport_network_obj
-                route_obj.created_at = timezone.now()
-                route_obj.transport_mode = transport_mode_obj_dict[route_obj.transport_mode.pk]
-                route_obj.save()
-
-        # update reference to return correct transport mode instances
-        new_scene_obj.refresh_from_db()
+    @conditional_get(get_object_version)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        scene_obj = serializer.save()
+        bump_versions(scene_id_list=[scene_obj.pk])
+
+    def perform_update(self, serializer):
+        scene_obj = serializer.save()
+        bump_versions(scene_id_list=[scene_obj.pk])
+
+    def perform_destroy(self, instance):
+        city_id = instance.city_id
+        instance.delete()
+        bump_versions(city_id_list=[city_id])
+
+    @action(detail=True, methods=['POST'])
+    def duplicate(self, request, public_id=None):
+        new_scene_obj = clone_scene(self.get_object())
+        new_scene_obj = self.queryset.get(pk=new_scene_obj.pk)
 
         return Response(SceneSerializer(new_scene_obj).data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['GET'])
+    @conditional_get(get_object_version)
     def global_results(self, request, public_id=None):
         """ summarize results of optimizations in all transport networks """
         scene_obj = self.get_object()
@@ -301,6 +365,75 @@ class SceneViewSet(mixins.RetrieveModelMixin, mixins.DestroyModelMixin, mixins.U
 
         return Response(response, status.HTTP_200_OK)
 
+    @action(detail=True, methods=['POST'])
+    def run_optimization(self, request, public_id=None):
+        """ submit every transport network of scene that is not queued or processing as a group """
+        scene_obj = self.get_object()
+        solver_parameters = get_request_solver_parameters(request)
+        idempotency_key = get_request_idempotency_key(request)
+        group_id = None
+        if idempotency_key is not None:
+            group_id, reserved = reserve_optimization_group(scene_obj, idempotency_key)
+            group = get_optimization_group(group_id)
+            if not reserved and group is not None:
+                response = dict(group_id=group_id, duplicate=True, **get_optimization_group_progress(group))
+                return Response(response, status.HTTP_200_OK)
+
+        transport_network_obj_list = list(TransportNetwork.objects.filter(scene=scene_obj, route__isnull=False).exclude(
+            optimization_status__in=[TransportNetwork.STATUS_QUEUED, TransportNetwork.STATUS_PROCESSING]).distinct(
+        ).order_by('created_at').prefetch_related('route_set'))
+        if len(transport_network_obj_list) == 0:
+            raise ValidationError('Scene does not have transport networks with routes ready to be optimized')
+
+        transport_mode_obj_list = list(scene_obj.transportmode_set.all())
+        submitted_transport_network_obj_list = []
+        transport_networks = []
+        for transport_network_obj in transport_network_obj_list:
+            # avoid querying the same scene, city and transport modes for each network
+            transport_network_obj.scene = scene_obj
+            try:
+                cache_hit = submit_optimization(transport_network_obj, transport_mode_obj_list=transport_mode_obj_list,
+                                                solver_parameters=solver_parameters, idempotency_key=idempotency_key)
+            except OptimizationAlreadySubmitted:
+                # another request submitted it after it was listed
+                continue
+            submitted_transport_network_obj_list.append(transport_network_obj)
+            transport_networks.append(dict(public_id=transport_network_obj.public_id,
+                                           optimization_status=transport_network_obj.optimization_status,
+                                           cache_hit=cache_hit))
+        group_id = create_optimization_group(scene_obj, submitted_transport_network_obj_list, group_id=group_id)
+
+        return Response(dict(group_id=group_id, duplicate=False, solver_parameters=solver_parameters,
+                             transport_networks=transport_networks), status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['POST'])
+    def cancel_optimization(self, request, public_id=None):
+        """ cancel every transport network of scene that is queued or processing """
+        scene_obj = self.get_object()
+        transport_network_obj_list = list(TransportNetwork.objects.filter(
+            scene=scene_obj, optimization_status__in=[TransportNetwork.STATUS_QUEUED,
+                                                      TransportNetwork.STATUS_PROCESSING]).order_by('created_at'))
+        for transport_network_obj in transport_network_obj_list:
+            transport_network_obj.scene = scene_obj
+        cancel_optimizations(transport_network_obj_list)
+
+        transport_networks = [dict(public_id=transport_network_obj.public_id,
+                                   optimization_status=transport_network_obj.optimization_status) for
+                              transport_network_obj in transport_network_obj_list]
+
+        return Response(dict(transport_networks=transport_networks), status.HTTP_200_OK)
+
+    @action(detail=True, methods=['GET'], url_path=r'optimization_groups/(?P<group_id>[^/.]+)')
+    def optimization_group(self, request, public_id=None, group_id=None):
+        scene_obj = self.get_object()
+        group = get_optimization_group(group_id)
+        if group is None or group['scene_public_id'] != str(scene_obj.public_id):
+            raise NotFound('Optimization group does not exist or it expired')
+
+        response = dict(group_id=group_id, created_at=group['created_at'], **get_optimization_group_progress(group))
+
+        return Response(response, status.HTTP_200_OK)
+
 
 class TransportModeViewSet(mixins.RetrieveModelMixin, mixins.DestroyModelMixin, mixins.UpdateModelMixin,
                            mixins.CreateModelMixin, viewsets.GenericViewSet):
@@ -311,6 +444,24 @@ class TransportModeViewSet(mixins.RetrieveModelMixin, mixins.DestroyModelMixin,
     lookup_field = 'public_id'
     queryset = TransportMode.objects.all()
 
+    @staticmethod
+    def bump_scene_versions(scene_id):
+        # routes of every transport network of the scene include their transport mode
+        bump_versions(scene_id_list=[scene_id], transport_network_scene_id_list=[scene_id])
+
+    def perform_create(self, serializer):
+        transport_mode_obj = serializer.save()
+        bump_versions(scene_id_list=[transport_mode_obj.scene_id])
+
+    def perform_update(self, serializer):
+        transport_mode_obj = serializer.save()
+        self.bump_scene_versions(transport_mode_obj.scene_id)
+
+    def perform_destroy(self, instance):
+        scene_id = instance.scene_id
+        instance.delete()
+        self.bump_scene_versions(scene_id)
+
 
 class TransportNetworkViewSet(mixins.RetrieveModelMixin, mixins.DestroyModelMixin, mixins.UpdateModelMixin,
                               mixins.CreateModelMixin, viewsets.GenericViewSet):
@@ -321,27 +472,40 @@ class TransportNetworkViewSet(mixins.RetrieveModelMixin, mixins.DestroyModelMixi
     lookup_field = 'public_id'
     queryset = TransportNetwork.objects.prefetch_related('route_set__transport_mode')
 
+    def get_queryset(self):
+        if self.action == 'duplicate':
+            # routes are copied by clone_transport_network
+            return TransportNetwork.objects.all()
+        if self.action == 'run_optimization':
+            # optimization inputs are needed to look for previous results
+            return super().get_queryset().select_related('scene__city', 'scene__passenger')
+        if self.action == 'cancel_optimization':
+            # scene is needed to publish status change
+            return super().get_queryset().select_related('scene')
+
+        return super().get_queryset()
+
+    @conditional_get(get_object_version)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        transport_network_obj = serializer.save()
+        bump_versions(transport_network_id_list=[transport_network_obj.pk])
+
+    def perform_update(self, serializer):
+        transport_network_obj = serializer.save()
+        bump_versions(transport_network_id_list=[transport_network_obj.pk])
+
+    def perform_destroy(self, instance):
+        scene_id = instance.scene_id
+        instance.delete()
+        bump_versions(scene_id_list=[scene_id])
+
     @action(detail=True, methods=['POST'])
     def duplicate(self, request, public_id=None):
-        now = timezone.now()
-        new_transport_network_obj = self.get_object()
-
-        new_transport_network_obj.pk = None
-        new_transport_network_obj.name = '{0} copy'.format(new_transport_network_obj.name)
-        new_transport_network_obj.optimization_status = None
-        new_transport_network_obj.optimization_ran_at = None
-        new_transport_network_obj.created_at = now
-        new_transport_network_obj.public_id = uuid.uuid4()
-        new_transport_network_obj.save()
-
-        for route_obj in self.get_object().route_set.all():
-            route_obj.pk = None
-            route_obj.transport_network = new_transport_network_obj
-            route_obj.created_at = now
-            route_obj.save()
-
-        # update reference to return correct transport mode instances
-        new_transport_network_obj.refresh_from_db()
+        new_transport_network_obj = clone_transport_network(self.get_object())
+        new_transport_network_obj = self.queryset.get(pk=new_transport_network_obj.pk)
 
         return Response(TransportNetworkSerializer(new_transport_network_obj).data, status=status.HTTP_201_CREATED)
 
@@ -411,21 +575,55 @@ class TransportNetworkViewSet(mixins.RetrieveModelMixin, mixins.DestroyModelMixi
 
     @action(detail=True, methods=['POST'])
     def run_optimization(self, request, public_id=None):
+        """
+        optional parameters: warm_start to start from frequencies of previous results,
+        warm_start_transport_network_public_id to take them from another transport network of the same scene and
+        solver budget (solver_profile, tolerance, max_number_of_iteration and deadline)
+        """
         transport_network_obj = self.get_object()
+        idempotency_key = get_request_idempotency_key(request)
 
+        # retry of a request that was already accepted
+        if idempotency_key is not None and transport_network_obj.optimization_idempotency_key == idempotency_key:
+            return self.duplicate_submission_response(transport_network_obj)
         if transport_network_obj.optimization_status in [TransportNetwork.STATUS_QUEUED,
                                                          TransportNetwork.STATUS_PROCESSING]:
             raise ValidationError("Transport network is queued or processing at this moment")
+        solver_parameters = get_request_solver_parameters(request)
 
-        transport_network_obj.optimization_status = TransportNetwork.STATUS_QUEUED
-        transport_network_obj.save()
-
-        # async task
-        job = optimize_transport_network.delay(transport_network_obj.public_id)
-
-        TransportNetwork.objects.filter(public_id=transport_network_obj.public_id).update(job_id=job.id)
+        warm_start_transport_network_obj = None
+        warm_start_transport_network_public_id = request.data.get('warm_start_transport_network_public_id')
+        if warm_start_transport_network_public_id is not None:
+            try:
+                warm_start_transport_network_obj = TransportNetwork.objects.get(
+                    scene_id=transport_network_obj.scene_id, public_id=warm_start_transport_network_public_id)
+            except (TransportNetwork.DoesNotExist, DjangoValidationError):
+                raise ValidationError('Warm start transport network does not exist in the same scene')
+        elif request.data.get('warm_start', False) is True:
+            warm_start_transport_network_obj = transport_network_obj
 
-        return Response(TransportNetworkSerializer(transport_network_obj).data, status.HTTP_201_CREATED)
+        try:
+            cache_hit = submit_optimization(transport_network_obj,
+                                            warm_start_transport_network_obj=warm_start_transport_network_obj,
+                                            solver_parameters=solver_parameters, idempotency_key=idempotency_key)
+        except OptimizationAlreadySubmitted as e:
+            # a concurrent request won the compare and set
+            if e.duplicate:
+                return self.duplicate_submission_response(transport_network_obj)
+            raise ValidationError(str(e))
+
+        data = TransportNetworkSerializer(transport_network_obj).data
+        data['cache_hit'] = cache_hit
+        data['duplicate'] = False
+        data['solver_parameters'] = solver_parameters
+        return Response(data, status.HTTP_201_CREATED)
+
+    @staticmethod
+    def duplicate_submission_response(transport_network_obj):
+        data = TransportNetworkSerializer(transport_network_obj).data
+        data['duplicate'] = True
+        data['job_id'] = transport_network_obj.job_id
+        return Response(data, status.HTTP_200_OK)
 
     @action(detail=True, methods=['POST'])
     def cancel_optimization(self, request, public_id=None):
@@ -434,24 +632,20 @@ class TransportNetworkViewSet(mixins.RetrieveModelMixin, mixins.DestroyModelMixi
                                                          TransportNetwork.STATUS_FINISHED]:
             raise ValidationError('Optimization is not running or queued')
 
-        redis_conn = get_connection()
-        workers = Worker.all(redis_conn)
-        for worker in workers:
-            if worker.state == WorkerStatus.BUSY and \
-                    worker.get_current_job_id() == str(transport_network_obj.job_id):
-                send_kill_horse_command(redis_conn, worker.name)
+        cancel_optimizations([transport_network_obj])
 
-        # remove from queue
-        cancel_job(str(transport_network_obj.job_id), connection=redis_conn)
+        return Response(TransportNetworkSerializer(transport_network_obj).data, status.HTTP_200_OK)
 
-        transport_network_obj.optimization_status = None
-        transport_network_obj.optimization_ran_at = None
-        transport_network_obj.optimization_error_message = None
-        transport_network_obj.save()
+    @action(detail=True, methods=['GET'])
+    def progress(self, request, public_id=None):
+        """ progress events of running optimization, they are read from redis to poll without touching database """
+        events = get_optimization_progress(public_id)
+        response = dict(public_id=public_id, last_event=events[-1] if events else None, events=events)
 
-        return Response(TransportNetworkSerializer(transport_network_obj).data, status.HTTP_200_OK)
+        return Response(response, status.HTTP_200_OK)
 
     @action(detail=True, methods=['GET'])
+    @conditional_get(get_object_version)
     def results(self, request, public_id=None):
         transport_network_obj = self.get_object()
 
@@ -463,6 +657,39 @@ class TransportNetworkViewSet(mixins.RetrieveModelMixin, mixins.DestroyModelMixi
         return Response(dict(opt_result=opt_result, opt_result_per_route=opt_result_per_route), status.HTTP_200_OK)
 
 
+class ParameterSweepViewSet(mixins.RetrieveModelMixin, mixins.DestroyModelMixin, mixins.CreateModelMixin,
+                            mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    API endpoint to optimize a transport network with different passenger and transport mode values
+    """
+    serializer_class = ParameterSweepSerializer
+    lookup_field = 'public_id'
+    queryset = ParameterSweep.objects.order_by('-created_at')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        transport_network_public_id = self.request.query_params.get('transport_network_public_id')
+        if self.action == 'list' and transport_network_public_id is not None:
+            queryset = queryset.filter(transport_network__public_id=transport_network_public_id)
+
+        return queryset
+
+    def perform_create(self, serializer):
+        """ solver budget is given like in run_optimization actions, deadline is not used by sweeps """
+        solver_parameters = get_request_solver_parameters(self.request)
+        parameter_sweep_obj = serializer.save()
+        submit_parameter_sweep(parameter_sweep_obj, get_sweep_points(parameter_sweep_obj.parameters),
+                               solver_parameters=solver_parameters)
+
+    @action(detail=True, methods=['GET'])
+    def results(self, request, public_id=None):
+        parameter_sweep_obj = self.get_object()
+        table = get_sweep_result_table(parameter_sweep_obj.parametersweepresult_set.order_by('point'))
+        response = dict(parameter_sweep=ParameterSweepSerializer(parameter_sweep_obj).data, **table)
+
+        return Response(response, status.HTTP_200_OK)
+
+
 @api_view()
 def recent_optimizations(request):
     optimizations = TransportNetwork.objects.select_related('scene__city'). \
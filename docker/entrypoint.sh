@@ -7,10 +7,19 @@ case "$1" in
     python manage.py migrate
     python manage.py collectstatic --no-input
 
-    gunicorn --chdir webapp --access-logfile - --bind :8000 webapp.wsgi:application -t 1200
+    gunicorn --chdir webapp --access-logfile - --bind :8000 webapp.asgi:application -t 1200 \
+      --worker-class uvicorn.workers.UvicornWorker
   ;;
   worker)
     echo "starting worker"
-    python manage.py rqworker default optimizer --worker-class rqworkers.optimizerWorker.OptimizerWorker
+    python manage.py run_optimizer_pool default optimizer --worker-class rqworkers.optimizerWorker.OptimizerWorker
+  ;;
+  fast_worker)
+    echo "starting fast lane worker"
+    python manage.py run_optimizer_pool optimizer_fast --worker-class rqworkers.optimizerWorker.InProcessOptimizerWorker
+  ;;
+  reaper)
+    echo "starting reaper of orphaned optimizations"
+    python manage.py reap_optimizations --loop
   ;;
 esac
\ No newline at end of file
@@ -0,0 +1,35 @@
+import numpy as np
+from django.conf import settings
+
+
+def estimate_optimization_cost(city_obj, route_number, transport_mode_number, max_number_of_iteration=None):
+    """
+    Predicted cost of an optimization in arbitrary units. Every iteration builds hyperpaths for each origin-destination
+    pair with trips and each route is an option of them, so cost grows with number of nodes, demand density, routes
+    and transport modes.
+
+    :param city_obj: city with graph and demand matrix
+    :param max_number_of_iteration: cost of one iteration is returned if it is None
+    :return: float
+    """
+    node_number = len(city_obj.demand_matrix_header or [])
+    demand_density = 1
+    if city_obj.demand_matrix is not None and node_number > 0:
+        demand_density = np.count_nonzero(city_obj.demand_matrix) / node_number ** 2
+
+    cost = node_number ** 2 * demand_density * max(route_number, 1) * max(transport_mode_number, 1)
+    if max_number_of_iteration is not None:
+        cost *= max_number_of_iteration
+
+    return float(cost)
+
+
+def get_queue_lane(cost):
+    """
+    :return: first lane of settings.OPTIMIZER_QUEUE_LANES whose maximum cost is not lower than cost
+    """
+    for lane in settings.OPTIMIZER_QUEUE_LANES:
+        if lane['max_cost'] is None or cost <= lane['max_cost']:
+            return lane
+
+    return settings.OPTIMIZER_QUEUE_LANES[-1]
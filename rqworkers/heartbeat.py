@@ -0,0 +1,67 @@
+import logging
+import threading
+
+from django.conf import settings
+from django_rq.queues import get_connection
+
+logger = logging.getLogger(__name__)
+
+# transport network public id -> job id, it expires when the process running the optimization dies
+OPTIMIZATION_HEARTBEAT_KEY = 'optimization-heartbeat:{0}'
+
+
+class OptimizationHeartbeat:
+    """
+    Thread that refreshes the heartbeat of a running optimization every settings.OPTIMIZATION_HEARTBEAT_INTERVAL
+    seconds. The key lives settings.OPTIMIZATION_HEARTBEAT_TTL seconds, so it expires when the work horse is killed
+    and rqworkers.reaper finds the transport network.
+    """
+
+    def __init__(self, transport_network_public_id, job_id=None, connection=None):
+        self.key = OPTIMIZATION_HEARTBEAT_KEY.format(transport_network_public_id)
+        self.job_id = job_id
+        self.connection = connection or get_connection()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def beat(self):
+        self.connection.set(self.key, str(self.job_id), ex=settings.OPTIMIZATION_HEARTBEAT_TTL)
+
+    def _run(self):
+        while not self.stop_event.wait(settings.OPTIMIZATION_HEARTBEAT_INTERVAL):
+            try:
+                self.beat()
+            except Exception:
+                # a redis failure must not stop the optimization, next beat tries again
+                logger.exception('heartbeat of %s failed', self.key)
+
+    def start(self):
+        # first beat is written before status is processing, so reaper never sees a running job without heartbeat
+        self.beat()
+        self.thread = threading.Thread(target=self._run, name='optimization-heartbeat', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        # a stuck job stopped after rqworkers.reaper enqueued it again must not remove the heartbeat of its retry
+        if self.connection.get(self.key) == str(self.job_id).encode():
+            self.connection.delete(self.key)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def get_heartbeats(connection, transport_network_public_id_list):
+    """
+    :return: list with job id of the last heartbeat of each transport network, None if heartbeat expired
+    """
+    job_id_list = connection.mget([OPTIMIZATION_HEARTBEAT_KEY.format(public_id) for public_id in
+                                   transport_network_public_id_list]) if transport_network_public_id_list else []
+
+    return [None if job_id is None else job_id.decode() for job_id in job_id_list]
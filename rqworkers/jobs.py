@@ -1,118 +1,259 @@
 import logging
 
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from django_rq import job
+from rq.timeouts import JobTimeoutException
 from sidermit.exceptions import SIDERMITException
 from sidermit.optimization import Optimizer
 
-from storage.models import TransportNetwork, OptimizationResult, OptimizationResultPerMode, TransportMode, \
-    OptimizationResultPerRoute, OptimizationResultPerRouteDetail, Route
+from rqworkers.heartbeat import OptimizationHeartbeat
+from rqworkers.optimization import run_network_optimization, get_solver_parameters, get_optimizer_parameters
+from rqworkers.progress import ProgressReporter, publish_status_change
+from storage.models import TransportNetwork, ParameterSweep, ParameterSweepResult, OptimizationResult
+from storage.results import save_optimization_results, get_optimization_input_fingerprint, \
+    get_warm_start_frequencies, save_optimization_checkpoint, get_optimization_checkpoint, \
+    delete_optimization_checkpoints
+from storage.sweeps import apply_overrides, save_sweep_results, fail_sweep_chunk
+from storage.versions import bump_versions
 
 logger = logging.getLogger(__name__)
 
 
-@job(settings.OPTIMIZER_QUEUE_NAME, timeout=60 * 60 * 24 * 3)
-def optimize_transport_network(transport_network_public_id):
+class OptimizationCancelled(Exception):
+    """ transport network is not processing the job anymore, it was cancelled or enqueued again """
+    pass
+
+
+@job(settings.OPTIMIZER_QUEUE_NAME, timeout=settings.OPTIMIZER_JOB_TIMEOUT)
+def optimize_transport_network(transport_network_public_id, warm_start_transport_network_public_id=None,
+                               solver_parameters=None):
+    """
+    :param warm_start_transport_network_public_id: optimizer starts from frequencies of results of this transport
+    network (it can be the same network), routes are matched by name
+    :param solver_parameters: dict returned by get_solver_parameters, default profile is used if it is None
+    """
     start_time = timezone.now()
+    if solver_parameters is None:
+        solver_parameters = get_solver_parameters()
+    optimizer_parameters = get_optimizer_parameters(solver_parameters)
     transport_network_obj = TransportNetwork.objects.select_related('scene__city', 'scene__passenger').get(
         public_id=transport_network_public_id)
-    transport_network_obj.optimization_status = TransportNetwork.STATUS_PROCESSING
-    transport_network_obj.optimization_ran_at = timezone.now()
-    transport_network_obj.save()
+    # every write below is conditional on the transport network still processing this job, so a cancelled job or
+    # a stuck job enqueued again by rqworkers.reaper never overwrites the status
+    job_id = transport_network_obj.job_id
+    if job_id is None or transport_network_obj.optimization_status != TransportNetwork.STATUS_QUEUED:
+        logger.info('optimization of transport network %s was cancelled before it started',
+                    transport_network_public_id)
+        return
+    # heartbeat expires if this process dies, so rqworkers.reaper can free the transport network
+    with OptimizationHeartbeat(transport_network_public_id, job_id):
+        transport_network_obj.optimization_status = TransportNetwork.STATUS_PROCESSING
+        transport_network_obj.optimization_ran_at = timezone.now()
+        if TransportNetwork.objects.filter(pk=transport_network_obj.pk, job_id=job_id,
+                                           optimization_status=TransportNetwork.STATUS_QUEUED).update(
+                optimization_status=transport_network_obj.optimization_status,
+                optimization_ran_at=transport_network_obj.optimization_ran_at) == 0:
+            logger.info('optimization of transport network %s was cancelled before it started',
+                        transport_network_public_id)
+            return
+        progress_reporter = ProgressReporter(transport_network_public_id, transport_network_obj.scene.public_id)
+        progress_reporter.reset()
+        bump_versions(transport_network_id_list=[transport_network_obj.pk])
+        publish_status_change(transport_network_obj)
+
+        graph = transport_network_obj.scene.city.get_sidermit_graph()
+        demand = transport_network_obj.scene.city.get_sidermit_demand_matrix(graph)
+
+        passenger = transport_network_obj.scene.passenger.get_sidermit_passenger()
+        network = transport_network_obj.get_sidermit_network(graph)
+
+        transport_mode_obj_list = list(transport_network_obj.scene.transportmode_set.all())
+        route_obj_list = list(transport_network_obj.route_set.all())
+        input_fingerprint = get_optimization_input_fingerprint(transport_network_obj, transport_mode_obj_list,
+                                                               route_obj_list, optimizer_parameters)
+
+        transport_mode_dict = dict()
+        # name -> id maps are used to save results without querying each route and transport mode again
+        transport_mode_id_dict = dict()
+        for transport_mode_obj in transport_mode_obj_list:
+            transport_mode_dict[transport_mode_obj.id] = transport_mode_obj.get_sidermit_transport_mode()
+            transport_mode_id_dict[transport_mode_obj.name] = transport_mode_obj.id
+
+        route_id_dict = dict()
+        for route_obj in route_obj_list:
+            network.add_route(route_obj.get_sidermit_route(transport_mode_dict[route_obj.transport_mode_id]))
+            route_id_dict[route_obj.name] = route_obj.id
+
+        f = None
+        warm_start_transport_network_obj = None
+        reference_iteration_number = None
+        if warm_start_transport_network_public_id is not None:
+            warm_start_transport_network_obj = TransportNetwork.objects.get(
+                public_id=warm_start_transport_network_public_id)
+            # read before results are replaced, reference can be the same network
+            f = get_warm_start_frequencies(warm_start_transport_network_obj, route_obj_list,
+                                           transport_mode_obj_list)
+            if f is None:
+                warm_start_transport_network_obj = None
+            else:
+                reference_iteration_number = OptimizationResult.objects.filter(
+                    transport_network=warm_start_transport_network_obj).values_list(
+                    'iteration_number', flat=True).first()
+
+        # a job interrupted by a worker restart resumes from the last iteration it finished
+        initial_iteration = 0
+        previous_result = None
+        checkpoint_obj = get_optimization_checkpoint(transport_network_obj, input_fingerprint)
+        if checkpoint_obj is not None:
+            f = checkpoint_obj.frequencies
+            initial_iteration = checkpoint_obj.iteration_number
+            previous_result = checkpoint_obj.better_result
+            logger.info('optimization of transport network %s resumes after iteration %s', transport_network_public_id,
+                        initial_iteration)
+
+        def checkpoint(iteration, next_f, better_result):
+            # kill horse command does not stop jobs of InProcessOptimizerWorker, they stop here
+            if not save_optimization_checkpoint(transport_network_obj, input_fingerprint, iteration, next_f,
+                                                better_result, job_id=job_id):
+                raise OptimizationCancelled()
+
+        processing_filter = dict(pk=transport_network_obj.pk, job_id=job_id,
+                                 optimization_status=TransportNetwork.STATUS_PROCESSING)
 
-    graph = transport_network_obj.scene.city.get_sidermit_graph()
-    demand = transport_network_obj.scene.city.get_sidermit_demand_matrix(graph)
+        try:
+            # run optimizer
+            opt_obj, iteration_number, deadline_reached = run_network_optimization(
+                graph, demand, passenger, network, f=f, deadline=solver_parameters['deadline'],
+                progress_reporter=progress_reporter, initial_iteration=initial_iteration,
+                previous_result=previous_result, checkpoint=checkpoint, **optimizer_parameters)
+            saved_iteration_number = None
+            if reference_iteration_number is not None:
+                saved_iteration_number = reference_iteration_number - iteration_number
 
-    passenger = transport_network_obj.scene.passenger.get_sidermit_passenger()
-    network = transport_network_obj.get_sidermit_network(graph)
+            progress_reporter.start_phase()
+            with transaction.atomic():
+                save_optimization_results(transport_network_obj, opt_obj.get_overall_results(),
+                                          opt_obj.get_network_results(), route_id_dict=route_id_dict,
+                                          transport_mode_id_dict=transport_mode_id_dict,
+                                          # results cut by deadline are not reused by other networks
+                                          input_fingerprint=None if deadline_reached else input_fingerprint,
+                                          solver_profile=solver_parameters['profile'],
+                                          deadline_reached=deadline_reached, iteration_number=iteration_number,
+                                          warm_start_transport_network_obj=warm_start_transport_network_obj,
+                                          saved_iteration_number=saved_iteration_number)
 
-    transport_mode_dict = dict()
-    for transport_mode_obj in transport_network_obj.scene.transportmode_set.all():
-        transport_mode_dict[transport_mode_obj.id] = transport_mode_obj.get_sidermit_transport_mode()
+                transport_network_obj.optimization_status = TransportNetwork.STATUS_FINISHED
+                transport_network_obj.optimization_duration = timezone.now() - start_time
+                transport_network_obj.optimization_error_message = None
+                # results are rolled back if job was cancelled while they were saved
+                if TransportNetwork.objects.filter(**processing_filter).update(
+                        optimization_status=transport_network_obj.optimization_status,
+                        optimization_duration=transport_network_obj.optimization_duration,
+                        optimization_error_message=None) == 0:
+                    raise OptimizationCancelled()
+                delete_optimization_checkpoints([transport_network_obj.id])
+            bump_versions(transport_network_id_list=[transport_network_obj.pk])
+            progress_reporter.report(ProgressReporter.PHASE_SAVING_RESULTS)
+            progress_reporter.report(ProgressReporter.PHASE_FINISHED)
+            publish_status_change(transport_network_obj)
+        except OptimizationCancelled:
+            # status and checkpoint belong to whoever cancelled the job or to its retry
+            logger.info('optimization of transport network %s was cancelled', transport_network_public_id)
+        except (SIDERMITException, Exception) as e:
+            transport_network_obj.optimization_status = TransportNetwork.STATUS_ERROR
+            transport_network_obj.optimization_duration = timezone.now() - start_time
+            transport_network_obj.optimization_error_message = str(e)
+            with transaction.atomic():
+                if TransportNetwork.objects.filter(**processing_filter).update(
+                        optimization_status=transport_network_obj.optimization_status,
+                        optimization_duration=transport_network_obj.optimization_duration,
+                        optimization_error_message=transport_network_obj.optimization_error_message) == 0:
+                    logger.info('optimization of transport network %s was cancelled', transport_network_public_id)
+                    return
+                # the same inputs fail again, next run starts over
+                delete_optimization_checkpoints([transport_network_obj.id])
+            bump_versions(transport_network_id_list=[transport_network_obj.pk])
+            progress_reporter.report(ProgressReporter.PHASE_ERROR, message=str(e))
+            publish_status_change(transport_network_obj)
 
-    for route_obj in transport_network_obj.route_set.all():
-        network.add_route(route_obj.get_sidermit_route(transport_mode_dict[route_obj.transport_mode_id]))
 
+def get_sweep_point_results(parameter_sweep_obj, point_list, optimizer_parameters):
+    """
+    :return: list of ParameterSweepResult of points, optimization errors of a point are saved in its result
+    """
+    transport_network_obj = parameter_sweep_obj.transport_network
+    scene_obj = transport_network_obj.scene
+
+    graph = scene_obj.city.get_sidermit_graph()
+    demand = scene_obj.city.get_sidermit_demand_matrix(graph)
+    transport_mode_obj_list = list(scene_obj.transportmode_set.all())
+    route_obj_list = list(transport_network_obj.route_set.all())
+
+    result_obj_list = []
+    for point, overrides in point_list:
+        result_obj = ParameterSweepResult(parameter_sweep=parameter_sweep_obj, point=point, overrides=overrides)
+        try:
+            passenger_obj, point_transport_mode_obj_list = apply_overrides(scene_obj.passenger,
+                                                                           transport_mode_obj_list, overrides)
+            transport_mode_dict = {transport_mode_obj.id: transport_mode_obj.get_sidermit_transport_mode() for
+                                   transport_mode_obj in point_transport_mode_obj_list}
+            network = transport_network_obj.get_sidermit_network(graph)
+            for route_obj in route_obj_list:
+                network.add_route(route_obj.get_sidermit_route(transport_mode_dict[route_obj.transport_mode_id]))
+
+            opt_obj = Optimizer.network_optimization(graph, demand, passenger_obj.get_sidermit_passenger(), network,
+                                                     f=None, **optimizer_parameters)
+            overall_results = opt_obj.get_overall_results()
+            result_obj.vrc = overall_results['VRC']
+            result_obj.co = overall_results['operators_cost']
+            result_obj.ci = overall_results['infrastructure_cost']
+            result_obj.cu = overall_results['users_cost']
+            result_obj.tv = overall_results['travel_time_on_board']
+            result_obj.tw = overall_results['waiting_time']
+            result_obj.ta = overall_results['access_time']
+            result_obj.t = overall_results['transfers']
+        except JobTimeoutException:
+            # chunk is out of time, it must not go on with the next point
+            raise
+        except (SIDERMITException, Exception) as e:
+            result_obj.error_message = str(e)
+        result_obj_list.append(result_obj)
+
+    return result_obj_list
+
+
+@job(settings.OPTIMIZER_QUEUE_NAME, timeout=settings.OPTIMIZER_JOB_TIMEOUT)
+def run_parameter_sweep(parameter_sweep_public_id, point_list, solver_parameters=None):
+    """
+    Optimize transport network of parameter sweep for a chunk of its points. Graph and demand are built once and
+    reused for every point.
+
+    :param point_list: list of (point index, overrides)
+    :param solver_parameters: dict returned by get_solver_parameters, default profile is used if it is None.
+    Deadline is not used, each point runs until tolerance or max_number_of_iteration
+    """
+    if solver_parameters is None:
+        solver_parameters = get_solver_parameters()
+    # first chunk that starts marks the sweep as processing
+    ParameterSweep.objects.filter(public_id=parameter_sweep_public_id, status=ParameterSweep.STATUS_QUEUED).update(
+        status=ParameterSweep.STATUS_PROCESSING, ran_at=timezone.now())
     try:
-        # run optimizer
-        opt_obj = Optimizer.network_optimization(graph, demand, passenger, network, f=None, tolerance=0.01,
-                                                 max_number_of_iteration=5)
-
-        ov_results = opt_obj.get_overall_results()
-
-        opt_result_obj, created = OptimizationResult.objects.get_or_create(
-            transport_network=transport_network_obj,
-            defaults=dict(vrc=ov_results['VRC'], co=ov_results['operators_cost'], ci=ov_results['infrastructure_cost'],
-                          cu=ov_results['users_cost'], tv=ov_results['travel_time_on_board'],
-                          tw=ov_results['waiting_time'], ta=ov_results['access_time'], t=ov_results['transfers']))
-        if not created:
-            opt_result_obj.vrc = ov_results['VRC']
-            opt_result_obj.co = ov_results['operators_cost']
-            opt_result_obj.ci = ov_results['infrastructure_cost']
-            opt_result_obj.cu = ov_results['users_cost']
-            opt_result_obj.tv = ov_results['travel_time_on_board']
-            opt_result_obj.tw = ov_results['waiting_time']
-            opt_result_obj.ta = ov_results['access_time']
-            opt_result_obj.t = ov_results['transfers']
-            opt_result_obj.save()
-
-        for mode in ov_results['vehicles_mode']:
-            b = ov_results['vehicles_mode'][mode]
-            k = ov_results['vehicle_capacity_mode'][mode]
-            l = ov_results['lines_mode'][mode]
-
-            transport_mode_obj = TransportMode.objects.get(scene=transport_network_obj.scene, name=mode.name)
-            opt_per_mode, created = OptimizationResultPerMode.objects.get_or_create(
-                transport_network=transport_network_obj,
-                transport_mode=transport_mode_obj,
-                defaults=dict(b=b, k=k, l=l))
-
-            if not created:
-                opt_per_mode.b = b
-                opt_per_mode.k = k
-                opt_per_mode.l = l
-                opt_per_mode.save()
-
-        network_results = opt_obj.get_network_results()
-
-        for route in network_results:
-            route_name = route[0]
-            route_obj = Route.objects.get(transport_network=transport_network_obj, name=route_name)
-            opt_result_per_route_obj, _ = OptimizationResultPerRoute.objects.get_or_create(
-                transport_network=transport_network_obj, route=route_obj,
-                defaults=dict(frequency=route[1], frequency_per_line=route[2], k=route[3], b=route[4], tc=route[5],
-                              co=route[6], lambda_min=route[7]))
-            opt_result_per_route_obj.frequency = route[1]
-            opt_result_per_route_obj.frequency_per_line = route[2]
-            opt_result_per_route_obj.k = route[3]
-            opt_result_per_route_obj.b = route[4]
-            opt_result_per_route_obj.tc = route[5]
-            opt_result_per_route_obj.co = route[6]
-            opt_result_per_route_obj.lambda_min = route[7]
-            opt_result_per_route_obj.save()
-
-            sub_table_i = route[8]
-            sub_table_r = route[9]
-
-            OptimizationResultPerRouteDetail.objects.filter(opt_route=opt_result_per_route_obj).delete()
-            for node_i, node_j, charge_ij in sub_table_i:
-                OptimizationResultPerRouteDetail.objects.create(opt_route=opt_result_per_route_obj,
-                                                                direction=OptimizationResultPerRouteDetail.DIRECTION_I,
-                                                                origin_node=node_i, destination_node=node_j,
-                                                                lambda_value=charge_ij)
-            for node_i, node_j, charge_ij in sub_table_r:
-                OptimizationResultPerRouteDetail.objects.create(opt_route=opt_result_per_route_obj,
-                                                                direction=OptimizationResultPerRouteDetail.DIRECTION_R,
-                                                                origin_node=node_i, destination_node=node_j,
-                                                                lambda_value=charge_ij)
-
-        transport_network_obj.optimization_status = TransportNetwork.STATUS_FINISHED
-        transport_network_obj.optimization_duration = timezone.now() - start_time
-        transport_network_obj.optimization_error_message = None
-        transport_network_obj.save()
-    except (SIDERMITException, Exception) as e:
-        transport_network_obj.optimization_status = TransportNetwork.STATUS_ERROR
-        transport_network_obj.optimization_duration = timezone.now() - start_time
-        transport_network_obj.optimization_error_message = str(e)
-        transport_network_obj.save()
+        parameter_sweep_obj = ParameterSweep.objects.select_related(
+            'transport_network__scene__city', 'transport_network__scene__passenger').get(
+            public_id=parameter_sweep_public_id)
+    except ParameterSweep.DoesNotExist:
+        logger.warning('parameter sweep %s was deleted before its chunk ran', parameter_sweep_public_id)
+        return
+
+    try:
+        result_obj_list = get_sweep_point_results(parameter_sweep_obj, point_list,
+                                                  get_optimizer_parameters(solver_parameters))
+    except Exception as e:
+        # rq timeout is raised inside the job too, so the chunk is not lost
+        logger.exception('chunk of parameter sweep %s failed', parameter_sweep_public_id)
+        fail_sweep_chunk(parameter_sweep_obj, point_list, str(e))
+        return
+
+    save_sweep_results(parameter_sweep_obj, result_obj_list)
@@ -0,0 +1,116 @@
+import time
+
+from django.conf import settings
+from sidermit.optimization import Optimizer
+
+from rqworkers.progress import ProgressReporter
+
+
+def get_solver_parameters(profile=None, tolerance=None, max_number_of_iteration=None, deadline=None):
+    """
+    Solver budget of an optimization: values of profile defined in settings.OPTIMIZER_SOLVER_PROFILES replaced by
+    given values.
+
+    :return: dict with profile, tolerance, max_number_of_iteration and deadline
+    """
+    profile = profile or settings.OPTIMIZER_DEFAULT_SOLVER_PROFILE
+    solver_parameters = dict(settings.OPTIMIZER_SOLVER_PROFILES[profile], profile=profile)
+    for name, value in [('tolerance', tolerance), ('max_number_of_iteration', max_number_of_iteration),
+                        ('deadline', deadline)]:
+        if value is not None:
+            solver_parameters[name] = value
+
+    return solver_parameters
+
+
+def get_optimizer_parameters(solver_parameters):
+    """ parameters given to sidermit optimizer, they are part of the input fingerprint """
+    return dict(tolerance=solver_parameters['tolerance'],
+                max_number_of_iteration=solver_parameters['max_number_of_iteration'])
+
+
+def get_job_timeout(solver_parameters, job_timeout=None):
+    """
+    :param job_timeout: timeout of the queue lane, settings.OPTIMIZER_JOB_TIMEOUT is used if it is None
+    """
+    if solver_parameters['deadline'] is None:
+        return job_timeout or settings.OPTIMIZER_JOB_TIMEOUT
+
+    return int(solver_parameters['deadline']) + settings.OPTIMIZER_DEADLINE_MARGIN
+
+
+def run_network_optimization(graph_obj, demand_obj, passenger_obj, network_obj, f=None, tolerance=0.01,
+                             max_number_of_iteration=None, deadline=None, progress_reporter=None,
+                             initial_iteration=0, previous_result=None, checkpoint=None):
+    """
+    Same iterations as sidermit Optimizer.network_optimization, built with its public methods so each iteration can
+    be reported. The first optimizer is also the returned one, sidermit builds the same object twice.
+
+    :param f: dict route id -> initial frequency, fini of each transport mode is used if it is None
+    :param deadline: seconds, no iteration starts after it and the best result found so far is returned. An
+    iteration in progress is not interrupted
+    :param progress_reporter: ProgressReporter instance, progress is not reported if it is None
+    :param initial_iteration: iterations done before, when optimization resumes from a checkpoint
+    :param previous_result: best result of iterations done before, it competes with results of this run
+    :param checkpoint: callable with arguments iteration number, f of the next iteration and best result so far,
+    called after each iteration
+    :return: Optimizer object with better result, number of external iterations, True if deadline was reached
+    """
+    start_time = time.perf_counter()
+
+    def report(phase, iteration=None, vrc=None):
+        if progress_reporter is not None:
+            progress_reporter.report(phase, iteration=iteration, vrc=vrc)
+            progress_reporter.start_phase()
+
+    if progress_reporter is not None:
+        progress_reporter.start_phase()
+    result_opt_obj = Optimizer(graph_obj, demand_obj, passenger_obj, network_obj, f)
+    report(ProgressReporter.PHASE_INITIALIZATION)
+
+    result_list = [(result_opt_obj.f_opt, 'initialization', -1, 'initialization', -1, -1)]
+    if previous_result is not None:
+        result_list.append(tuple(previous_result))
+
+    def save_checkpoint():
+        if checkpoint is not None:
+            checkpoint(iteration, opt_obj.fopt_to_f(new_f), Optimizer.get_better_result(result_list))
+
+    res = result_opt_obj.internal_optimization()
+    result_list.append((res.x, res.success, res.status, res.message, res.constr_violation, res.fun))
+    iteration = initial_iteration + 1
+    report(ProgressReporter.PHASE_ITERATION, iteration=iteration, vrc=res.fun)
+
+    opt_obj = result_opt_obj
+    previous_f = result_list[0][0]
+    new_f = res.x
+    save_checkpoint()
+    deadline_reached = False
+    # iterate until external tolerance is reached or maximum number of iterations is exceeded
+    while not opt_obj.external_optimization_tolerance(previous_f, new_f, tolerance):
+        if max_number_of_iteration is not None and iteration > max_number_of_iteration:
+            break
+        if deadline is not None and time.perf_counter() - start_time >= deadline:
+            deadline_reached = True
+            break
+        previous_f = new_f
+        opt_obj = Optimizer(graph_obj, demand_obj, passenger_obj, network_obj, opt_obj.fopt_to_f(new_f))
+        res = opt_obj.internal_optimization()
+        result_list.append((res.x, res.success, res.status, res.message, res.constr_violation, res.fun))
+        new_f = res.x
+        iteration += 1
+        report(ProgressReporter.PHASE_ITERATION, iteration=iteration, vrc=res.fun)
+        save_checkpoint()
+
+    better_result = Optimizer.get_better_result(result_list)
+    if better_result is not None:
+        fopt, success, status, message, constr_violation, fun = better_result
+        # frequencies lower than one vehicle per day are removed
+        fopt = [0 if x < 1 / 24 else x for x in fopt]
+        better_result = fopt, success, status, message, constr_violation, fun
+
+    # it raises exceptions when there is not a valid result
+    Optimizer.status_optimization(better_result)
+    result_opt_obj.better_res = better_result
+
+    return result_opt_obj, iteration, deadline_reached
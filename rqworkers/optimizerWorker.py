@@ -1,12 +1,66 @@
-from rq import Worker
+import importlib
+import logging
+
+from django.conf import settings
+from django.db import connections
+from rq import Worker, SimpleWorker
+from rq.defaults import DEFAULT_RESULT_TTL, DEFAULT_WORKER_TTL
+from rq.utils import utcnow
+
+logger = logging.getLogger(__name__)
+
+# modules imported before the first job, so work horses inherit them already loaded
+PRELOADED_MODULES = ['numpy', 'scipy.optimize', 'sidermit.city', 'sidermit.publictransportsystem',
+                     'sidermit.optimization', 'storage.models', 'rqworkers.jobs']
+
+
+# job id -> hash with name of worker that runs the job, so jobs are cancelled without scanning every worker
+JOB_WORKER_KEY = 'optimization-job-worker:{0}'
+
+
+def preload_modules():
+    for module_name in PRELOADED_MODULES:
+        importlib.import_module(module_name)
+
+
+def register_job_worker(connection, job, worker_name):
+    key = JOB_WORKER_KEY.format(job.id)
+    timeout = job.timeout if job.timeout is not None and job.timeout > 0 else settings.OPTIMIZER_JOB_TIMEOUT
+    pipeline = connection.pipeline()
+    pipeline.hset(key, mapping=dict(worker_name=worker_name))
+    # key outlives the job if the process dies without removing it
+    pipeline.expire(key, int(timeout) + 60)
+    pipeline.execute()
+
+
+def unregister_job_worker(connection, job_id):
+    connection.delete(JOB_WORKER_KEY.format(job_id))
+
+
+def get_job_workers(connection, job_id_list):
+    """
+    :return: list with dict of worker_name for each job, None if job is not running in an optimizer worker
+    """
+    pipeline = connection.pipeline()
+    for job_id in job_id_list:
+        pipeline.hgetall(JOB_WORKER_KEY.format(job_id))
+
+    job_worker_list = []
+    for job_worker in pipeline.execute():
+        if not job_worker:
+            job_worker_list.append(None)
+            continue
+        job_worker_list.append(dict(worker_name=job_worker[b'worker_name'].decode()))
+
+    return job_worker_list
 
 
 # Same worker called with rqworker by default, created to be able to call it in the same way
 # as any other worker in the script for the service.
 class OptimizerWorker(Worker):
 
-    def __init__(self, queues, name=None, default_result_ttl=None, connection=None,
-                 exc_handler=None, exception_handlers=None, default_worker_ttl=None,
+    def __init__(self, queues, name=None, default_result_ttl=DEFAULT_RESULT_TTL, connection=None,
+                 exc_handler=None, exception_handlers=None, default_worker_ttl=DEFAULT_WORKER_TTL,
                  job_class=None, queue_class=None):
         print("Initializing OptimizerWorker...")
         super(OptimizerWorker, self).__init__(queues, name=name, default_result_ttl=default_result_ttl,
@@ -14,4 +68,42 @@ class OptimizerWorker(Worker):
                                               exception_handlers=exception_handlers,
                                               default_worker_ttl=default_worker_ttl, job_class=job_class,
                                               queue_class=queue_class)
+        preload_modules()
         print("OptimizerWorker ready!")
+
+    def fork_work_horse(self, job, queue):
+        # a forked horse must not share the database socket of its parent
+        connections.close_all()
+        super().fork_work_horse(job, queue)
+
+    def prepare_job_execution(self, job, heartbeat_ttl=None):
+        super().prepare_job_execution(job, heartbeat_ttl=heartbeat_ttl)
+        register_job_worker(self.connection, job, self.name)
+        # time between enqueue and start, it includes time waiting for a free worker
+        if job.enqueued_at is not None:
+            job.meta['startup_latency'] = (utcnow() - job.enqueued_at).total_seconds()
+            job.save_meta()
+            logger.info('job %s started %.3f seconds after it was enqueued', job.id, job.meta['startup_latency'])
+
+    def perform_job(self, job, queue, heartbeat_ttl=None):
+        try:
+            return super().perform_job(job, queue, heartbeat_ttl=heartbeat_ttl)
+        finally:
+            unregister_job_worker(self.connection, job.id)
+
+
+class InProcessOptimizerWorker(SimpleWorker, OptimizerWorker):
+    """
+    Jobs run in the worker process instead of a forked work horse, so modules, sidermit cache and database
+    connection are reused between jobs. It is meant for short jobs, a job that crashes the interpreter stops the
+    worker. There is no work horse to kill, so a cancelled job stops at its next checkpoint (see
+    rqworkers.jobs.optimize_transport_network) and the worker takes the next job.
+    """
+
+    def execute_job(self, job, queue):
+        # connection is kept between jobs, it is replaced only if it broke
+        for connection in connections.all():
+            if connection.connection is not None and not connection.is_usable():
+                connection.close()
+
+        return super().execute_job(job, queue)
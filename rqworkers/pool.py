@@ -0,0 +1,146 @@
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from django.db import connections
+from django_rq.queues import get_queues
+from django_rq.workers import get_worker
+from rq import Worker
+from rq.worker import WorkerStatus
+
+from rqworkers.optimizerWorker import preload_modules
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker(queue_names, worker_class):
+    """ entry point of a child process of the pool """
+    # signals of the terminal reach only the supervisor, it decides how children stop
+    os.setsid()
+    # children must not share database sockets of the supervisor
+    connections.close_all()
+    get_worker(*queue_names, worker_class=worker_class).work()
+
+
+def get_desired_worker_number(queued_job_number, busy_worker_number, min_workers, max_workers):
+    """ one worker for each job waiting or running, between min_workers and max_workers """
+    return max(min_workers, min(max_workers, queued_job_number + busy_worker_number))
+
+
+class OptimizerWorkerPool:
+    """
+    Supervisor of worker processes that listen the same queues. Number of workers follows queue depth between
+    min_workers and max_workers, crashed workers are replaced and stopped workers finish their current job.
+    """
+
+    def __init__(self, queue_names, min_workers, max_workers, worker_class, check_interval=5,
+                 process_factory=None):
+        """
+        :param worker_class: python path of rq worker class used by children
+        :param check_interval: seconds between queue depth checks
+        :param process_factory: callable with arguments target and args that returns a process, multiprocessing
+        fork context is used if it is None
+        """
+        self.queue_names = queue_names
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.worker_class = worker_class
+        self.check_interval = check_interval
+        self.process_factory = process_factory or multiprocessing.get_context('fork').Process
+        self.processes = dict()
+        # children that received SIGTERM, they exit after their current job
+        self.stopping_pids = set()
+        self.shutdown_requested = False
+
+    def start_worker(self):
+        process = self.process_factory(target=run_worker, args=(self.queue_names, self.worker_class))
+        process.start()
+        self.processes[process.pid] = process
+        logger.info('optimizer worker %s started', process.pid)
+
+    def stop_worker(self, pid):
+        self.stopping_pids.add(pid)
+        self.processes[pid].terminate()
+        logger.info('optimizer worker %s stopping', pid)
+
+    def reap_workers(self):
+        """ forget children that exited, unexpected exits are logged and replaced by scale """
+        for pid, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            del self.processes[pid]
+            if pid in self.stopping_pids:
+                self.stopping_pids.discard(pid)
+            else:
+                logger.warning('optimizer worker %s exited with code %s', pid, process.exitcode)
+
+    def get_worker_states(self):
+        """ :return: dict pid -> rq state of children registered in redis """
+        queues = get_queues(*self.queue_names)
+        hostname = socket.gethostname()
+        states = dict()
+        for worker in Worker.all(connection=queues[0].connection):
+            if worker.hostname == hostname and worker.pid in self.processes:
+                states[worker.pid] = worker.get_state()
+
+        return states
+
+    def get_queued_job_number(self):
+        return sum(queue.count for queue in get_queues(*self.queue_names))
+
+    def scale(self):
+        states = self.get_worker_states()
+        busy_worker_number = sum(1 for state in states.values() if state == WorkerStatus.BUSY)
+        desired = get_desired_worker_number(self.get_queued_job_number(), busy_worker_number, self.min_workers,
+                                            self.max_workers)
+
+        running_pids = [pid for pid in self.processes if pid not in self.stopping_pids]
+        for _ in range(desired - len(running_pids)):
+            self.start_worker()
+
+        # only idle workers are stopped, so running optimizations are never interrupted
+        idle_pids = [pid for pid in running_pids if states.get(pid) == WorkerStatus.IDLE]
+        for pid in idle_pids[:max(len(running_pids) - desired, 0)]:
+            self.stop_worker(pid)
+
+    def request_shutdown(self, signum, frame):
+        logger.info('optimizer worker pool received signal %s, draining', signum)
+        self.shutdown_requested = True
+
+    def drain(self, timeout=None):
+        """ warm shutdown of every child, children still alive after timeout are killed """
+        for pid in list(self.processes):
+            if pid not in self.stopping_pids:
+                self.stop_worker(pid)
+
+        end_time = None if timeout is None else time.monotonic() + timeout
+        for process in list(self.processes.values()):
+            process.join(None if end_time is None else max(end_time - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning('optimizer worker %s did not finish in time, stopping its job', process.pid)
+                # second SIGTERM is a cold shutdown, rq kills the work horse before exiting
+                process.terminate()
+                process.join(10)
+            if process.is_alive():
+                process.kill()
+                process.join()
+        self.processes.clear()
+        self.stopping_pids.clear()
+
+    def run(self, drain_timeout=None):
+        # children are forked with sidermit and numeric stack already imported
+        preload_modules()
+        signal.signal(signal.SIGTERM, self.request_shutdown)
+        signal.signal(signal.SIGINT, self.request_shutdown)
+
+        for _ in range(self.min_workers):
+            self.start_worker()
+        while not self.shutdown_requested:
+            self.reap_workers()
+            self.scale()
+            time.sleep(self.check_interval)
+
+        self.drain(drain_timeout)
@@ -0,0 +1,97 @@
+import json
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from django_rq.queues import get_connection
+
+OPTIMIZATION_PROGRESS_KEY = 'optimization-progress:{0}'
+# every event of a transport network is also published in the channel of its scene
+OPTIMIZATION_SCENE_CHANNEL = 'optimization-scene:{0}'
+OPTIMIZATION_CHANNEL_PATTERNS = [OPTIMIZATION_PROGRESS_KEY.format('*'), OPTIMIZATION_SCENE_CHANNEL.format('*')]
+
+PHASE_STATUS = 'status'
+
+
+def publish_event(connection, transport_network_public_id, scene_public_id, event):
+    """
+    Keep event in the list of transport network and publish it in channels of transport network and scene.
+    The list is capped to settings.OPTIMIZATION_PROGRESS_MAX_EVENTS events.
+    """
+    key = OPTIMIZATION_PROGRESS_KEY.format(transport_network_public_id)
+    event = dict(event, transport_network_public_id=str(transport_network_public_id))
+    content = json.dumps(event)
+
+    pipeline = connection.pipeline()
+    pipeline.rpush(key, content)
+    pipeline.ltrim(key, -settings.OPTIMIZATION_PROGRESS_MAX_EVENTS, -1)
+    pipeline.expire(key, settings.OPTIMIZATION_PROGRESS_TTL)
+    pipeline.publish(key, content)
+    if scene_public_id is not None:
+        pipeline.publish(OPTIMIZATION_SCENE_CHANNEL.format(scene_public_id), content)
+    pipeline.execute()
+
+    return event
+
+
+def publish_status_change(transport_network_obj, connection=None):
+    """ publish optimization status of transport network, it has to be called after status is saved """
+    event = dict(phase=PHASE_STATUS, optimization_status=transport_network_obj.optimization_status,
+                 timestamp=timezone.now().isoformat())
+
+    return publish_event(connection or get_connection(), transport_network_obj.public_id,
+                         transport_network_obj.scene.public_id, event)
+
+
+class ProgressReporter:
+    """
+    Publish progress events of a running optimization in redis. Events are kept in a list, so they can be read
+    without touching the database, and they are published in channels of transport network and scene for listeners.
+    """
+    PHASE_INITIALIZATION = 'initialization'
+    PHASE_ITERATION = 'iteration'
+    PHASE_SAVING_RESULTS = 'saving_results'
+    PHASE_FINISHED = 'finished'
+    PHASE_ERROR = 'error'
+
+    def __init__(self, transport_network_public_id, scene_public_id=None, connection=None):
+        self.transport_network_public_id = transport_network_public_id
+        self.scene_public_id = scene_public_id
+        self.key = OPTIMIZATION_PROGRESS_KEY.format(transport_network_public_id)
+        self.connection = connection or get_connection()
+        self.start_time = time.perf_counter()
+        self.phase_start_time = self.start_time
+
+    def reset(self):
+        """ remove events of previous runs """
+        self.connection.delete(self.key)
+        self.start_time = time.perf_counter()
+        self.phase_start_time = self.start_time
+
+    def start_phase(self):
+        self.phase_start_time = time.perf_counter()
+
+    def report(self, phase, iteration=None, vrc=None, message=None):
+        """
+        :param phase: one of PHASE_* values
+        :param iteration: number of external iteration
+        :param vrc: best value reached by internal optimization in this phase
+        :param message: free text, e.g. error message
+        """
+        now = time.perf_counter()
+        event = dict(phase=phase, iteration=iteration, vrc=None if vrc is None else float(vrc), message=message,
+                     elapsed_time=round(now - self.start_time, 3),
+                     phase_elapsed_time=round(now - self.phase_start_time, 3),
+                     timestamp=timezone.now().isoformat())
+
+        return publish_event(self.connection, self.transport_network_public_id, self.scene_public_id, event)
+
+
+def get_optimization_progress(transport_network_public_id, connection=None):
+    """
+    :return: list of progress events of the last optimization of transport network, oldest first
+    """
+    connection = connection or get_connection()
+    events = connection.lrange(OPTIMIZATION_PROGRESS_KEY.format(transport_network_public_id), 0, -1)
+
+    return [json.loads(event) for event in events]
@@ -0,0 +1,184 @@
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django_rq.queues import get_connection
+from rq.command import send_kill_horse_command
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+from rq.registry import FailedJobRegistry, StartedJobRegistry
+
+from rqworkers.heartbeat import get_heartbeats
+from rqworkers.jobs import run_parameter_sweep
+from rqworkers.optimizerWorker import get_job_workers, unregister_job_worker
+from rqworkers.progress import publish_status_change
+from rqworkers.submission import enqueue_optimization
+from storage.models import TransportNetwork, ParameterSweep
+from storage.results import delete_optimization_checkpoints
+from storage.sweeps import fail_sweep_chunk
+from storage.versions import bump_versions
+
+logger = logging.getLogger(__name__)
+
+ORPHANED_OPTIMIZATION_ERROR_MESSAGE = 'Optimization worker stopped unexpectedly'
+FAILED_SWEEP_CHUNK_ERROR_MESSAGE = 'Parameter sweep worker stopped unexpectedly'
+PARAMETER_SWEEP_FUNC_NAME = '{0}.{1}'.format(run_parameter_sweep.__module__, run_parameter_sweep.__name__)
+
+
+def get_orphaned_transport_networks(connection):
+    """
+    :return: transport networks with status processing whose heartbeat expired. Networks that started less than
+    settings.OPTIMIZATION_HEARTBEAT_TTL seconds ago are not checked
+    """
+    started_before = timezone.now() - timedelta(seconds=settings.OPTIMIZATION_HEARTBEAT_TTL)
+    transport_network_obj_list = list(TransportNetwork.objects.select_related('scene').filter(
+        optimization_status=TransportNetwork.STATUS_PROCESSING, optimization_ran_at__lt=started_before))
+    heartbeat_list = get_heartbeats(connection, [transport_network_obj.public_id for transport_network_obj in
+                                                 transport_network_obj_list])
+
+    return [transport_network_obj for transport_network_obj, heartbeat in
+            zip(transport_network_obj_list, heartbeat_list) if heartbeat is None]
+
+
+def get_job_arguments(connection, job_id):
+    """ :return: arguments of optimization job, None if rq does not have the job anymore """
+    try:
+        return Job.fetch(str(job_id), connection=connection).args
+    except NoSuchJobError:
+        return None
+
+
+def get_lane(queue_name):
+    for lane in settings.OPTIMIZER_QUEUE_LANES:
+        if lane['queue'] == queue_name:
+            return lane
+
+    return None
+
+
+def retry_optimization(transport_network_obj, job_arguments):
+    """
+    Enqueue optimization again with the arguments of its dead job, it resumes from its last checkpoint.
+    Compare and set on job id, so a network is retried once when many reapers run at the same time.
+
+    :return: True if network was enqueued again
+    """
+    previous_job_id = transport_network_obj.job_id
+    job_id = uuid.uuid4()
+    values = dict(optimization_status=TransportNetwork.STATUS_QUEUED,
+                  optimization_retry_number=transport_network_obj.optimization_retry_number + 1, job_id=job_id)
+    if TransportNetwork.objects.filter(pk=transport_network_obj.pk, job_id=transport_network_obj.job_id,
+                                       optimization_status=TransportNetwork.STATUS_PROCESSING).update(**values) == 0:
+        return False
+    for field_name, value in values.items():
+        setattr(transport_network_obj, field_name, value)
+    bump_versions(transport_network_id_list=[transport_network_obj.pk])
+    publish_status_change(transport_network_obj)
+
+    _, warm_start_transport_network_public_id, solver_parameters = job_arguments
+    try:
+        enqueue_optimization(transport_network_obj.public_id, warm_start_transport_network_public_id,
+                             solver_parameters, get_lane(transport_network_obj.optimization_queue), job_id=job_id)
+    except Exception:
+        # network stays orphaned, so the next run of the reaper tries again
+        TransportNetwork.objects.filter(pk=transport_network_obj.pk, job_id=job_id).update(
+            optimization_status=TransportNetwork.STATUS_PROCESSING, job_id=previous_job_id,
+            optimization_retry_number=values['optimization_retry_number'] - 1)
+        bump_versions(transport_network_id_list=[transport_network_obj.pk])
+        raise
+
+    return True
+
+
+def fail_optimization(transport_network_obj):
+    """
+    Move network to error, so it can be submitted again. Compare and set on job id like retry_optimization.
+
+    :return: True if network was moved to error
+    """
+    values = dict(optimization_status=TransportNetwork.STATUS_ERROR,
+                  optimization_error_message=ORPHANED_OPTIMIZATION_ERROR_MESSAGE)
+    if TransportNetwork.objects.filter(pk=transport_network_obj.pk, job_id=transport_network_obj.job_id,
+                                       optimization_status=TransportNetwork.STATUS_PROCESSING).update(**values) == 0:
+        return False
+    # the same as a failed job, next run starts over
+    delete_optimization_checkpoints([transport_network_obj.pk])
+    for field_name, value in values.items():
+        setattr(transport_network_obj, field_name, value)
+    bump_versions(transport_network_id_list=[transport_network_obj.pk])
+    publish_status_change(transport_network_obj)
+
+    return True
+
+
+def reap_orphaned_optimizations(max_retries=None, connection=None):
+    """
+    Free transport networks that stay in processing because the process running their optimization died (work
+    horse killed by the kernel, container stopped, etc.). A network is enqueued again while it has less than
+    max_retries retries, otherwise it is moved to error.
+
+    :param max_retries: settings.OPTIMIZATION_REAPER_MAX_RETRIES is used if it is None
+    :return: list of transport networks enqueued again, list of transport networks moved to error
+    """
+    if max_retries is None:
+        max_retries = settings.OPTIMIZATION_REAPER_MAX_RETRIES
+    connection = connection or get_connection()
+
+    retried_list = []
+    failed_list = []
+    transport_network_obj_list = get_orphaned_transport_networks(connection)
+    job_id_list = [str(transport_network_obj.job_id) for transport_network_obj in transport_network_obj_list]
+    for transport_network_obj, job_id, job_worker in zip(transport_network_obj_list, job_id_list,
+                                                         get_job_workers(connection, job_id_list)):
+        # heartbeat can also expire if the job is stuck, it must not run next to its retry. A work horse is killed,
+        # a job of InProcessOptimizerWorker stops at its next checkpoint because the network is not processing it
+        # anymore
+        if job_worker is not None:
+            send_kill_horse_command(connection, job_worker['worker_name'])
+            unregister_job_worker(connection, job_id)
+
+        job_arguments = get_job_arguments(connection, transport_network_obj.job_id)
+        if transport_network_obj.optimization_retry_number < max_retries and job_arguments is not None:
+            if retry_optimization(transport_network_obj, job_arguments):
+                logger.warning('optimization of transport network %s enqueued again (retry %s)',
+                               transport_network_obj.public_id, transport_network_obj.optimization_retry_number)
+                retried_list.append(transport_network_obj)
+        elif fail_optimization(transport_network_obj):
+            logger.warning('optimization of transport network %s moved to error', transport_network_obj.public_id)
+            failed_list.append(transport_network_obj)
+
+    return retried_list, failed_list
+
+
+def reap_failed_parameter_sweeps(connection=None):
+    """
+    Move to error parameter sweeps with a chunk whose job failed without saving its results (work horse killed,
+    worker died while the job was started), otherwise they stay queued or processing forever. Errors raised by the
+    chunk itself are saved by run_parameter_sweep.
+
+    :return: list of parameter sweeps moved to error
+    """
+    connection = connection or get_connection()
+    # jobs of dead workers are moved to failed registry by cleanup
+    StartedJobRegistry(settings.OPTIMIZER_QUEUE_NAME, connection=connection).cleanup()
+    failed_job_registry = FailedJobRegistry(settings.OPTIMIZER_QUEUE_NAME, connection=connection)
+
+    point_list_dict = dict()
+    for job in Job.fetch_many(failed_job_registry.get_job_ids(), connection=connection):
+        if job is not None and job.func_name == PARAMETER_SWEEP_FUNC_NAME:
+            parameter_sweep_public_id, point_list = job.args[:2]
+            point_list_dict.setdefault(str(parameter_sweep_public_id), []).extend(point_list)
+    if not point_list_dict:
+        return []
+
+    parameter_sweep_obj_list = list(ParameterSweep.objects.filter(
+        public_id__in=point_list_dict.keys(),
+        status__in=[ParameterSweep.STATUS_QUEUED, ParameterSweep.STATUS_PROCESSING]))
+    for parameter_sweep_obj in parameter_sweep_obj_list:
+        logger.warning('parameter sweep %s moved to error', parameter_sweep_obj.public_id)
+        fail_sweep_chunk(parameter_sweep_obj, point_list_dict[str(parameter_sweep_obj.public_id)],
+                         FAILED_SWEEP_CHUNK_ERROR_MESSAGE)
+
+    return parameter_sweep_obj_list
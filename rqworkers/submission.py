@@ -0,0 +1,316 @@
+import json
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django_rq.queues import get_connection, get_queue
+from rq import cancel_job
+from rq.command import send_kill_horse_command
+from rq.exceptions import NoSuchJobError
+
+from rqworkers.cost import estimate_optimization_cost, get_queue_lane
+from rqworkers.jobs import optimize_transport_network, run_parameter_sweep
+from rqworkers.optimizerWorker import get_job_workers, unregister_job_worker
+from rqworkers.optimization import get_solver_parameters, get_optimizer_parameters, get_job_timeout
+from rqworkers.progress import publish_status_change
+from storage.models import TransportNetwork, ParameterSweep
+from storage.results import get_optimization_input_fingerprint, find_optimization_result_source, \
+    copy_optimization_results, delete_optimization_checkpoints
+from storage.sweeps import fail_sweep_chunk
+from storage.versions import bump_versions
+
+OPTIMIZATION_GROUP_KEY = 'optimization-group:{0}'
+# scene public id, idempotency key -> group id
+OPTIMIZATION_GROUP_IDEMPOTENCY_KEY = 'optimization-group-idempotency:{0}:{1}'
+
+# fields read again when a submission loses the compare and set
+TRANSPORT_NETWORK_OPTIMIZATION_FIELDS = ['optimization_status', 'optimization_ran_at', 'optimization_error_message',
+                                         'optimization_duration', 'optimization_predicted_cost', 'optimization_queue',
+                                         'optimization_idempotency_key', 'optimization_retry_number', 'job_id']
+
+
+class OptimizationAlreadySubmitted(Exception):
+    """ transport network is queued or processing, or it was already submitted with the same idempotency key """
+
+    def __init__(self, transport_network_obj, duplicate):
+        """
+        :param transport_network_obj: transport network with its current optimization state
+        :param duplicate: True if it was submitted before with the same idempotency key
+        """
+        super().__init__('Transport network is queued or processing at this moment')
+        self.transport_network_obj = transport_network_obj
+        self.duplicate = duplicate
+
+
+def enqueue_optimization(transport_network_public_id, warm_start_transport_network_public_id, solver_parameters,
+                         lane=None, job_id=None):
+    """
+    enqueue optimization job in queue of lane, rq timeout is the lane timeout or it depends on solver deadline
+
+    :param lane: one of settings.OPTIMIZER_QUEUE_LANES, the last one is used if it is None
+    :param job_id: id of rq job, rq creates one if it is None
+    """
+    if lane is None:
+        lane = settings.OPTIMIZER_QUEUE_LANES[-1]
+
+    return get_queue(lane['queue']).enqueue(
+        optimize_transport_network, transport_network_public_id, warm_start_transport_network_public_id,
+        solver_parameters, job_timeout=get_job_timeout(solver_parameters, lane['job_timeout']),
+        job_id=None if job_id is None else str(job_id))
+
+
+def claim_transport_network(transport_network_obj, values, idempotency_key=None):
+    """
+    Compare and set of optimization status: values are saved only if transport network is not queued or processing
+    and it was not submitted with idempotency key before, so only one of concurrent submissions wins.
+
+    :param values: dict field name -> value saved with status queued
+    :raise OptimizationAlreadySubmitted: if another submission won
+    """
+    values = dict(values, optimization_status=TransportNetwork.STATUS_QUEUED,
+                  optimization_idempotency_key=idempotency_key, optimization_retry_number=0)
+    queryset = TransportNetwork.objects.filter(pk=transport_network_obj.pk).exclude(
+        optimization_status__in=[TransportNetwork.STATUS_QUEUED, TransportNetwork.STATUS_PROCESSING])
+    if idempotency_key is not None:
+        queryset = queryset.exclude(optimization_idempotency_key=idempotency_key)
+
+    if queryset.update(**values) == 0:
+        transport_network_obj.refresh_from_db(fields=TRANSPORT_NETWORK_OPTIMIZATION_FIELDS)
+        raise OptimizationAlreadySubmitted(transport_network_obj, idempotency_key is not None and
+                                           transport_network_obj.optimization_idempotency_key == idempotency_key)
+
+    for field_name, value in values.items():
+        setattr(transport_network_obj, field_name, value)
+
+
+def release_transport_network(transport_network_obj, job_id):
+    """ undo claim_transport_network when submission fails, so network can be submitted again """
+    TransportNetwork.objects.filter(pk=transport_network_obj.pk, optimization_status=TransportNetwork.STATUS_QUEUED,
+                                    job_id=job_id).update(optimization_status=None, job_id=None,
+                                                          optimization_idempotency_key=None)
+    bump_versions(transport_network_id_list=[transport_network_obj.pk])
+
+
+def submit_optimization(transport_network_obj, transport_mode_obj_list=None, warm_start_transport_network_obj=None,
+                        solver_parameters=None, idempotency_key=None):
+    """
+    Enqueue optimization of transport network. If a finished transport network has the same inputs, its results
+    are copied and nothing is enqueued.
+
+    :param transport_network_obj: transport network with its scene, city and passenger
+    :param transport_mode_obj_list: transport modes of the scene, they are queried if they are not given
+    :param warm_start_transport_network_obj: optimizer starts from frequencies of results of this transport network
+    :param solver_parameters: dict returned by get_solver_parameters, default profile is used if it is None
+    :param idempotency_key: a second submission with the same key is reported as duplicate instead of being enqueued
+    :return: True if results were copied from another transport network, False if a job was enqueued or the
+    submission was cancelled before copied results were saved
+    :raise OptimizationAlreadySubmitted: if transport network is queued or processing or key was already used
+    """
+    if transport_mode_obj_list is None:
+        transport_mode_obj_list = transport_network_obj.scene.transportmode_set.all()
+    transport_mode_obj_list = list(transport_mode_obj_list)
+    route_obj_list = list(transport_network_obj.route_set.all())
+    if solver_parameters is None:
+        solver_parameters = get_solver_parameters()
+
+    # results of a network with the same inputs are copied instead of being computed again
+    optimizer_parameters = get_optimizer_parameters(solver_parameters)
+    input_fingerprint = get_optimization_input_fingerprint(transport_network_obj, transport_mode_obj_list,
+                                                           route_obj_list, optimizer_parameters)
+    source_transport_network_obj = find_optimization_result_source(input_fingerprint, transport_network_obj,
+                                                                   optimizer_parameters)
+    if source_transport_network_obj is not None:
+        claim_transport_network(transport_network_obj, dict(optimization_predicted_cost=None, optimization_queue=None,
+                                                            job_id=None), idempotency_key)
+        values = dict(optimization_status=TransportNetwork.STATUS_FINISHED, optimization_ran_at=timezone.now(),
+                      optimization_duration=timedelta(0), optimization_error_message=None)
+        try:
+            with transaction.atomic():
+                copy_optimization_results(source_transport_network_obj, transport_network_obj)
+                # compare and set with the claim, so a cancellation made after it is not overwritten
+                finished = TransportNetwork.objects.filter(
+                    pk=transport_network_obj.pk, optimization_status=TransportNetwork.STATUS_QUEUED,
+                    job_id=None).update(**values) == 1
+                if not finished:
+                    transaction.set_rollback(True)
+        except Exception:
+            release_transport_network(transport_network_obj, None)
+            raise
+        if not finished:
+            transport_network_obj.refresh_from_db(fields=TRANSPORT_NETWORK_OPTIMIZATION_FIELDS)
+            return False
+        for field_name, value in values.items():
+            setattr(transport_network_obj, field_name, value)
+        bump_versions(transport_network_id_list=[transport_network_obj.pk])
+        publish_status_change(transport_network_obj)
+
+        return True
+
+    predicted_cost = estimate_optimization_cost(transport_network_obj.scene.city, len(route_obj_list),
+                                                len(transport_mode_obj_list),
+                                                solver_parameters['max_number_of_iteration'])
+    lane = get_queue_lane(predicted_cost)
+
+    # job id is saved with status, so a network is never queued without its job
+    job_id = uuid.uuid4()
+    claim_transport_network(transport_network_obj, dict(optimization_predicted_cost=predicted_cost,
+                                                        optimization_queue=lane['queue'], job_id=job_id),
+                            idempotency_key)
+    bump_versions(transport_network_id_list=[transport_network_obj.pk])
+    publish_status_change(transport_network_obj)
+
+    # async task
+    warm_start_transport_network_public_id = None
+    if warm_start_transport_network_obj is not None:
+        warm_start_transport_network_public_id = warm_start_transport_network_obj.public_id
+    try:
+        enqueue_optimization(transport_network_obj.public_id, warm_start_transport_network_public_id,
+                             solver_parameters, lane, job_id=job_id)
+    except Exception:
+        release_transport_network(transport_network_obj, job_id)
+        raise
+
+    return False
+
+
+def cancel_optimizations(transport_network_obj_list):
+    """
+    Kill running jobs and remove queued jobs of transport networks, then clear their optimization status. Jobs of
+    InProcessOptimizerWorker are not killed, they stop at their next checkpoint when they see the status.
+    Workers running the jobs are read from the job -> worker map, so cost does not depend on number of workers.
+
+    :param transport_network_obj_list: transport networks with their scene
+    """
+    connection = get_connection()
+    job_id_list = [str(transport_network_obj.job_id) for transport_network_obj in transport_network_obj_list if
+                   transport_network_obj.job_id is not None]
+    for job_id, job_worker in zip(job_id_list, get_job_workers(connection, job_id_list)):
+        if job_worker is not None:
+            send_kill_horse_command(connection, job_worker['worker_name'])
+            unregister_job_worker(connection, job_id)
+        # remove from queue
+        try:
+            cancel_job(job_id, connection=connection)
+        except NoSuchJobError:
+            pass
+
+    values = dict(optimization_status=None, optimization_ran_at=None, optimization_error_message=None,
+                  optimization_idempotency_key=None)
+    transport_network_id_list = [transport_network_obj.pk for transport_network_obj in transport_network_obj_list]
+    TransportNetwork.objects.filter(pk__in=transport_network_id_list).update(**values)
+    bump_versions(transport_network_id_list=transport_network_id_list)
+    # a cancelled optimization starts over
+    delete_optimization_checkpoints(transport_network_id_list)
+    for transport_network_obj in transport_network_obj_list:
+        for field_name, value in values.items():
+            setattr(transport_network_obj, field_name, value)
+        publish_status_change(transport_network_obj)
+
+
+def submit_parameter_sweep(parameter_sweep_obj, point_list, solver_parameters=None):
+    """
+    Enqueue points of parameter sweep in chunks of settings.PARAMETER_SWEEP_CHUNK_SIZE points, so they are
+    distributed across optimizer workers. Each chunk builds graph and demand only once.
+
+    :param point_list: list of overrides returned by storage.sweeps.get_sweep_points
+    :param solver_parameters: dict returned by get_solver_parameters, default profile is used if it is None
+    """
+    if solver_parameters is None:
+        solver_parameters = get_solver_parameters()
+    parameter_sweep_obj.status = ParameterSweep.STATUS_QUEUED
+    parameter_sweep_obj.save()
+
+    indexed_point_list = list(enumerate(point_list))
+    chunk_size = settings.PARAMETER_SWEEP_CHUNK_SIZE
+    for i in range(0, len(indexed_point_list), chunk_size):
+        try:
+            run_parameter_sweep.delay(parameter_sweep_obj.public_id, indexed_point_list[i:i + chunk_size],
+                                      solver_parameters)
+        except Exception as e:
+            # points that are not enqueued never get results, so the sweep could not finish
+            fail_sweep_chunk(parameter_sweep_obj, indexed_point_list[i:], str(e))
+            raise
+
+
+def reserve_optimization_group(scene_obj, idempotency_key):
+    """
+    Reserve a group id for the idempotency key of a scene submission. Only the first request with the key gets it.
+
+    :return: group id, True if key was not used before in the scene
+    """
+    group_id = str(uuid.uuid4())
+    key = OPTIMIZATION_GROUP_IDEMPOTENCY_KEY.format(scene_obj.public_id, idempotency_key)
+    connection = get_connection()
+    if connection.set(key, group_id, nx=True, ex=settings.OPTIMIZATION_GROUP_TTL):
+        return group_id, True
+    reserved_group_id = connection.get(key)
+    if reserved_group_id is None:
+        # reservation expired between both commands
+        return reserve_optimization_group(scene_obj, idempotency_key)
+
+    return reserved_group_id.decode(), False
+
+
+def create_optimization_group(scene_obj, transport_network_obj_list, group_id=None):
+    """
+    Save in redis which transport networks were submitted together, so their progress can be followed as a unit.
+    Every network keeps its own job in the optimizer queue, so workers process them in parallel.
+
+    :param group_id: id returned by reserve_optimization_group, a new one is created if it is None
+    :return: group id
+    """
+    group_id = group_id or str(uuid.uuid4())
+    group = dict(scene_public_id=str(scene_obj.public_id), created_at=timezone.now().isoformat(),
+                 transport_network_public_ids=[str(transport_network_obj.public_id) for transport_network_obj in
+                                               transport_network_obj_list])
+    get_connection().set(OPTIMIZATION_GROUP_KEY.format(group_id), json.dumps(group),
+                         ex=settings.OPTIMIZATION_GROUP_TTL)
+
+    return group_id
+
+
+def get_optimization_group(group_id):
+    """
+    :return: dict with scene public id, creation time and transport network public ids, None if group does not exist
+    or it expired
+    """
+    group = get_connection().get(OPTIMIZATION_GROUP_KEY.format(group_id))
+    if group is None:
+        return None
+
+    return json.loads(group)
+
+
+def get_optimization_group_progress(group):
+    """
+    Progress of group is computed from optimization status of its transport networks, they are the source of truth.
+    Deleted transport networks are reported as missing and group is completed when nothing is queued or processing.
+
+    :param group: dict returned by get_optimization_group
+    :return: dict with number of transport networks by status and status of each transport network
+    """
+    public_id_list = group['transport_network_public_ids']
+    status_dict = {str(public_id): optimization_status for public_id, optimization_status in
+                   TransportNetwork.objects.filter(public_id__in=public_id_list).values_list(
+                       'public_id', 'optimization_status')}
+
+    transport_networks = []
+    status_count = {optimization_status: 0 for optimization_status, _ in TransportNetwork.status_choices}
+    missing = 0
+    for public_id in public_id_list:
+        if public_id not in status_dict:
+            missing += 1
+            continue
+        optimization_status = status_dict[public_id]
+        transport_networks.append(dict(public_id=public_id, optimization_status=optimization_status))
+        # cancelled optimizations do not have status
+        if optimization_status is not None:
+            status_count[optimization_status] += 1
+
+    total = len(public_id_list)
+    pending = status_count[TransportNetwork.STATUS_QUEUED] + status_count[TransportNetwork.STATUS_PROCESSING]
+
+    return dict(total=total, status_count=status_count, missing=missing, pending=pending, completed=pending == 0,
+                transport_networks=transport_networks)
@@ -0,0 +1,180 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from sidermit.city import Graph, GraphContentFormat, Demand
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """ thread-safe in-process cache that discards the least recently used entry when it is full """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+def get_graph_fingerprint(graph_content):
+    """
+    :param graph_content: graph in pajek format
+    :return: hex digest that identifies the graph content
+    """
+    return hashlib.sha1(graph_content.encode('utf-8')).hexdigest()
+
+
+def get_demand_matrix_fingerprint(demand_matrix):
+    """
+    :param demand_matrix: list of list or numpy array with trips between nodes
+    :return: hex digest that identifies the matrix content
+    """
+    matrix = np.ascontiguousarray(demand_matrix, dtype=np.float64)
+    digest = hashlib.sha1(str(matrix.shape).encode('utf-8'))
+    digest.update(matrix.tobytes())
+    return digest.hexdigest()
+
+
+class SidermitCache:
+    """
+    Two-tier cache for sidermit Graph and Demand objects built from city content.
+
+    Entries are keyed by a content hash, so a stale object is never returned for new content. The first tier is an
+    LRU dict local to the process, the second one is the shared redis cache (CACHES['default']) so other web and
+    worker processes do not parse the same pajek text again. Cached objects are shared, callers must not modify them.
+    """
+    GRAPH_KEY_PREFIX = 'sidermit:graph'
+    DEMAND_KEY_PREFIX = 'sidermit:demand'
+
+    def __init__(self, local_max_size, timeout, cache_alias='default'):
+        self.local = LRUCache(local_max_size)
+        self.timeout = timeout
+        self.cache_alias = cache_alias
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias]
+
+    def get_graph_key(self, graph_content):
+        return '{0}:{1}'.format(self.GRAPH_KEY_PREFIX, get_graph_fingerprint(graph_content))
+
+    def get_demand_key(self, graph_content, demand_matrix):
+        return '{0}:{1}:{2}'.format(self.DEMAND_KEY_PREFIX, get_graph_fingerprint(graph_content),
+                                    get_demand_matrix_fingerprint(demand_matrix))
+
+    def get_graph(self, graph_content):
+        """
+        :param graph_content: graph in pajek format
+        :return: sidermit.city.Graph object
+        """
+        key = self.get_graph_key(graph_content)
+        graph_obj = self.local.get(key)
+        if graph_obj is not None:
+            return graph_obj
+
+        graph_obj = self.shared.get(key)
+        if graph_obj is None:
+            graph_obj = Graph.build_from_content(graph_content, GraphContentFormat.PAJEK)
+            self.shared.set(key, graph_obj, self.timeout)
+        self.local.set(key, graph_obj)
+
+        return graph_obj
+
+    def get_demand(self, graph_obj, graph_content, demand_matrix):
+        """
+        :param graph_obj: sidermit.city.Graph object built from graph_content
+        :param graph_content: graph in pajek format
+        :param demand_matrix: list of list or numpy array with trips between nodes
+        :return: sidermit.city.Demand object
+        """
+        key = self.get_demand_key(graph_content, demand_matrix)
+        demand_obj = self.local.get(key)
+        if demand_obj is not None:
+            return demand_obj
+
+        content = self.shared.get(key)
+        if content is None:
+            demand_obj = Demand.build_from_content(graph_obj, demand_matrix)
+            self.shared.set(key, self.dump_demand(demand_obj), self.timeout)
+        else:
+            demand_obj = self.load_demand(graph_obj, content)
+        self.local.set(key, demand_obj)
+
+        return demand_obj
+
+    @staticmethod
+    def dump_demand(demand_obj):
+        """ Demand objects can not be pickled (its matrix is a defaultdict built with a lambda) """
+        matrix = {origin: dict(row) for origin, row in demand_obj.get_matrix().items()}
+        return dict(matrix=matrix, total_trips=demand_obj.get_total_trips())
+
+    @staticmethod
+    def load_demand(graph_obj, content):
+        demand_obj = Demand(graph_obj)
+        matrix = demand_obj.get_matrix()
+        for origin, row in content['matrix'].items():
+            matrix[origin].update(row)
+        demand_obj.total_trips = content['total_trips']
+
+        return demand_obj
+
+    def invalidate_graph(self, graph_content):
+        """
+        remove graph entry related to content from both tiers.
+        Local tiers of other processes evict it when it is not used anymore.
+        """
+        self._invalidate(self.get_graph_key(graph_content))
+
+    def invalidate_demand(self, graph_content, demand_matrix):
+        """
+        remove demand entry related to content from both tiers.
+        Local tiers of other processes evict it when it is not used anymore.
+        """
+        self._invalidate(self.get_demand_key(graph_content, demand_matrix))
+
+    def _invalidate(self, key):
+        self.local.delete(key)
+        self.shared.delete(key)
+        logger.debug('sidermit cache entry "{0}" invalidated'.format(key))
+
+    def clear_local(self):
+        self.local.clear()
+
+
+sidermit_cache = SidermitCache(settings.SIDERMIT_CACHE_LOCAL_MAX_SIZE, settings.SIDERMIT_CACHE_TIMEOUT)
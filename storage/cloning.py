@@ -0,0 +1,128 @@
+import uuid
+
+from django.db import transaction
+from django.utils import timezone
+
+from storage.models import Scene, Passenger, TransportMode, TransportNetwork, Route
+from storage.versions import bump_versions
+
+# optimization state is not copied, cloned networks have to be optimized again
+TRANSPORT_NETWORK_RESET_VALUES = dict(optimization_status=None, optimization_ran_at=None,
+                                      optimization_error_message=None, optimization_duration=None,
+                                      optimization_predicted_cost=None, optimization_queue=None,
+                                      optimization_idempotency_key=None, optimization_retry_number=0,
+                                      job_id=None)
+
+
+def _prepare_copy(obj, **values):
+    """ turn obj into an unsaved copy of itself with new values, returns previous primary key """
+    previous_pk = obj.pk
+    obj.pk = None
+    obj._state.adding = True
+    if hasattr(obj, 'public_id'):
+        obj.public_id = uuid.uuid4()
+    for field_name, value in values.items():
+        setattr(obj, field_name, value)
+
+    return previous_pk
+
+
+def _bulk_copy(model, queryset, get_values):
+    """
+    copy every row of queryset with one insert.
+
+    :param get_values: function that receives the original object and returns dict with values to change on the copy
+    :return: dict previous primary key -> new object
+    """
+    previous_pk_list = []
+    obj_list = []
+    for obj in queryset:
+        previous_pk_list.append(_prepare_copy(obj, **get_values(obj)))
+        obj_list.append(obj)
+
+    return dict(zip(previous_pk_list, model.objects.bulk_create(obj_list)))
+
+
+def _copy_scene_content(scene_obj_dict, now):
+    """
+    copy passenger, transport modes, transport networks and routes of scenes.
+
+    :param scene_obj_dict: dict previous scene primary key -> new scene object
+    """
+    scene_id_list = list(scene_obj_dict.keys())
+
+    _bulk_copy(Passenger, Passenger.objects.filter(scene_id__in=scene_id_list),
+               lambda obj: dict(scene=scene_obj_dict[obj.scene_id]))
+    transport_mode_obj_dict = _bulk_copy(TransportMode, TransportMode.objects.filter(scene_id__in=scene_id_list),
+                                         lambda obj: dict(scene=scene_obj_dict[obj.scene_id], created_at=now))
+    transport_network_obj_dict = _bulk_copy(
+        TransportNetwork, TransportNetwork.objects.filter(scene_id__in=scene_id_list),
+        lambda obj: dict(scene=scene_obj_dict[obj.scene_id], created_at=now, **TRANSPORT_NETWORK_RESET_VALUES))
+    _bulk_copy(Route, Route.objects.filter(transport_network_id__in=list(transport_network_obj_dict.keys())),
+               lambda obj: dict(transport_network=transport_network_obj_dict[obj.transport_network_id],
+                                transport_mode=transport_mode_obj_dict[obj.transport_mode_id], created_at=now))
+
+
+@transaction.atomic
+def clone_city(city_obj, name=None):
+    """
+    copy city with its scenes, passengers, transport modes, transport networks and routes. The number of queries
+    does not depend on the number of copied rows.
+
+    :param city_obj: city to copy, it becomes the new city
+    :param name: name of new city, "<name> copy" by default
+    :return: new city
+    """
+    now = timezone.now()
+    previous_city_pk = _prepare_copy(city_obj, created_at=now, name=name or '{0} copy'.format(city_obj.name))
+    city_obj.save()
+
+    scene_obj_dict = _bulk_copy(Scene, Scene.objects.filter(city_id=previous_city_pk),
+                                lambda obj: dict(city=city_obj, created_at=now))
+    _copy_scene_content(scene_obj_dict, now)
+
+    return city_obj
+
+
+@transaction.atomic
+def clone_scene(scene_obj, name=None):
+    """
+    copy scene with its passenger, transport modes, transport networks and routes in the same city. The number of
+    queries does not depend on the number of copied rows.
+
+    :param scene_obj: scene to copy, it becomes the new scene
+    :param name: name of new scene, "<name> copy" by default
+    :return: new scene
+    """
+    now = timezone.now()
+    previous_scene_pk = _prepare_copy(scene_obj, created_at=now, name=name or '{0} copy'.format(scene_obj.name))
+    scene_obj.save()
+
+    _copy_scene_content({previous_scene_pk: scene_obj}, now)
+    # city payload includes the new scene
+    bump_versions(scene_id_list=[scene_obj.pk])
+
+    return scene_obj
+
+
+@transaction.atomic
+def clone_transport_network(transport_network_obj, name=None):
+    """
+    copy transport network with its routes in the same scene. Optimization state is not copied.
+
+    :param transport_network_obj: transport network to copy, it becomes the new transport network
+    :param name: name of new transport network, "<name> copy" by default
+    :return: new transport network
+    """
+    now = timezone.now()
+    previous_transport_network_pk = _prepare_copy(
+        transport_network_obj, created_at=now, name=name or '{0} copy'.format(transport_network_obj.name),
+        **TRANSPORT_NETWORK_RESET_VALUES)
+    transport_network_obj.save()
+
+    _bulk_copy(Route, Route.objects.filter(transport_network_id=previous_transport_network_pk),
+               lambda obj: dict(transport_network=transport_network_obj, created_at=now))
+    # scene and city payloads include the new transport network
+    bump_versions(transport_network_id_list=[transport_network_obj.pk])
+
+    return transport_network_obj
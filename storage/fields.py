@@ -0,0 +1,85 @@
+import base64
+import io
+
+import numpy as np
+from django.core.exceptions import ValidationError
+from django.db import models
+
+
+def dump_matrix(matrix):
+    """
+    :param matrix: list of list or numpy array
+    :return: bytes of a contiguous float64 array in .npy layout
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+    if matrix.size == 0:
+        matrix = matrix.reshape((0, 0))
+    if matrix.ndim != 2:
+        raise ValueError('Matrix should have two dimensions')
+
+    buffer = io.BytesIO()
+    np.lib.format.write_array(buffer, matrix, allow_pickle=False)
+
+    return buffer.getvalue()
+
+
+def load_matrix(content):
+    """
+    :param content: bytes-like object in .npy layout
+    :return: read-only numpy array that shares memory with content
+    """
+    content = memoryview(content)
+    magic_length = np.lib.format.MAGIC_LEN
+    version = np.lib.format.read_magic(io.BytesIO(content[:magic_length].tobytes()))
+    # header length is stored in 2 bytes for version 1.0 and 4 bytes for later versions
+    if version == (1, 0):
+        header_length_size, read_header = 2, np.lib.format.read_array_header_1_0
+    else:
+        header_length_size, read_header = 4, np.lib.format.read_array_header_2_0
+    header_length = int.from_bytes(content[magic_length:magic_length + header_length_size], 'little')
+    offset = magic_length + header_length_size + header_length
+    shape, fortran_order, dtype = read_header(io.BytesIO(content[magic_length:offset].tobytes()))
+
+    matrix = np.frombuffer(content, dtype=dtype, offset=offset)
+    return matrix.reshape(shape, order='F' if fortran_order else 'C')
+
+
+class NumpyMatrixField(models.BinaryField):
+    """
+    Two-dimensional float matrix stored as bytea in .npy layout. Values are read into numpy arrays without copying
+    the database buffer (arrays are read-only), lists of lists are accepted on assignment.
+    """
+    description = 'Float matrix stored in .npy layout'
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('editable', True)
+        super().__init__(*args, **kwargs)
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return load_matrix(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, np.ndarray):
+            return value
+        if isinstance(value, str):
+            return load_matrix(base64.b64decode(value.encode('ascii')))
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return load_matrix(value)
+        try:
+            return load_matrix(dump_matrix(value))
+        except ValueError as e:
+            raise ValidationError(str(e), code='invalid')
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is not None and not isinstance(value, (bytes, bytearray, memoryview)):
+            value = dump_matrix(value)
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def value_to_string(self, obj):
+        """ binary data is serialized as base64 """
+        value = self.value_from_object(obj)
+        if value is None:
+            return value
+        return base64.b64encode(dump_matrix(value)).decode('ascii')
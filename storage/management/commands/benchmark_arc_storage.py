@@ -0,0 +1,92 @@
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, connection
+
+from api.serializers import OptimizationResultPerRouteSerializer
+from storage.models import TransportNetwork, OptimizationResultPerRoute, OptimizationResultPerRouteDetail
+from storage.results import pack_arc_loads, _insert_route_details
+
+
+def read_route_results(transport_network_obj):
+    """ the same queries and serialization of results action of transport network api """
+    return OptimizationResultPerRouteSerializer(
+        OptimizationResultPerRoute.objects.select_related('route').prefetch_related(
+            'optimizationresultperroutedetail_set').filter(transport_network=transport_network_obj), many=True).data
+
+
+def get_row_storage_size(transport_network_obj):
+    """ bytes of route detail rows of transport network, without indexes """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT COALESCE(SUM(pg_column_size(d.*)), 0) FROM {0} d JOIN {1} r ON r.id = d.opt_route_id '
+                       'WHERE r.transport_network_id = %s'.format(OptimizationResultPerRouteDetail._meta.db_table,
+                                                                  OptimizationResultPerRoute._meta.db_table),
+                       [transport_network_obj.pk])
+        return cursor.fetchone()[0]
+
+
+def get_columnar_storage_size(transport_network_obj):
+    """ bytes of packed arc loads of transport network, postgresql can compress them """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT COALESCE(SUM(pg_column_size(arc_loads)), 0) FROM {0} WHERE transport_network_id = %s'
+                       .format(OptimizationResultPerRoute._meta.db_table), [transport_network_obj.pk])
+        return cursor.fetchone()[0]
+
+
+class Command(BaseCommand):
+    help = 'Compare storage size and read latency of arc loads saved as rows and packed in a binary column'
+
+    def add_arguments(self, parser):
+        parser.add_argument('transport_network', help='public id of a transport network with results')
+        parser.add_argument('--repeat', type=int, default=5, help='number of reads, best time is reported')
+
+    def handle(self, *args, **options):
+        try:
+            transport_network_obj = TransportNetwork.objects.get(public_id=options['transport_network'])
+        except (TransportNetwork.DoesNotExist, ValueError):
+            raise CommandError('transport network "{0}" does not exist'.format(options['transport_network']))
+
+        # both layouts are written in a transaction that is rolled back, saved results do not change
+        with transaction.atomic():
+            # arc loads are read with the layout they were saved
+            serializer = OptimizationResultPerRouteSerializer()
+            arc_load_list_dict = dict()
+            for opt_result_per_route_obj in OptimizationResultPerRoute.objects.prefetch_related(
+                    'optimizationresultperroutedetail_set').filter(transport_network=transport_network_obj):
+                arc_load_list_dict[opt_result_per_route_obj.pk] = [
+                    (arc_load['direction'], arc_load['origin_node'], arc_load['destination_node'],
+                     arc_load['lambda_value']) for arc_load in
+                    serializer.get_optimizationresultperroutedetail_set(opt_result_per_route_obj)]
+            arc_number = sum(len(arc_load_list) for arc_load_list in arc_load_list_dict.values())
+            if arc_number == 0:
+                raise CommandError('transport network does not have arc loads')
+
+            OptimizationResultPerRouteDetail.objects.filter(opt_route_id__in=arc_load_list_dict.keys()).delete()
+            OptimizationResultPerRoute.objects.filter(pk__in=arc_load_list_dict.keys()).update(arc_loads=None)
+            _insert_route_details([
+                OptimizationResultPerRouteDetail(opt_route_id=opt_route_id, direction=direction, origin_node=node_i,
+                                                 destination_node=node_j, lambda_value=charge_ij)
+                for opt_route_id, arc_load_list in arc_load_list_dict.items()
+                for direction, node_i, node_j, charge_ij in arc_load_list])
+            row_size = get_row_storage_size(transport_network_obj)
+            row_data = read_route_results(transport_network_obj)
+            row_time = min(timeit.repeat(lambda: read_route_results(transport_network_obj), number=1,
+                                         repeat=options['repeat']))
+
+            OptimizationResultPerRouteDetail.objects.filter(opt_route_id__in=arc_load_list_dict.keys()).delete()
+            for opt_route_id, arc_load_list in arc_load_list_dict.items():
+                OptimizationResultPerRoute.objects.filter(pk=opt_route_id).update(
+                    arc_loads=pack_arc_loads(arc_load_list))
+            columnar_size = get_columnar_storage_size(transport_network_obj)
+            columnar_data = read_route_results(transport_network_obj)
+            columnar_time = min(timeit.repeat(lambda: read_route_results(transport_network_obj), number=1,
+                                              repeat=options['repeat']))
+
+            transaction.set_rollback(True)
+
+        if row_data != columnar_data:
+            self.stderr.write('results are different with both layouts')
+        self.stdout.write('{0} routes, {1} arcs'.format(len(arc_load_list_dict), arc_number))
+        self.stdout.write('rows: {0} bytes, read in {1:.4f}s'.format(row_size, row_time))
+        self.stdout.write('columnar: {0} bytes, read in {1:.4f}s ({2:.1f}x smaller, {3:.1f}x faster)'.format(
+            columnar_size, columnar_time, row_size / max(columnar_size, 1), row_time / columnar_time))
@@ -0,0 +1,65 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from sidermit.city import Graph, Demand, GraphContentFormat
+
+from storage.utils import get_demand_matrix_array, read_demand_matrix_csv
+
+
+def loop_demand_matrix_to_list(demand_obj):
+    """ conversion used by city matrix actions before vectorized version """
+    demand_matrix = demand_obj.get_matrix()
+    demand_matrix_data = []
+    size = len(demand_matrix.keys())
+    for i in range(size):
+        row = []
+        for j in range(size):
+            row.append(round(demand_matrix[i][j], 2))
+        demand_matrix_data.append(row)
+
+    return demand_matrix_data
+
+
+def loop_read_demand_matrix_csv(content, graph_obj):
+    """ csv parsing used by city matrix actions before vectorized version """
+    matrix = []
+    rows = content.split('\n')[1:]
+    for row in rows:
+        matrix.append([float(value) for value in row.split(',')[1:]])
+
+    return loop_demand_matrix_to_list(Demand.build_from_content(graph_obj, matrix))
+
+
+class Command(BaseCommand):
+    help = 'Compare python loops and numpy pipeline to convert and parse demand matrices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--zones', nargs='+', type=int, default=[100, 200, 400],
+                            help='number of zones of each graph, graph has 2 * zones + 1 nodes')
+        parser.add_argument('--repeat', type=int, default=3, help='number of runs, best time is reported')
+
+    def handle(self, *args, **options):
+        for zones in options['zones']:
+            graph_obj = Graph.build_from_parameters(zones, 2, 3, 4)
+            # api works with graphs read from pajek content
+            graph_obj = Graph.build_from_content(graph_obj.export_graph(GraphContentFormat.PAJEK),
+                                                 GraphContentFormat.PAJEK)
+            demand_obj = Demand.build_from_parameters(graph_obj, 15000, 0.8, 0.4, 0.5)
+            header = ','.join(str(node_obj.name) for node_obj in graph_obj.get_nodes())
+            rows = ['{0},{1}'.format(name, ','.join(map(str, row))) for name, row in
+                    zip(header.split(','), loop_demand_matrix_to_list(demand_obj))]
+            content = '\n'.join([',{0}'.format(header)] + rows)
+
+            cases = [
+                ('to list', lambda: loop_demand_matrix_to_list(demand_obj),
+                 lambda: get_demand_matrix_array(demand_obj, graph_obj).tolist()),
+                ('from csv', lambda: loop_read_demand_matrix_csv(content, graph_obj),
+                 lambda: read_demand_matrix_csv(content, graph_obj).tolist()),
+            ]
+            for name, loop_function, numpy_function in cases:
+                if loop_function() != numpy_function():
+                    self.stderr.write('{0}: results are different for {1} zones'.format(name, zones))
+                loop_time = min(timeit.repeat(loop_function, number=1, repeat=options['repeat']))
+                numpy_time = min(timeit.repeat(numpy_function, number=1, repeat=options['repeat']))
+                self.stdout.write('{0} nodes, {1}: loop {2:.4f}s numpy {3:.4f}s ({4:.1f}x)'.format(
+                    len(graph_obj.get_nodes()), name, loop_time, numpy_time, loop_time / numpy_time))
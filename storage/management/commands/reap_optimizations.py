@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rqworkers.reaper import reap_orphaned_optimizations, reap_failed_parameter_sweeps
+
+
+class Command(BaseCommand):
+    help = 'Enqueue again or move to error transport networks processing in a worker that died, move to error ' \
+           'parameter sweeps with a chunk that died'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-retries', type=int, default=settings.OPTIMIZATION_REAPER_MAX_RETRIES,
+                            help='times an optimization is enqueued again before it is moved to error')
+        parser.add_argument('--loop', action='store_true', help='run until the process is stopped')
+        parser.add_argument('--interval', type=float, default=settings.OPTIMIZATION_REAPER_INTERVAL,
+                            help='seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            retried_list, failed_list = reap_orphaned_optimizations(max_retries=options['max_retries'])
+            if retried_list or failed_list:
+                self.stdout.write('{0} optimizations enqueued again, {1} moved to error'.format(
+                    len(retried_list), len(failed_list)))
+            failed_sweep_list = reap_failed_parameter_sweeps()
+            if failed_sweep_list:
+                self.stdout.write('{0} parameter sweeps moved to error'.format(len(failed_sweep_list)))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,33 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rqworkers.pool import OptimizerWorkerPool
+
+
+class Command(BaseCommand):
+    help = 'Run a pool of optimizer workers that scales with queue depth'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queues', nargs='*', default=[settings.OPTIMIZER_QUEUE_NAME],
+                            help='queues listened by every worker')
+        parser.add_argument('--min-workers', type=int, default=settings.OPTIMIZER_POOL_MIN_WORKERS)
+        parser.add_argument('--max-workers', type=int,
+                            default=settings.OPTIMIZER_POOL_MAX_WORKERS or os.cpu_count() or 1,
+                            help='number of cores by default')
+        parser.add_argument('--worker-class', default='rqworkers.optimizerWorker.OptimizerWorker')
+        parser.add_argument('--check-interval', type=float, default=settings.OPTIMIZER_POOL_CHECK_INTERVAL,
+                            help='seconds between queue depth checks')
+        parser.add_argument('--drain-timeout', type=float, default=settings.OPTIMIZER_POOL_DRAIN_TIMEOUT,
+                            help='seconds to wait for running jobs on shutdown, it waits forever if it is not given')
+
+    def handle(self, *args, **options):
+        min_workers = max(options['min_workers'], 0)
+        max_workers = max(options['max_workers'], min_workers, 1)
+        self.stdout.write('starting optimizer worker pool on {0} with {1} to {2} workers'.format(
+            ', '.join(options['queues']), min_workers, max_workers))
+
+        pool = OptimizerWorkerPool(options['queues'], min_workers, max_workers, options['worker_class'],
+                                   check_interval=options['check_interval'])
+        pool.run(drain_timeout=options['drain_timeout'])
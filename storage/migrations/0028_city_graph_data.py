@@ -0,0 +1,73 @@
+# Generated by Django 3.1.3 on 2026-10-17 04:07
+
+import hashlib
+
+from django.db import migrations, models
+from sidermit.city import Graph, GraphContentFormat
+from sidermit.city.graph import CBD, Periphery, Subcenter
+from sidermit.exceptions import SIDERMITException
+
+# copy of storage.utils and storage.cache helpers at the time of this migration
+
+
+def build_city_graph(graph_content, n, l, g, p, etha, etha_zone, angles, gi, hi):
+    try:
+        return Graph.build_from_parameters(n, l, g, p, etha, etha_zone, angles, gi, hi)
+    except (SIDERMITException, TypeError):
+        return Graph.build_from_content(graph_content, GraphContentFormat.PAJEK)
+
+
+def get_network_descriptor(graph_obj):
+    nodes = []
+    for node_obj in graph_obj.get_nodes():
+        node_type = None
+        if isinstance(node_obj, CBD):
+            node_type = 'cbd'
+        elif isinstance(node_obj, Periphery):
+            node_type = 'periphery'
+        elif isinstance(node_obj, Subcenter):
+            node_type = 'subcenter'
+        nodes.append(dict(name=str(node_obj.name), id=int(node_obj.id), x=float(node_obj.x), y=float(node_obj.y),
+                          type=node_type))
+
+    edges = [dict(id=int(edge_obj.id), source=int(edge_obj.node1.id), target=int(edge_obj.node2.id)) for edge_obj in
+             graph_obj.get_edges()]
+
+    return dict(nodes=nodes, edges=edges)
+
+
+def fill_city_graph_data(apps, schema_editor):
+    City = apps.get_model('storage', 'City')
+    for city_obj in City.objects.all():
+        graph_obj = build_city_graph(city_obj.graph, city_obj.n, city_obj.l, city_obj.g, city_obj.p, city_obj.etha,
+                                     city_obj.etha_zone, city_obj.angles, city_obj.gi, city_obj.hi)
+        City.objects.filter(pk=city_obj.pk).update(
+            graph_fingerprint=hashlib.sha1(city_obj.graph.encode('utf-8')).hexdigest(),
+            network_descriptor=get_network_descriptor(graph_obj),
+            demand_matrix_header=[str(node_obj.name) for node_obj in graph_obj.get_nodes()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0027_auto_20201120_1502'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='demand_matrix_header',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='graph_fingerprint',
+            field=models.CharField(max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='network_descriptor',
+            field=models.JSONField(null=True),
+        ),
+        migrations.RunPython(fill_city_graph_data, migrations.RunPython.noop),
+    ]
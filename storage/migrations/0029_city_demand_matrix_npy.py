@@ -0,0 +1,42 @@
+# Generated by Django 3.1.3 on 2026-10-17 05:12
+
+from django.db import migrations
+
+import storage.fields
+
+
+def copy_demand_matrix(apps, schema_editor):
+    City = apps.get_model('storage', 'City')
+    for city_obj in City.objects.exclude(demand_matrix__isnull=True).only('demand_matrix').iterator():
+        City.objects.filter(pk=city_obj.pk).update(demand_matrix_npy=city_obj.demand_matrix)
+
+
+def copy_demand_matrix_npy(apps, schema_editor):
+    City = apps.get_model('storage', 'City')
+    for city_obj in City.objects.exclude(demand_matrix_npy__isnull=True).only('demand_matrix_npy').iterator():
+        City.objects.filter(pk=city_obj.pk).update(demand_matrix=city_obj.demand_matrix_npy.tolist())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0028_city_graph_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='demand_matrix_npy',
+            field=storage.fields.NumpyMatrixField(editable=True, null=True),
+        ),
+        migrations.RunPython(copy_demand_matrix, copy_demand_matrix_npy),
+        migrations.RemoveField(
+            model_name='city',
+            name='demand_matrix',
+        ),
+        migrations.RenameField(
+            model_name='city',
+            old_name='demand_matrix_npy',
+            new_name='demand_matrix',
+        ),
+    ]
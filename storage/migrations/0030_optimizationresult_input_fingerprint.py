@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-17 04:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0029_city_demand_matrix_npy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='optimizationresult',
+            name='input_fingerprint',
+            field=models.CharField(db_index=True, max_length=40, null=True),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.1.3 on 2026-10-17 04:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0030_optimizationresult_input_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParameterSweep',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('public_id', models.UUIDField(default=uuid.uuid4)),
+                ('parameters', models.JSONField()),
+                ('point_number', models.IntegerField()),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('processing', 'Processing'), ('finished', 'Finished'), ('error', 'Error')], default=None, max_length=20, null=True)),
+                ('ran_at', models.DateTimeField(default=None, null=True)),
+                ('duration', models.DurationField(default=None, null=True)),
+                ('transport_network', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='storage.transportnetwork')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ParameterSweepResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('point', models.IntegerField()),
+                ('overrides', models.JSONField()),
+                ('vrc', models.FloatField(null=True)),
+                ('co', models.FloatField(null=True)),
+                ('ci', models.FloatField(null=True)),
+                ('cu', models.FloatField(null=True)),
+                ('tv', models.FloatField(null=True)),
+                ('tw', models.FloatField(null=True)),
+                ('ta', models.FloatField(null=True)),
+                ('t', models.FloatField(null=True)),
+                ('error_message', models.TextField(default=None, null=True)),
+                ('parameter_sweep', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='storage.parametersweep')),
+            ],
+            options={
+                'unique_together': {('parameter_sweep', 'point')},
+            },
+        ),
+    ]
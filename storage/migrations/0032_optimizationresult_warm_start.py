@@ -0,0 +1,29 @@
+# Generated by Django 3.1.3 on 2026-10-17 05:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0031_parametersweep'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='optimizationresult',
+            name='iteration_number',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='optimizationresult',
+            name='saved_iteration_number',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='optimizationresult',
+            name='warm_start_transport_network',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='storage.transportnetwork'),
+        ),
+    ]
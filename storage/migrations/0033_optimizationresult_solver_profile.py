@@ -0,0 +1,23 @@
+# Generated by Django 3.1.3 on 2026-10-17 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0032_optimizationresult_warm_start'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='optimizationresult',
+            name='deadline_reached',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='optimizationresult',
+            name='solver_profile',
+            field=models.CharField(max_length=20, null=True),
+        ),
+    ]
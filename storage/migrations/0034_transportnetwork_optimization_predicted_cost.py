@@ -0,0 +1,23 @@
+# Generated by Django 3.1.3 on 2026-10-17 05:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0033_optimizationresult_solver_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transportnetwork',
+            name='optimization_predicted_cost',
+            field=models.FloatField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='transportnetwork',
+            name='optimization_queue',
+            field=models.CharField(default=None, max_length=50, null=True),
+        ),
+    ]
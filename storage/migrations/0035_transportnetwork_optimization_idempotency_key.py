@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-17 05:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0034_transportnetwork_optimization_predicted_cost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transportnetwork',
+            name='optimization_idempotency_key',
+            field=models.CharField(default=None, max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.3 on 2026-10-17 05:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0035_transportnetwork_optimization_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OptimizationCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('input_fingerprint', models.CharField(max_length=40)),
+                ('saved_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('iteration_number', models.IntegerField()),
+                ('frequencies', models.JSONField()),
+                ('better_result', models.JSONField(null=True)),
+                ('transport_network', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='storage.transportnetwork')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-17 05:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0036_optimizationcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transportnetwork',
+            name='optimization_retry_number',
+            field=models.IntegerField(default=0),
+        ),
+    ]
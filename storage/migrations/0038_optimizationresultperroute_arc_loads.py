@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-17 05:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0037_transportnetwork_optimization_retry_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='optimizationresultperroute',
+            name='arc_loads',
+            field=models.BinaryField(default=None, null=True),
+        ),
+    ]
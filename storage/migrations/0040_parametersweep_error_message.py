@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-17 06:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0039_version_and_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parametersweep',
+            name='error_message',
+            field=models.TextField(default=None, null=True),
+        ),
+    ]
@@ -1,21 +1,41 @@
 import uuid
 
-from django.contrib.postgres.fields import ArrayField
+import numpy as np
 from django.db import models
+from django.db.models import DEFERRED
 from django.utils import timezone
-from sidermit.city import Graph, GraphContentFormat, Demand
 from sidermit.publictransportsystem import Passenger as SidermitPassenger, TransportMode as SidermitTransportMode, \
     TransportNetwork as SidermitTransportNetwork, Route as SidermitRoute
 from sidermit.publictransportsystem import RouteType
 
+from storage.cache import sidermit_cache
+from storage.fields import NumpyMatrixField
+from storage.utils import get_city_graph_data
 
-class City(models.Model):
+
+class VersionedModelMixin:
+    """
+    version and updated_at are only written by storage.versions.bump_versions. Other saves of an existing object do
+    not write them, so an object loaded before a bump does not bring back its previous version.
+    """
+    VERSION_FIELDS = ['version', 'updated_at']
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            deferred_fields = self.get_deferred_fields()
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields if
+                                       not field.primary_key and field.name not in self.VERSION_FIELDS and
+                                       field.attname not in deferred_fields]
+        super().save(*args, **kwargs)
+
+
+class City(VersionedModelMixin, models.Model):
     """ city == project """
     created_at = models.DateTimeField(default=timezone.now)
     public_id = models.UUIDField(default=uuid.uuid4)
     name = models.CharField(max_length=50)
     graph = models.TextField(null=False)
-    demand_matrix = ArrayField(ArrayField(models.FloatField()), null=True)
+    demand_matrix = NumpyMatrixField(null=True)
     # graph parameters
     n = models.IntegerField(null=True)
     p = models.FloatField(null=True)
@@ -33,18 +53,87 @@ class City(models.Model):
     alpha = models.FloatField(null=True)
     beta = models.FloatField(null=True)
 
+    # data derived from graph, computed on save
+    graph_fingerprint = models.CharField(max_length=40, null=True)
+    network_descriptor = models.JSONField(null=True)
+    demand_matrix_header = models.JSONField(null=True)
+    # increased when api payload of the object changes, see storage.versions
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    GRAPH_FIELDS = ['graph', 'n', 'l', 'g', 'p', 'etha', 'etha_zone', 'angles', 'gi', 'hi']
+    GRAPH_DATA_FIELDS = ['graph_fingerprint', 'network_descriptor', 'demand_matrix_header']
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # keep content read from database to know what changed on save
+        instance._loaded_content = {field_name: value for field_name, value in zip(field_names, values) if
+                                    field_name in cls.GRAPH_FIELDS + ['demand_matrix'] and value is not DEFERRED}
+
+        return instance
+
+    def save(self, *args, **kwargs):
+        if self.graph_has_changed():
+            self.update_graph_data()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | set(self.GRAPH_DATA_FIELDS)
+        super().save(*args, **kwargs)
+        self.invalidate_sidermit_cache(changed_only=True)
+        deferred_fields = self.get_deferred_fields()
+        self._loaded_content = {field_name: getattr(self, field_name) for field_name in
+                                self.GRAPH_FIELDS + ['demand_matrix'] if field_name not in deferred_fields}
+
+    def delete(self, *args, **kwargs):
+        self.invalidate_sidermit_cache()
+        return super().delete(*args, **kwargs)
+
+    def graph_has_changed(self):
+        """ True if graph or its parameters changed since the instance was read from database """
+        loaded_content = getattr(self, '_loaded_content', None)
+        if loaded_content is None:
+            return True
+
+        return any(loaded_content[field_name] != getattr(self, field_name) for field_name in self.GRAPH_FIELDS if
+                   field_name in loaded_content)
+
+    def update_graph_data(self):
+        """ compute graph fingerprint, network descriptor and demand matrix header """
+        graph_data = get_city_graph_data(self.graph, self.n, self.l, self.g, self.p, self.etha, self.etha_zone,
+                                         self.angles, self.gi, self.hi)
+        for field_name, value in graph_data.items():
+            setattr(self, field_name, value)
+
+    def invalidate_sidermit_cache(self, changed_only=False):
+        """ remove parsed graph and demand objects built with previous content from cache """
+        loaded_content = getattr(self, '_loaded_content', {})
+        previous_graph = loaded_content.get('graph')
+        if previous_graph is None:
+            return
+        graph_changed = previous_graph != self.graph
+        if graph_changed or not changed_only:
+            sidermit_cache.invalidate_graph(previous_graph)
+
+        previous_demand_matrix = loaded_content.get('demand_matrix')
+        if previous_demand_matrix is not None and \
+                (graph_changed or not np.array_equal(previous_demand_matrix, self.demand_matrix) or not changed_only):
+            sidermit_cache.invalidate_demand(previous_graph, previous_demand_matrix)
+
     def get_sidermit_graph(self):
-        return Graph.build_from_content(self.graph, GraphContentFormat.PAJEK)
+        return sidermit_cache.get_graph(self.graph)
 
     def get_sidermit_demand_matrix(self, graph):
-        return Demand.build_from_content(graph, self.demand_matrix)
+        return sidermit_cache.get_demand(graph, self.graph, self.demand_matrix)
 
 
-class Scene(models.Model):
+class Scene(VersionedModelMixin, models.Model):
     city = models.ForeignKey(City, on_delete=models.CASCADE)
     public_id = models.UUIDField(default=uuid.uuid4)
     created_at = models.DateTimeField(default=timezone.now)
     name = models.CharField(max_length=50)
+    # increased when api payload of the object changes, see storage.versions
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(default=timezone.now)
 
 
 class Passenger(models.Model):
@@ -91,7 +180,7 @@ class TransportMode(models.Model):
         unique_together = ['scene', 'name']
 
 
-class TransportNetwork(models.Model):
+class TransportNetwork(VersionedModelMixin, models.Model):
     scene = models.ForeignKey(Scene, on_delete=models.CASCADE)
     created_at = models.DateTimeField(default=timezone.now)
     name = models.CharField(max_length=50)
@@ -110,6 +199,16 @@ class TransportNetwork(models.Model):
     optimization_ran_at = models.DateTimeField(default=None, null=True)
     optimization_error_message = models.TextField(default=None, null=True)
     optimization_duration = models.DurationField(default=None, null=True)
+    # cost predicted by rqworkers.cost when job was enqueued and queue that received it
+    optimization_predicted_cost = models.FloatField(default=None, null=True)
+    optimization_queue = models.CharField(max_length=50, default=None, null=True)
+    # key of the request that submitted the last optimization, a request with the same key is not enqueued again
+    optimization_idempotency_key = models.CharField(max_length=100, default=None, null=True)
+    # times rqworkers.reaper enqueued the optimization again after its worker died
+    optimization_retry_number = models.IntegerField(default=0)
+    # increased when api payload of the object changes, see storage.versions
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(default=timezone.now)
 
     job_id = models.UUIDField(null=True)
 
@@ -147,6 +246,16 @@ class Route(models.Model):
 
 class OptimizationResult(models.Model):
     transport_network = models.OneToOneField(TransportNetwork, on_delete=models.CASCADE)
+    # hash of optimization inputs, results with the same value can be copied instead of computed again
+    input_fingerprint = models.CharField(max_length=40, null=True, db_index=True)
+    solver_profile = models.CharField(max_length=20, null=True)
+    # optimizer stopped before convergence because solver deadline was reached
+    deadline_reached = models.BooleanField(default=False)
+    # external iterations done by optimizer, and iterations saved when it started from frequencies of another result
+    iteration_number = models.IntegerField(null=True)
+    warm_start_transport_network = models.ForeignKey(TransportNetwork, null=True, on_delete=models.SET_NULL,
+                                                     related_name='+')
+    saved_iteration_number = models.IntegerField(null=True)
     # optimization variables
     vrc = models.FloatField()
     co = models.FloatField()
@@ -178,6 +287,9 @@ class OptimizationResultPerRoute(models.Model):
     tc = models.FloatField()
     co = models.FloatField()
     lambda_min = models.FloatField()
+    # arc loads packed by storage.results.pack_arc_loads when settings.OPTIMIZATION_RESULT_ARC_STORAGE is columnar,
+    # if it is null they are OptimizationResultPerRouteDetail rows
+    arc_loads = models.BinaryField(default=None, null=True)
 
 
 class OptimizationResultPerRouteDetail(models.Model):
@@ -193,3 +305,55 @@ class OptimizationResultPerRouteDetail(models.Model):
     origin_node = models.IntegerField()
     destination_node = models.IntegerField()
     lambda_value = models.FloatField()
+
+
+class OptimizationCheckpoint(models.Model):
+    """ state of a running optimization saved after each iteration, a restarted job resumes from it """
+    transport_network = models.OneToOneField(TransportNetwork, on_delete=models.CASCADE)
+    # checkpoint is used only by an optimization with the same inputs
+    input_fingerprint = models.CharField(max_length=40)
+    saved_at = models.DateTimeField(default=timezone.now)
+    iteration_number = models.IntegerField()
+    # route name -> frequency given to optimizer in the next iteration
+    frequencies = models.JSONField()
+    # best result of iterations done so far, with the shape used by sidermit Optimizer.get_better_result
+    better_result = models.JSONField(null=True)
+
+
+class ParameterSweep(models.Model):
+    """ optimizations of a transport network with different passenger and transport mode values """
+    transport_network = models.ForeignKey(TransportNetwork, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now)
+    public_id = models.UUIDField(default=uuid.uuid4)
+    STATUS_QUEUED = TransportNetwork.STATUS_QUEUED
+    STATUS_PROCESSING = TransportNetwork.STATUS_PROCESSING
+    STATUS_FINISHED = TransportNetwork.STATUS_FINISHED
+    STATUS_ERROR = TransportNetwork.STATUS_ERROR
+    # grid or list of points requested by user
+    parameters = models.JSONField()
+    point_number = models.IntegerField()
+    status = models.CharField(max_length=20, choices=TransportNetwork.status_choices, default=None, null=True)
+    ran_at = models.DateTimeField(default=None, null=True)
+    duration = models.DurationField(default=None, null=True)
+    # error of a chunk of points that failed as a whole, errors of single points are saved in their results
+    error_message = models.TextField(default=None, null=True)
+
+
+class ParameterSweepResult(models.Model):
+    """ global optimization results of one point of a parameter sweep """
+    parameter_sweep = models.ForeignKey(ParameterSweep, on_delete=models.CASCADE)
+    point = models.IntegerField()
+    overrides = models.JSONField()
+    # optimization variables, they are null if optimization failed
+    vrc = models.FloatField(null=True)
+    co = models.FloatField(null=True)
+    ci = models.FloatField(null=True)
+    cu = models.FloatField(null=True)
+    tv = models.FloatField(null=True)
+    tw = models.FloatField(null=True)
+    ta = models.FloatField(null=True)
+    t = models.FloatField(null=True)
+    error_message = models.TextField(default=None, null=True)
+
+    class Meta:
+        unique_together = ('parameter_sweep', 'point')
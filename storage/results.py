@@ -0,0 +1,350 @@
+import hashlib
+import io
+import json
+import logging
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction, connection
+from django.utils import timezone
+
+from storage.cache import get_graph_fingerprint, get_demand_matrix_fingerprint
+from storage.models import OptimizationResult, OptimizationResultPerMode, OptimizationResultPerRoute, \
+    OptimizationResultPerRouteDetail, Route, TransportMode, Passenger, TransportNetwork, OptimizationCheckpoint
+
+logger = logging.getLogger(__name__)
+
+
+# change it when the fingerprint content changes, so previous fingerprints do not match anymore
+INPUT_FINGERPRINT_VERSION = 1
+PASSENGER_FIELDS = ['va', 'pv', 'pw', 'pa', 'pt', 'spv', 'spw', 'spa', 'spt']
+TRANSPORT_MODE_FIELDS = ['name', 'bya', 'co', 'c1', 'c2', 'v', 't', 'fini', 'fmax', 'kmax', 'theta', 'tat', 'd']
+ROUTE_FIELDS = ['name', 'nodes_sequence_i', 'stops_sequence_i', 'nodes_sequence_r', 'stops_sequence_r', 'type']
+
+ARC_STORAGE_ROWS = 'rows'
+ARC_STORAGE_COLUMNAR = 'columnar'
+# packed arc loads are these columns one after the other, direction is stored as its index in ARC_LOAD_DIRECTIONS
+ARC_LOAD_COLUMNS = [('direction', '<u1'), ('origin_node', '<i4'), ('destination_node', '<i4'), ('lambda_value', '<f8')]
+ARC_LOAD_DIRECTIONS = [OptimizationResultPerRouteDetail.DIRECTION_I, OptimizationResultPerRouteDetail.DIRECTION_R]
+ARC_LOAD_SIZE = sum(np.dtype(dtype).itemsize for _, dtype in ARC_LOAD_COLUMNS)
+
+
+def get_optimization_input_fingerprint(transport_network_obj, transport_mode_obj_list, route_obj_list,
+                                       optimizer_parameters):
+    """
+    Hash of everything that defines the result of an optimization: city graph, demand matrix, passenger, transport
+    modes, routes and optimizer parameters. Names are part of the hash because results are related to routes and
+    transport modes by name.
+
+    :param transport_network_obj: transport network with its scene, city and passenger
+    :param transport_mode_obj_list: transport modes of the scene
+    :param route_obj_list: routes of transport network
+    :param optimizer_parameters: dict with parameters given to sidermit optimizer
+    :return: hex digest
+    """
+    scene_obj = transport_network_obj.scene
+    city_obj = scene_obj.city
+    try:
+        passenger = [getattr(scene_obj.passenger, field_name) for field_name in PASSENGER_FIELDS]
+    except Passenger.DoesNotExist:
+        passenger = None
+    transport_mode_name_dict = {transport_mode_obj.id: transport_mode_obj.name for transport_mode_obj in
+                                transport_mode_obj_list}
+
+    content = dict(
+        version=INPUT_FINGERPRINT_VERSION,
+        graph=get_graph_fingerprint(city_obj.graph),
+        demand=None if city_obj.demand_matrix is None else get_demand_matrix_fingerprint(city_obj.demand_matrix),
+        passenger=passenger,
+        transport_modes=sorted([getattr(transport_mode_obj, field_name) for field_name in TRANSPORT_MODE_FIELDS]
+                               for transport_mode_obj in transport_mode_obj_list),
+        routes=sorted([getattr(route_obj, field_name) for field_name in ROUTE_FIELDS] +
+                      [transport_mode_name_dict[route_obj.transport_mode_id]] for route_obj in route_obj_list),
+        optimizer_parameters=optimizer_parameters)
+
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def find_optimization_result_source(input_fingerprint, transport_network_obj, optimizer_parameters):
+    """
+    Inputs of a finished transport network can change after its optimization (e.g. a transport mode is renamed or
+    deleted), so the fingerprint of each candidate is computed again from its current inputs. Candidates that do not
+    match anymore lose their fingerprint, so they are not checked again.
+
+    :param optimizer_parameters: dict with parameters given to sidermit optimizer, the same used for input_fingerprint
+    :return: another finished transport network with results computed from the same inputs or None
+    """
+    for source_transport_network_obj in TransportNetwork.objects.select_related(
+            'scene__city', 'scene__passenger').filter(
+            optimizationresult__input_fingerprint=input_fingerprint,
+            optimization_status=TransportNetwork.STATUS_FINISHED).exclude(pk=transport_network_obj.pk):
+        current_input_fingerprint = get_optimization_input_fingerprint(
+            source_transport_network_obj, source_transport_network_obj.scene.transportmode_set.all(),
+            source_transport_network_obj.route_set.all(), optimizer_parameters)
+        if current_input_fingerprint == input_fingerprint:
+            return source_transport_network_obj
+        OptimizationResult.objects.filter(transport_network=source_transport_network_obj).update(
+            input_fingerprint=None)
+
+    return None
+
+
+def get_warm_start_frequencies(reference_transport_network_obj, route_obj_list, transport_mode_obj_list):
+    """
+    Initial frequencies for optimizer taken from results of reference transport network. Routes are matched by name,
+    routes without a positive frequency in reference start with fini of their transport mode.
+
+    :return: dict route name -> frequency or None if no route matches
+    """
+    frequency_dict = dict(OptimizationResultPerRoute.objects.filter(
+        transport_network=reference_transport_network_obj, frequency__gt=0).values_list('route__name', 'frequency'))
+    if not any(route_obj.name in frequency_dict for route_obj in route_obj_list):
+        return None
+
+    fini_dict = {transport_mode_obj.id: transport_mode_obj.fini for transport_mode_obj in transport_mode_obj_list}
+
+    return {route_obj.name: frequency_dict.get(route_obj.name, fini_dict[route_obj.transport_mode_id]) for route_obj
+            in route_obj_list}
+
+
+def get_route_arc_loads(route):
+    """
+    :param route: item of list returned by sidermit Optimizer.get_network_results
+    :return: list of (direction, origin node, destination node, lambda value) for each arc of both directions
+    """
+    return [(direction, node_i, node_j, charge_ij) for direction, sub_table in
+            zip(ARC_LOAD_DIRECTIONS, [route[8], route[9]]) for node_i, node_j, charge_ij in sub_table]
+
+
+def pack_arc_loads(arc_load_list):
+    """
+    Pack arc loads of a route in typed columns, 17 bytes by arc instead of a database row.
+
+    :param arc_load_list: list of (direction, origin node, destination node, lambda value)
+    :return: bytes
+    """
+    if not arc_load_list:
+        return b''
+    direction_list, origin_list, destination_list, lambda_list = zip(*arc_load_list)
+    direction_list = [ARC_LOAD_DIRECTIONS.index(direction) for direction in direction_list]
+
+    return b''.join(np.asarray(values, dtype=dtype).tobytes() for values, (_, dtype) in
+                    zip([direction_list, origin_list, destination_list, lambda_list], ARC_LOAD_COLUMNS))
+
+
+def unpack_arc_loads(data):
+    """
+    :param data: bytes returned by pack_arc_loads
+    :return: list of dicts with the same keys and values as OptimizationResultPerRouteDetailSerializer
+    """
+    data = bytes(data)
+    arc_number = len(data) // ARC_LOAD_SIZE
+    column_list = []
+    offset = 0
+    for _, dtype in ARC_LOAD_COLUMNS:
+        column = np.frombuffer(data, dtype=dtype, count=arc_number, offset=offset)
+        offset += column.nbytes
+        column_list.append(column.tolist())
+    direction_list = [ARC_LOAD_DIRECTIONS[index] for index in column_list[0]]
+
+    return [dict(zip([name for name, _ in ARC_LOAD_COLUMNS], arc_load)) for arc_load in
+            zip(direction_list, *column_list[1:])]
+
+
+def _delete_results(transport_network_obj):
+    OptimizationResultPerRouteDetail.objects.filter(opt_route__transport_network=transport_network_obj).delete()
+    OptimizationResultPerRoute.objects.filter(transport_network=transport_network_obj).delete()
+    OptimizationResultPerMode.objects.filter(transport_network=transport_network_obj).delete()
+    OptimizationResult.objects.filter(transport_network=transport_network_obj).delete()
+
+
+def _insert_route_details(detail_obj_list):
+    if len(detail_obj_list) > settings.OPTIMIZATION_RESULT_COPY_THRESHOLD:
+        _copy_route_details(detail_obj_list)
+    else:
+        OptimizationResultPerRouteDetail.objects.bulk_create(detail_obj_list)
+
+
+def _copy_route_details(detail_obj_list):
+    """ insert rows with postgresql COPY, it is faster than INSERT for large tables """
+    buffer = io.StringIO()
+    for detail_obj in detail_obj_list:
+        row = (detail_obj.opt_route_id, detail_obj.direction, int(detail_obj.origin_node),
+               int(detail_obj.destination_node), float(detail_obj.lambda_value))
+        buffer.write('{0}\t{1}\t{2}\t{3}\t{4!r}\n'.format(*row))
+    buffer.seek(0)
+
+    columns = ('opt_route_id', 'direction', 'origin_node', 'destination_node', 'lambda_value')
+    with connection.cursor() as cursor:
+        cursor.copy_from(buffer, OptimizationResultPerRouteDetail._meta.db_table, columns=columns)
+
+
+def save_optimization_results(transport_network_obj, overall_results, network_results, route_id_dict=None,
+                              transport_mode_id_dict=None, input_fingerprint=None, solver_profile=None,
+                              deadline_reached=False, iteration_number=None, warm_start_transport_network_obj=None,
+                              saved_iteration_number=None):
+    """
+    Replace results of transport network in one transaction. Rows are inserted with bulk_create, route details
+    with COPY when they are more than settings.OPTIMIZATION_RESULT_COPY_THRESHOLD rows. Route details are packed in
+    OptimizationResultPerRoute.arc_loads instead when settings.OPTIMIZATION_RESULT_ARC_STORAGE is columnar.
+
+    :param transport_network_obj: optimized transport network
+    :param overall_results: dict returned by sidermit Optimizer.get_overall_results
+    :param network_results: list returned by sidermit Optimizer.get_network_results
+    :param route_id_dict: dict route name -> route id, it is queried if it is not given
+    :param transport_mode_id_dict: dict transport mode name -> transport mode id, it is queried if it is not given
+    :param input_fingerprint: value returned by get_optimization_input_fingerprint for optimization inputs
+    :param solver_profile: name of solver profile used by optimizer
+    :param deadline_reached: True if optimizer stopped because of solver deadline
+    :param iteration_number: external iterations done by optimizer
+    :param warm_start_transport_network_obj: transport network whose frequencies were used as initial frequencies
+    :param saved_iteration_number: iterations saved by warm start compared with the reference optimization
+    :return: persistence duration in seconds
+    """
+    start_time = time.perf_counter()
+
+    if route_id_dict is None:
+        route_id_dict = {name: route_id for route_id, name in
+                         Route.objects.filter(transport_network=transport_network_obj).values_list('id', 'name')}
+    if transport_mode_id_dict is None:
+        transport_mode_id_dict = {name: transport_mode_id for transport_mode_id, name in
+                                  TransportMode.objects.filter(scene_id=transport_network_obj.scene_id).values_list(
+                                      'id', 'name')}
+
+    with transaction.atomic():
+        _delete_results(transport_network_obj)
+
+        OptimizationResult.objects.create(
+            transport_network=transport_network_obj, input_fingerprint=input_fingerprint,
+            solver_profile=solver_profile, deadline_reached=deadline_reached, iteration_number=iteration_number,
+            warm_start_transport_network=warm_start_transport_network_obj,
+            saved_iteration_number=saved_iteration_number, vrc=overall_results['VRC'],
+            co=overall_results['operators_cost'], ci=overall_results['infrastructure_cost'],
+            cu=overall_results['users_cost'], tv=overall_results['travel_time_on_board'],
+            tw=overall_results['waiting_time'], ta=overall_results['access_time'], t=overall_results['transfers'])
+
+        OptimizationResultPerMode.objects.bulk_create([
+            OptimizationResultPerMode(transport_network=transport_network_obj,
+                                      transport_mode_id=transport_mode_id_dict[mode.name], b=b,
+                                      k=overall_results['vehicle_capacity_mode'][mode],
+                                      l=overall_results['lines_mode'][mode])
+            for mode, b in overall_results['vehicles_mode'].items()])
+
+        columnar = settings.OPTIMIZATION_RESULT_ARC_STORAGE == ARC_STORAGE_COLUMNAR
+        arc_load_list_list = [get_route_arc_loads(route) for route in network_results]
+        opt_result_per_route_obj_list = OptimizationResultPerRoute.objects.bulk_create([
+            OptimizationResultPerRoute(transport_network=transport_network_obj, route_id=route_id_dict[route[0]],
+                                       frequency=route[1], frequency_per_line=route[2], k=route[3], b=route[4],
+                                       tc=route[5], co=route[6], lambda_min=route[7],
+                                       arc_loads=pack_arc_loads(arc_load_list) if columnar else None)
+            for route, arc_load_list in zip(network_results, arc_load_list_list)])
+
+        detail_obj_list = []
+        if not columnar:
+            for opt_result_per_route_obj, arc_load_list in zip(opt_result_per_route_obj_list, arc_load_list_list):
+                for direction, node_i, node_j, charge_ij in arc_load_list:
+                    detail_obj_list.append(OptimizationResultPerRouteDetail(
+                        opt_route_id=opt_result_per_route_obj.pk, direction=direction, origin_node=node_i,
+                        destination_node=node_j, lambda_value=charge_ij))
+
+            _insert_route_details(detail_obj_list)
+
+    duration = time.perf_counter() - start_time
+    logger.info('results of transport network "{0}" saved in {1:.3f} seconds ({2} routes, {3} arcs, {4})'.format(
+        transport_network_obj.public_id, duration, len(opt_result_per_route_obj_list),
+        sum(len(arc_load_list) for arc_load_list in arc_load_list_list), settings.OPTIMIZATION_RESULT_ARC_STORAGE))
+
+    return duration
+
+
+def copy_optimization_results(source_transport_network_obj, transport_network_obj):
+    """
+    Replace results of transport network with a copy of results of source transport network. Both networks must
+    have the same input fingerprint, so routes and transport modes are matched by name.
+    """
+    route_id_dict = dict(Route.objects.filter(transport_network=transport_network_obj).values_list('name', 'id'))
+    transport_mode_id_dict = dict(TransportMode.objects.filter(
+        scene_id=transport_network_obj.scene_id).values_list('name', 'id'))
+
+    with transaction.atomic():
+        _delete_results(transport_network_obj)
+
+        opt_result_obj = OptimizationResult.objects.get(transport_network=source_transport_network_obj)
+        opt_result_obj.pk = None
+        opt_result_obj.transport_network = transport_network_obj
+        opt_result_obj.save()
+
+        opt_result_per_mode_obj_list = []
+        for opt_result_per_mode_obj in OptimizationResultPerMode.objects.select_related('transport_mode').filter(
+                transport_network=source_transport_network_obj):
+            opt_result_per_mode_obj.pk = None
+            opt_result_per_mode_obj.transport_network = transport_network_obj
+            opt_result_per_mode_obj.transport_mode_id = transport_mode_id_dict[
+                opt_result_per_mode_obj.transport_mode.name]
+            opt_result_per_mode_obj_list.append(opt_result_per_mode_obj)
+        OptimizationResultPerMode.objects.bulk_create(opt_result_per_mode_obj_list)
+
+        previous_pk_list = []
+        opt_result_per_route_obj_list = []
+        for opt_result_per_route_obj in OptimizationResultPerRoute.objects.select_related('route').filter(
+                transport_network=source_transport_network_obj):
+            previous_pk_list.append(opt_result_per_route_obj.pk)
+            opt_result_per_route_obj.pk = None
+            opt_result_per_route_obj.transport_network = transport_network_obj
+            opt_result_per_route_obj.route_id = route_id_dict[opt_result_per_route_obj.route.name]
+            opt_result_per_route_obj_list.append(opt_result_per_route_obj)
+        opt_route_id_dict = {previous_pk: opt_result_per_route_obj.pk for previous_pk, opt_result_per_route_obj in
+                             zip(previous_pk_list,
+                                 OptimizationResultPerRoute.objects.bulk_create(opt_result_per_route_obj_list))}
+
+        detail_obj_list = []
+        for detail_obj in OptimizationResultPerRouteDetail.objects.filter(
+                opt_route__transport_network=source_transport_network_obj):
+            detail_obj.pk = None
+            detail_obj.opt_route_id = opt_route_id_dict[detail_obj.opt_route_id]
+            detail_obj_list.append(detail_obj)
+        _insert_route_details(detail_obj_list)
+
+
+def save_optimization_checkpoint(transport_network_obj, input_fingerprint, iteration_number, frequencies,
+                                 better_result, job_id=None):
+    """
+    Save state reached by optimization after an iteration, it replaces the previous checkpoint of transport network.
+
+    :param frequencies: dict route name -> frequency given to optimizer in the next iteration
+    :param better_result: tuple (fopt, success, status, message, constr_violation, fun) or None
+    :param job_id: checkpoint is saved only while transport network is processing this job, it is not checked if it
+    is None
+    :return: False if transport network is not processing the job anymore (cancelled or enqueued again by
+    rqworkers.reaper), nothing is saved
+    """
+    if better_result is not None:
+        fopt, success, status, message, constr_violation, fun = better_result
+        better_result = [[float(x) for x in fopt], bool(success), int(status), str(message), float(constr_violation),
+                         float(fun)]
+    values = dict(input_fingerprint=input_fingerprint, saved_at=timezone.now(), iteration_number=iteration_number,
+                  frequencies={str(route_id): float(frequency) for route_id, frequency in frequencies.items()},
+                  better_result=better_result)
+    with transaction.atomic():
+        # row is locked, so a cancellation waits for the checkpoint and then deletes it
+        if job_id is not None and not TransportNetwork.objects.select_for_update().filter(
+                pk=transport_network_obj.pk, job_id=job_id,
+                optimization_status=TransportNetwork.STATUS_PROCESSING).exists():
+            return False
+        if OptimizationCheckpoint.objects.filter(transport_network=transport_network_obj).update(**values) == 0:
+            OptimizationCheckpoint.objects.create(transport_network=transport_network_obj, **values)
+
+    return True
+
+
+def get_optimization_checkpoint(transport_network_obj, input_fingerprint):
+    """
+    :return: checkpoint saved by an optimization with the same inputs or None
+    """
+    return OptimizationCheckpoint.objects.filter(transport_network=transport_network_obj,
+                                                 input_fingerprint=input_fingerprint).first()
+
+
+def delete_optimization_checkpoints(transport_network_id_list):
+    OptimizationCheckpoint.objects.filter(transport_network_id__in=transport_network_id_list).delete()
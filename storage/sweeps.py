@@ -0,0 +1,134 @@
+import copy
+import itertools
+
+from django.utils import timezone
+
+from storage.models import ParameterSweep, ParameterSweepResult
+from storage.results import PASSENGER_FIELDS, TRANSPORT_MODE_FIELDS
+
+SWEEP_PASSENGER_FIELDS = PASSENGER_FIELDS
+# name identifies the transport mode, it can not be overridden
+SWEEP_TRANSPORT_MODE_FIELDS = [field_name for field_name in TRANSPORT_MODE_FIELDS if field_name != 'name']
+SWEEP_RESULT_FIELDS = ['vrc', 'co', 'ci', 'cu', 'tv', 'tw', 'ta', 't']
+
+
+def get_sweep_points(parameters):
+    """
+    Build the list of overrides that defines each point of a parameter sweep.
+
+    Overrides have the shape {'passenger': {field: value}, 'transport_modes': {transport mode name: {field: value}}}.
+    A grid has the same shape with a list of values for each field and its points are the cartesian product of
+    those lists.
+
+    :param parameters: dict with key 'grid' or key 'points'
+    :return: list of overrides
+    """
+    if 'points' in parameters:
+        return parameters['points']
+
+    grid = parameters['grid']
+    axes = [(('passenger', field_name), values) for field_name, values in grid.get('passenger', {}).items()]
+    for transport_mode_name, transport_mode_grid in grid.get('transport_modes', {}).items():
+        axes += [(('transport_modes', transport_mode_name, field_name), values) for field_name, values in
+                 transport_mode_grid.items()]
+
+    point_list = []
+    for values in itertools.product(*[axis_values for _, axis_values in axes]):
+        overrides = dict()
+        for (path, _), value in zip(axes, values):
+            section = overrides
+            for key in path[:-1]:
+                section = section.setdefault(key, dict())
+            section[path[-1]] = value
+        point_list.append(overrides)
+
+    return point_list
+
+
+def flatten_overrides(overrides):
+    """
+    :return: dict 'passenger.<field>' or 'transport_modes.<transport mode name>.<field>' -> value
+    """
+    flat_overrides = {'passenger.{0}'.format(field_name): value for field_name, value in
+                      overrides.get('passenger', {}).items()}
+    for transport_mode_name, transport_mode_overrides in overrides.get('transport_modes', {}).items():
+        for field_name, value in transport_mode_overrides.items():
+            flat_overrides['transport_modes.{0}.{1}'.format(transport_mode_name, field_name)] = value
+
+    return flat_overrides
+
+
+def apply_overrides(passenger_obj, transport_mode_obj_list, overrides):
+    """
+    Copy passenger and transport modes with values of overrides, given objects are not modified.
+
+    :return: passenger copy, list of transport mode copies
+    """
+    passenger_obj = copy.copy(passenger_obj)
+    for field_name, value in overrides.get('passenger', {}).items():
+        setattr(passenger_obj, field_name, value)
+
+    transport_mode_overrides = overrides.get('transport_modes', {})
+    transport_mode_obj_copy_list = []
+    for transport_mode_obj in transport_mode_obj_list:
+        transport_mode_obj = copy.copy(transport_mode_obj)
+        for field_name, value in transport_mode_overrides.get(transport_mode_obj.name, {}).items():
+            setattr(transport_mode_obj, field_name, value)
+        transport_mode_obj_copy_list.append(transport_mode_obj)
+
+    return passenger_obj, transport_mode_obj_copy_list
+
+
+def get_sweep_result_table(parameter_sweep_result_obj_list):
+    """
+    Compact representation of sweep results: one row per point with its overrides and optimization results.
+
+    :return: dict with column names and rows
+    """
+    override_columns = []
+    rows = []
+    for result_obj in parameter_sweep_result_obj_list:
+        flat_overrides = flatten_overrides(result_obj.overrides)
+        for column in flat_overrides.keys():
+            if column not in override_columns:
+                override_columns.append(column)
+        rows.append((result_obj.point, flat_overrides, result_obj))
+
+    columns = ['point'] + override_columns + SWEEP_RESULT_FIELDS + ['error_message']
+    table_rows = []
+    for point, flat_overrides, result_obj in rows:
+        table_rows.append([point] + [flat_overrides.get(column) for column in override_columns] +
+                          [getattr(result_obj, field_name) for field_name in SWEEP_RESULT_FIELDS] +
+                          [result_obj.error_message])
+
+    return dict(columns=columns, rows=table_rows)
+
+
+def save_sweep_results(parameter_sweep_obj, result_obj_list):
+    """
+    Save results of a chunk of points. Points that already have a result keep it.
+    """
+    ParameterSweepResult.objects.bulk_create(result_obj_list, ignore_conflicts=True)
+
+    # last chunk that ends marks the sweep as finished, unless another chunk failed
+    if ParameterSweepResult.objects.filter(parameter_sweep=parameter_sweep_obj).count() == \
+            parameter_sweep_obj.point_number:
+        ParameterSweep.objects.filter(pk=parameter_sweep_obj.pk, status__in=[
+            ParameterSweep.STATUS_QUEUED, ParameterSweep.STATUS_PROCESSING]).update(
+            status=ParameterSweep.STATUS_FINISHED, duration=timezone.now() - parameter_sweep_obj.ran_at)
+
+
+def fail_sweep_chunk(parameter_sweep_obj, point_list, error_message):
+    """
+    Move sweep to error when a chunk fails as a whole (graph or demand can not be built, job times out, its worker
+    dies or it can not be enqueued). Points of the chunk get a result with the error, results of other chunks are
+    kept.
+
+    :param point_list: list of (point index, overrides) of the chunk
+    """
+    ParameterSweep.objects.filter(pk=parameter_sweep_obj.pk, status__in=[
+        ParameterSweep.STATUS_QUEUED, ParameterSweep.STATUS_PROCESSING]).update(
+        status=ParameterSweep.STATUS_ERROR, error_message=error_message)
+    save_sweep_results(parameter_sweep_obj, [
+        ParameterSweepResult(parameter_sweep=parameter_sweep_obj, point=point, overrides=overrides,
+                             error_message=error_message) for point, overrides in point_list])
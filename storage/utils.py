@@ -0,0 +1,167 @@
+from itertools import chain
+
+import numpy as np
+from sidermit.city import Graph
+from sidermit.city.graph import CBD, Periphery, Subcenter
+from sidermit.exceptions import SIDERMITException, DemandMatrixIsNotValidException, VijIsNotValidException
+
+from storage.cache import sidermit_cache, get_graph_fingerprint
+
+
+def get_network_descriptor(graph_obj):
+    """
+
+    :param graph_obj: sidermite.city.Graph object
+    :return: dict with nodes and edges
+    """
+    nodes = []
+    for node_obj in graph_obj.get_nodes():
+        node_type = None
+        if isinstance(node_obj, CBD):
+            node_type = 'cbd'
+        elif isinstance(node_obj, Periphery):
+            node_type = 'periphery'
+        elif isinstance(node_obj, Subcenter):
+            node_type = 'subcenter'
+
+        # graphs read from pajek content have numpy values, cast them to be stored as json
+        node_descriptor = dict(name=str(node_obj.name), id=int(node_obj.id), x=float(node_obj.x), y=float(node_obj.y),
+                               type=node_type)
+        nodes.append(node_descriptor)
+
+    edges = []
+    for edge_obj in graph_obj.get_edges():
+        edge_descriptor = dict(id=int(edge_obj.id), source=int(edge_obj.node1.id), target=int(edge_obj.node2.id))
+        edges.append(edge_descriptor)
+
+    return dict(nodes=nodes, edges=edges)
+
+
+def get_demand_matrix_header(graph_obj):
+    """
+
+    :param graph_obj: sidermit.city.Graph object
+    :return: list with node names in the same order that rows and columns of demand matrix
+    """
+    return [str(node_obj.name) for node_obj in graph_obj.get_nodes()]
+
+
+def round_demand_matrix(matrix, decimals=2):
+    """
+    Same values than python round(value, decimals) of each cell, it was used before. Python rounds the exact binary
+    value and halfway values to even (0.125 -> 0.12, 2.675 -> 2.67), scaled cells are rounded by numpy and only
+    cells whose scaled value is exactly halfway are rounded by python.
+    """
+    scale = 10 ** decimals
+    scaled_matrix = matrix * scale
+    rounded_matrix = np.rint(scaled_matrix) / scale
+    # a scaled value that is not halfway is on the same side of it than the exact product
+    halfway = scaled_matrix - np.floor(scaled_matrix) == 0.5
+    if halfway.any():
+        rounded_matrix[halfway] = [round(value, decimals) for value in matrix[halfway].tolist()]
+
+    return rounded_matrix
+
+
+def get_demand_matrix_array(demand_obj, graph_obj, decimals=2):
+    """
+
+    :param demand_obj: sidermit.city.Demand object
+    :param graph_obj: sidermit.city.Graph object used to build demand_obj
+    :param decimals: number of decimals kept in each cell
+    :return: numpy array with rows and columns in the same order that graph nodes
+    """
+    node_position = {node_obj.id: position for position, node_obj in enumerate(graph_obj.get_nodes())}
+    matrix = np.zeros((len(node_position), len(node_position)))
+    # demand rows are sparse, only cells with trips are stored
+    for origin_node_id, row in demand_obj.get_matrix().items():
+        if not row:
+            continue
+        destinations = np.fromiter((node_position[node_id] for node_id in row.keys()), dtype=np.intp, count=len(row))
+        matrix[node_position[origin_node_id], destinations] = np.fromiter(row.values(), dtype=np.float64,
+                                                                          count=len(row))
+
+    return round_demand_matrix(matrix, decimals)
+
+
+def read_demand_matrix_csv(content, graph_obj, decimals=2):
+    """
+    Parse demand matrix in csv format, first row and first column are node names and they are ignored
+
+    :param content: csv content
+    :param graph_obj: sidermit.city.Graph object, its number of nodes defines expected matrix shape
+    :param decimals: number of decimals kept in each cell
+    :return: numpy array
+    """
+    size = len(graph_obj.get_nodes())
+    rows = [line.split(',')[1:] for line in content.strip().splitlines()[1:]]
+    # same validations and messages than sidermit.city.Demand.build_from_content
+    if len(rows) != size:
+        raise DemandMatrixIsNotValidException('Matrix should have rows equal to number of nodes')
+    if any(len(row) != size for row in rows):
+        raise DemandMatrixIsNotValidException('Matrix should have columns equal to number of nodes')
+
+    matrix = np.array(list(chain.from_iterable(rows)), dtype=np.float64).reshape((size, size))
+    if (matrix < 0).any():
+        raise VijIsNotValidException('cell value should be >= 0')
+
+    return round_demand_matrix(matrix, decimals)
+
+
+def read_demand_matrix_csv_file(file_obj, graph_obj, decimals=2):
+    """
+    Parse demand matrix in csv format line by line, so only one row of text is kept in memory. First row and first
+    column are node names and they are ignored. It fails on the first row with wrong number of cells.
+
+    :param file_obj: binary file-like object that yields lines, e.g. django UploadedFile
+    :param graph_obj: sidermit.city.Graph object, its number of nodes defines expected matrix shape
+    :param decimals: number of decimals kept in each cell
+    :return: numpy array
+    """
+    size = len(graph_obj.get_nodes())
+    matrix = np.empty((size, size))
+
+    row_index = -1
+    for line in file_obj:
+        line = line.decode('utf-8-sig' if row_index == -1 else 'utf-8').strip()
+        if not line:
+            continue
+        # first line is the header
+        if row_index >= 0:
+            if row_index == size:
+                raise DemandMatrixIsNotValidException('Matrix should have rows equal to number of nodes')
+            cells = line.split(',')[1:]
+            if len(cells) != size:
+                raise DemandMatrixIsNotValidException('Matrix should have columns equal to number of nodes')
+            matrix[row_index] = cells
+            if (matrix[row_index] < 0).any():
+                raise VijIsNotValidException('cell value should be >= 0')
+        row_index += 1
+
+    if row_index != size:
+        raise DemandMatrixIsNotValidException('Matrix should have rows equal to number of nodes')
+
+    return round_demand_matrix(matrix, decimals)
+
+
+def build_city_graph(graph_content, n, l, g, p, etha, etha_zone, angles, gi, hi):
+    """
+    :return: sidermit.city.Graph object based on parameters or graph content if parameters are not valid
+    """
+    try:
+        graph_obj = Graph.build_from_parameters(n, l, g, p, etha, etha_zone, angles, gi, hi)
+    except (SIDERMITException, TypeError):
+        graph_obj = sidermit_cache.get_graph(graph_content)
+
+    return graph_obj
+
+
+def get_city_graph_data(graph_content, n, l, g, p, etha, etha_zone, angles, gi, hi):
+    """
+    :return: dict with graph fingerprint, network descriptor and demand matrix header of a city
+    """
+    graph_obj = build_city_graph(graph_content, n, l, g, p, etha, etha_zone, angles, gi, hi)
+
+    return dict(graph_fingerprint=get_graph_fingerprint(graph_content),
+                network_descriptor=get_network_descriptor(graph_obj),
+                demand_matrix_header=get_demand_matrix_header(graph_obj))
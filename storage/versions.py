@@ -0,0 +1,39 @@
+from django.db import connection
+from django.utils import timezone
+
+from storage.models import City, Scene, TransportNetwork
+
+# one statement with data-modifying CTEs, so a change costs one query whatever the number of bumped tables
+BUMP_VERSIONS_SQL = '''
+WITH transport_network AS (
+    UPDATE {transport_network_table} SET version = version + 1, updated_at = %(now)s
+    WHERE id = ANY(%(transport_network_ids)s) OR scene_id = ANY(%(transport_network_scene_ids)s) RETURNING scene_id
+), scene AS (
+    UPDATE {scene_table} SET version = version + 1, updated_at = %(now)s
+    WHERE id = ANY(%(scene_ids)s) OR id IN (SELECT scene_id FROM transport_network) RETURNING city_id
+)
+UPDATE {city_table} SET version = version + 1, updated_at = %(now)s
+WHERE id = ANY(%(city_ids)s) OR id IN (SELECT city_id FROM scene)
+'''.format(transport_network_table=TransportNetwork._meta.db_table, scene_table=Scene._meta.db_table,
+           city_table=City._meta.db_table)
+
+
+def bump_versions(city_id_list=(), scene_id_list=(), transport_network_id_list=(), transport_network_scene_id_list=()):
+    """
+    Increase version and updated_at of objects whose api payload changed and of the objects that include them in
+    their payload: scene and city of a transport network and city of a scene. It has to be called after the change
+    is saved, so a client never keeps old data with a new version.
+
+    Data shared by many objects needs all of them in the call: transport modes are part of routes of every transport
+    network of the scene and a city is part of its scenes.
+
+    :param transport_network_scene_id_list: ids of scenes whose transport networks are bumped
+    """
+    if not (city_id_list or scene_id_list or transport_network_id_list or transport_network_scene_id_list):
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(BUMP_VERSIONS_SQL, dict(now=timezone.now(), city_ids=list(city_id_list),
+                                               scene_ids=list(scene_id_list),
+                                               transport_network_ids=list(transport_network_id_list),
+                                               transport_network_scene_ids=list(transport_network_scene_id_list)))
@@ -1,7 +1,8 @@
 """
 ASGI config for webapp project.
 
-It exposes the ASGI callable as a module-level variable named ``application``.
+It exposes the ASGI callable as a module-level variable named ``application``. Streams of optimization events are
+served outside django, every other request goes to django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -13,4 +14,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'webapp.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# django has to be set up before importing modules that use settings
+from api.events import EVENT_STREAM_PATH, optimization_event_stream  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and EVENT_STREAM_PATH.match(scope['path']):
+        await optimization_event_stream(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -169,6 +169,65 @@ LOGGING = {
 
 OPTIMIZER_QUEUE_NAME = 'optimizer'
 
+# solver budgets accepted by run_optimization. deadline is in seconds, when it is reached the best result found so far
+# is saved. It is checked between iterations, so rq timeout of a job with deadline adds OPTIMIZER_DEADLINE_MARGIN
+OPTIMIZER_SOLVER_PROFILES = {
+    'preview': dict(tolerance=0.05, max_number_of_iteration=2, deadline=60),
+    'standard': dict(tolerance=0.01, max_number_of_iteration=5, deadline=None),
+    'precise': dict(tolerance=0.001, max_number_of_iteration=20, deadline=None),
+}
+OPTIMIZER_DEFAULT_SOLVER_PROFILE = 'standard'
+OPTIMIZER_JOB_TIMEOUT = config('OPTIMIZER_JOB_TIMEOUT', default=60 * 60 * 24 * 3, cast=int)
+OPTIMIZER_DEADLINE_MARGIN = config('OPTIMIZER_DEADLINE_MARGIN', default=60 * 30, cast=int)
+
+# optimizations are routed to a lane by predicted cost (see rqworkers.cost), so cheap networks are not blocked by huge
+# ones. Every lane is a queue with its own workers and job timeout, the first lane that accepts the cost is used.
+# Predicted cost is saved in transport network to tune max_cost against optimization_duration
+OPTIMIZER_FAST_QUEUE_NAME = 'optimizer_fast'
+OPTIMIZER_QUEUE_LANES = [
+    dict(name='fast', queue=OPTIMIZER_FAST_QUEUE_NAME,
+         max_cost=config('OPTIMIZER_FAST_LANE_MAX_COST', default=50000, cast=float),
+         job_timeout=config('OPTIMIZER_FAST_LANE_JOB_TIMEOUT', default=60 * 60 * 2, cast=int)),
+    dict(name='heavy', queue=OPTIMIZER_QUEUE_NAME, max_cost=None, job_timeout=OPTIMIZER_JOB_TIMEOUT),
+]
+
+# run_optimizer_pool command, number of workers follows queue depth. Max workers is number of cores if it is 0
+OPTIMIZER_POOL_MIN_WORKERS = config('OPTIMIZER_POOL_MIN_WORKERS', default=1, cast=int)
+OPTIMIZER_POOL_MAX_WORKERS = config('OPTIMIZER_POOL_MAX_WORKERS', default=0, cast=int)
+OPTIMIZER_POOL_CHECK_INTERVAL = config('OPTIMIZER_POOL_CHECK_INTERVAL', default=5, cast=float)
+OPTIMIZER_POOL_DRAIN_TIMEOUT = config('OPTIMIZER_POOL_DRAIN_TIMEOUT', default=None,
+                                      cast=lambda value: None if value is None else float(value))
+
+# running optimizations refresh a heartbeat in redis every OPTIMIZATION_HEARTBEAT_INTERVAL seconds, it expires after
+# OPTIMIZATION_HEARTBEAT_TTL seconds. reap_optimizations command enqueues again networks whose heartbeat expired, up to
+# OPTIMIZATION_REAPER_MAX_RETRIES times, and then moves them to error
+OPTIMIZATION_HEARTBEAT_INTERVAL = config('OPTIMIZATION_HEARTBEAT_INTERVAL', default=30, cast=float)
+OPTIMIZATION_HEARTBEAT_TTL = config('OPTIMIZATION_HEARTBEAT_TTL', default=120, cast=int)
+OPTIMIZATION_REAPER_MAX_RETRIES = config('OPTIMIZATION_REAPER_MAX_RETRIES', default=1, cast=int)
+OPTIMIZATION_REAPER_INTERVAL = config('OPTIMIZATION_REAPER_INTERVAL', default=60, cast=float)
+
+# optimization route details are inserted with postgresql COPY when they have more rows than this value
+OPTIMIZATION_RESULT_COPY_THRESHOLD = config('OPTIMIZATION_RESULT_COPY_THRESHOLD', default=5000, cast=int)
+# layout of arc loads of each route: 'rows' saves one OptimizationResultPerRouteDetail row per arc, 'columnar' packs
+# them in a binary column of OptimizationResultPerRoute. Results saved with both layouts are read by the api, compare
+# them with benchmark_arc_storage command
+OPTIMIZATION_RESULT_ARC_STORAGE = config('OPTIMIZATION_RESULT_ARC_STORAGE', default='rows')
+
+# seconds a group of optimizations submitted together is kept in redis
+OPTIMIZATION_GROUP_TTL = config('OPTIMIZATION_GROUP_TTL', default=60 * 60 * 24 * 7, cast=int)
+
+# progress events of running optimizations are kept in redis, only the last events are kept
+OPTIMIZATION_PROGRESS_TTL = config('OPTIMIZATION_PROGRESS_TTL', default=60 * 60 * 24, cast=int)
+OPTIMIZATION_PROGRESS_MAX_EVENTS = config('OPTIMIZATION_PROGRESS_MAX_EVENTS', default=500, cast=int)
+
+# server-sent event streams, seconds between keepalive comments and events kept for a slow client
+OPTIMIZATION_EVENT_KEEPALIVE = config('OPTIMIZATION_EVENT_KEEPALIVE', default=15, cast=int)
+OPTIMIZATION_EVENT_QUEUE_SIZE = config('OPTIMIZATION_EVENT_QUEUE_SIZE', default=100, cast=int)
+
+# parameter sweeps are split in jobs of this number of points, every job runs its points sequentially
+PARAMETER_SWEEP_CHUNK_SIZE = config('PARAMETER_SWEEP_CHUNK_SIZE', default=5, cast=int)
+PARAMETER_SWEEP_MAX_POINTS = config('PARAMETER_SWEEP_MAX_POINTS', default=200, cast=int)
+
 RQ_QUEUES = {
     'default': {
         'USE_REDIS_CACHE': 'default'
@@ -179,6 +238,10 @@ RQ_QUEUES[OPTIMIZER_QUEUE_NAME] = {
     'USE_REDIS_CACHE': 'default',
 }
 
+RQ_QUEUES[OPTIMIZER_FAST_QUEUE_NAME] = {
+    'USE_REDIS_CACHE': 'default',
+}
+
 # Add link for django-rq queues to admin panel
 RQ_SHOW_ADMIN_LINK = True
 
@@ -195,6 +258,10 @@ CACHES = {
     }
 }
 
+# parsed sidermit graph and demand objects are cached in process (LRU) and in the redis cache defined above
+SIDERMIT_CACHE_LOCAL_MAX_SIZE = config('SIDERMIT_CACHE_LOCAL_MAX_SIZE', default=32, cast=int)
+SIDERMIT_CACHE_TIMEOUT = config('SIDERMIT_CACHE_TIMEOUT', default=60 * 60 * 24, cast=int)
+
 if TESTING:
     from django_redis.pool import ConnectionFactory
 